@@ -0,0 +1,1114 @@
+"""
+Async serving mode: the API of main.py on Starlette, served by uvicorn.
+
+    cd app
+    uvicorn asgi_app:app --port 5000      # or: python asgi_app.py
+
+The routes and payloads match the Flask app, plus a WebSocket voice session
+(/ws/voice-session) that only this mode serves. Request handling is async, so an
+open connection waiting on a slow voice turn costs a coroutine, not a thread.
+CPU-heavy work (NLP, response generation) runs on a bounded inference pool,
+recognition of uploaded and streamed audio on a bounded recognition pool and
+microphone work on a separate small audio pool, so none can starve the
+event loop or the others. Speech output is queued to the TTS worker and its
+future awaited. Blocking session store and archive reads are
+moved off the loop as well.
+"""
+import asyncio
+import functools
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from dotenv import load_dotenv
+import speech_recognition as sr
+load_dotenv()
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.sessions import SessionMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse as StarletteJSONResponse, StreamingResponse
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocket, WebSocketDisconnect
+from speech_to_text import speech_to_text, recognize, transcribe_audio, test_microphone, calibrated_microphone, UPLOAD_MAX_BYTES
+from text_to_speech import text_to_speech, speak, synthesize, get_available_voices, tts_worker, PRIORITY_INTERACTIVE
+from nlp_pipeline import process_text, process_texts, public_result, nlp_processor
+from sentiment import sentiment_analyzer
+from therapy_responses import generate_advanced_therapy_response, generate_hybrid_therapy_response, stream_hybrid_therapy_response
+from session_manager import session_manager
+from stt_backends import stt_stats
+from voice_listener import voice_listener
+from voice_stream import AudioRingBuffer, UtteranceDetector, load_vad, STREAM_MAX_UTTERANCE_SECONDS, STREAM_PREROLL_SECONDS
+from model_registry import model_registry
+from hybrid_response_generator import hybrid_generator, StreamCorrection
+from sharding import SHARD_KEY_HEADER, INTERNAL_TOKEN_HEADER, internal_request_allowed
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Threads for NLP and generation; torch releases the GIL, so this bounds CPU work in flight
+ASGI_INFERENCE_WORKERS = int(os.getenv('ASGI_INFERENCE_WORKERS', str(os.cpu_count() or 4)))
+
+# Threads for the microphone; speech output runs on the TTS worker thread
+ASGI_AUDIO_WORKERS = int(os.getenv('ASGI_AUDIO_WORKERS', '2'))
+
+# Threads for decoding and recognizing uploaded or WebSocket audio; kept apart from the
+# microphone, whose jobs hold a thread for as long as someone is speaking
+ASGI_RECOGNITION_WORKERS = int(os.getenv('ASGI_RECOGNITION_WORKERS', str(os.cpu_count() or 4)))
+
+# WebSocket voice sessions: default client sample rate, how often a partial transcript
+# of the utterance in progress is sent (0 turns them off), and the size of the
+# binary frames synthesized audio is sent back in
+WS_SAMPLE_RATE = int(os.getenv('WS_SAMPLE_RATE', '16000'))
+WS_PARTIAL_INTERVAL_SECONDS = float(os.getenv('WS_PARTIAL_INTERVAL_SECONDS', '1.0'))
+WS_AUDIO_CHUNK_BYTES = int(os.getenv('WS_AUDIO_CHUNK_BYTES', '32768'))
+
+MODEL_LOADING = os.getenv('MODEL_LOADING', 'background')
+BATCH_MAX_TEXTS = int(os.getenv('BATCH_MAX_TEXTS', '1000'))
+HOST = os.getenv('HOST', '127.0.0.1')
+PORT = int(os.getenv('PORT', '5000'))
+
+SECRET_KEY = os.getenv('SECRET_KEY')
+if not SECRET_KEY:
+    logger.warning("SECRET_KEY is not set; session cookies will not survive a restart")
+    SECRET_KEY = secrets.token_hex(32)
+
+class OffloadPool:
+    """Bounded thread pool that coroutines await, with in-flight counters for /metrics"""
+    
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = max(1, workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.busy_seconds = 0.0
+    
+    async def run(self, fn, *args, **kwargs):
+        """Run a blocking call on the pool and await its result"""
+        with self._lock:
+            self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, functools.partial(self._timed, fn, *args, **kwargs)
+            )
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+    
+    def _timed(self, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.busy_seconds += elapsed
+    
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+    
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'in_flight': self.pending,
+            'queued': max(0, self.pending - self.workers),
+            'completed': self.completed,
+            'busy_seconds': round(self.busy_seconds, 3)
+        }
+
+inference_pool = OffloadPool('inference', ASGI_INFERENCE_WORKERS)
+audio_pool = OffloadPool('audio', ASGI_AUDIO_WORKERS)
+recognition_pool = OffloadPool('recognition', ASGI_RECOGNITION_WORKERS)
+
+# Free a session's generation KV cache as soon as the session ends
+session_manager.on_session_end(hybrid_generator.release_session)
+session_manager.on_session_end(voice_listener.release_session)
+
+def _json_default(value):
+    # Same as Flask's jsonify: datetimes become HTTP dates
+    if isinstance(value, datetime):
+        value = value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+        return format_datetime(value, usegmt=True)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class JSONResponse(StarletteJSONResponse):
+    def render(self, content) -> bytes:
+        return json.dumps(content, default=_json_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def error(message: str, status: int, **extra) -> JSONResponse:
+    return JSONResponse({'success': False, **extra, 'error': message}, status_code=status)
+
+async def read_json(request: Request) -> dict:
+    """Request body as a dict; empty for missing or malformed JSON"""
+    try:
+        data = await request.json()
+    except (ValueError, UnicodeDecodeError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def audio_mimetype(request: Request):
+    """MIME type of a request that carries audio (raw body or multipart), else None"""
+    mimetype = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    if mimetype.startswith('audio/') or mimetype in ('application/octet-stream', 'multipart/form-data'):
+        return mimetype
+    return None
+
+async def transcribe_request_audio(request: Request, form=None) -> dict:
+    """
+    Transcribe the audio sent with a request while it is still uploading.
+    
+    Body chunks are queued to transcribe_audio on the recognition pool as they
+    arrive, so decoding overlaps the upload. Uploads don't touch the microphone
+    or speaker, so they don't wait behind the audio pool.
+    """
+    sample_rate = request.query_params.get('sample_rate')
+    sample_rate = int(sample_rate) if sample_rate and sample_rate.isdigit() else None
+    
+    if form is not None:
+        upload = form.get('audio')
+        if not hasattr(upload, 'file'):
+            return {'success': False, 'text': '', 'error': 'No "audio" file in the form'}
+        return await recognition_pool.run(transcribe_audio, upload.file, upload.content_type, sample_rate)
+    
+    chunks = queue.Queue()
+    transcription = asyncio.ensure_future(recognition_pool.run(
+        transcribe_audio, iter(chunks.get, None), request.headers.get('content-type'), sample_rate
+    ))
+    received = 0
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                chunks.put(chunk)
+                received += len(chunk)
+            # Stop receiving once the decoder has given up (bad or oversized audio)
+            if transcription.done() or received > UPLOAD_MAX_BYTES:
+                break
+    finally:
+        chunks.put(None)
+    return await transcription
+
+async def get_session(session_id: str):
+    # A session store lookup may hit SQLite, so keep it off the event loop
+    if session_manager.store is None:
+        return session_manager.get_session(session_id)
+    return await asyncio.to_thread(session_manager.get_session, session_id)
+
+@asynccontextmanager
+async def lifespan(app):
+    # Model loading: 'background' warms models on a thread, 'eager' blocks startup, 'lazy' loads on first use
+    if MODEL_LOADING == 'eager':
+        await asyncio.to_thread(model_registry.warm_up)
+    elif MODEL_LOADING == 'background':
+        model_registry.warm_up_async()
+    yield
+    inference_pool.shutdown()
+    audio_pool.shutdown()
+    recognition_pool.shutdown()
+    voice_listener.shutdown()
+    calibrated_microphone.stop()
+    tts_worker.shutdown()
+
+async def home(request: Request):
+    return JSONResponse({"message": "Advanced AI Speech Therapist backend is running!"})
+
+async def healthz(request: Request):
+    """Liveness probe - the process is up and serving requests"""
+    return JSONResponse({'status': 'ok'})
+
+async def readyz(request: Request):
+    """Readiness probe - all models have finished loading and warming up"""
+    status = model_registry.status()
+    return JSONResponse(status, status_code=200 if status['ready'] else 503)
+
+async def metrics(request: Request):
+    """Runtime metrics for the inference stack"""
+    return JSONResponse({
+        'sentiment_batcher': sentiment_analyzer.batcher.stats() if sentiment_analyzer.batcher else None,
+        'sentiment_cache': sentiment_analyzer.cache.stats(),
+        'nlp_cache': nlp_processor.cache.stats(),
+        'generation_kv_cache': hybrid_generator.kv_cache.stats(),
+        'generation_scheduler': hybrid_generator.scheduler.stats() if hybrid_generator.scheduler else None,
+        'session_store': session_manager.store_stats(),
+        'sessions': session_manager.session_stats(),
+        'speech_to_text': stt_stats(),
+        'microphone': calibrated_microphone.stats(),
+        'voice_listener': voice_listener.stats(),
+        'voice_sockets': VoiceSocket.stats(),
+        'text_to_speech': tts_worker.stats(),
+        'executors': {
+            'inference': inference_pool.stats(),
+            'audio': audio_pool.stats(),
+            'recognition': recognition_pool.stats()
+        }
+    })
+
+# Session Management Endpoints
+
+async def start_therapy_session(request: Request):
+    """Start a new therapy session"""
+    try:
+        # Behind the dispatcher, the session id carries the shard key it routed this request on
+        session_id = session_manager.create_session(request.headers.get(SHARD_KEY_HEADER))
+        request.session['current_session_id'] = session_id
+        
+        # Generate welcome message
+        welcome_message = "Hello! I'm your AI therapy assistant. I'm here to provide support and listen without judgment. How are you feeling today?"
+        
+        # Speak welcome message
+        tts_result = await asyncio.wrap_future(speak(welcome_message))
+        
+        return JSONResponse({
+            'success': True,
+            'session_id': session_id,
+            'welcome_message': welcome_message,
+            'speech_success': tts_result['success']
+        })
+    
+    except Exception as e:
+        logger.error(f"Error starting therapy session: {e}")
+        return error(str(e), 500)
+
+async def continue_session(request: Request):
+    """Continue an existing therapy session with speech input/output"""
+    try:
+        data = await read_json(request)
+        session_id = data.get('session_id') or request.session.get('current_session_id')
+        timeout = data.get('timeout', 10)
+        phrase_time_limit = data.get('phrase_time_limit', 15)
+        
+        if not session_id:
+            return error('No active session. Please start a session first.', 400)
+        
+        therapy_session = await get_session(session_id)
+        if not therapy_session:
+            return error('Session not found. Please start a new session.', 404)
+        
+        logger.info(f"Continuing session {session_id}...")
+        
+        # Step 1: Listen to user (or take what they said while the session was listening)
+        stt_result = await audio_pool.run(voice_listener.capture_utterance, session_id, timeout=timeout, phrase_time_limit=phrase_time_limit)
+        if not stt_result['success']:
+            return JSONResponse({
+                'success': False,
+                'step': 'speech-to-text',
+                'error': stt_result['error']
+            })
+        
+        user_input = stt_result['text']
+        logger.info(f"User said: {user_input}")
+        
+        # Steps 2-4: NLP, session context and response generation
+        nlp_result = await inference_pool.run(process_text, user_input)
+        context = therapy_session.get_conversation_context()
+        ai_response = await inference_pool.run(generate_hybrid_therapy_response, nlp_result, context)
+        
+        # Step 5: Add to session history
+        therapy_session.add_exchange(user_input, nlp_result, ai_response)
+        
+        # Step 6: Speak the response
+        tts_result = await asyncio.wrap_future(speak(ai_response, PRIORITY_INTERACTIVE))
+        
+        return JSONResponse({
+            'success': True,
+            'session_id': session_id,
+            'user_input': user_input,
+            'ai_response': ai_response,
+            'sentiment': nlp_result['sentiment']['sentiment'],
+            'topic': nlp_result['topic_category'],
+            'message_count': therapy_session.message_count,
+            'speech_success': tts_result['success'],
+            'session_context': {
+                'dominant_sentiment': therapy_session.session_context['dominant_sentiment'],
+                'main_topics': therapy_session.session_context['main_topics'],
+                'crisis_indicators': therapy_session.session_context['crisis_indicators']
+            }
+        })
+    
+    except Exception as e:
+        logger.error(f"Error continuing session: {e}")
+        return error(str(e), 500, step='session')
+
+async def end_therapy_session(request: Request):
+    """End a therapy session and get summary"""
+    session_id = request.path_params['session_id']
+    try:
+        # Ending may write the session to the cold archive
+        summary = await asyncio.to_thread(session_manager.end_session, session_id)
+        if summary:
+            return JSONResponse({
+                'success': True,
+                'session_id': session_id,
+                'session_summary': summary
+            })
+        return error('Session not found', 404)
+    
+    except Exception as e:
+        logger.error(f"Error ending session: {e}")
+        return error(str(e), 500)
+
+async def get_session_status(request: Request):
+    """Get current session status"""
+    try:
+        therapy_session = await get_session(request.path_params['session_id'])
+        if not therapy_session:
+            return error('Session not found', 404)
+        
+        return JSONResponse({
+            'success': True,
+            'session_status': therapy_session.get_conversation_context()
+        })
+    
+    except Exception as e:
+        logger.error(f"Error getting session status: {e}")
+        return error(str(e), 500)
+
+# Text-based endpoints for testing
+
+async def text_therapy(request: Request):
+    """Text-based therapy interaction"""
+    try:
+        data = await read_json(request)
+        if 'text' not in data:
+            return error('No text provided', 400)
+        
+        user_input = data['text']
+        session_id = data.get('session_id')
+        
+        if not session_id:
+            return error('Session ID required. Please start a session first.', 400)
+        
+        therapy_session = await get_session(session_id)
+        if not therapy_session:
+            return error(f'Session {session_id} not found. Please start a new session.', 404)
+        
+        # Process input and generate the response off the event loop
+        nlp_result = await inference_pool.run(process_text, user_input)
+        context = therapy_session.get_conversation_context()
+        was_first_message = context.get('is_first_message')
+        previous_message_count = context.get('message_count')
+        ai_response = await inference_pool.run(generate_advanced_therapy_response, nlp_result, context)
+        
+        # Add to session BEFORE returning response
+        therapy_session.add_exchange(user_input, nlp_result, ai_response)
+        
+        return JSONResponse({
+            'success': True,
+            'session_id': session_id,
+            'user_input': user_input,
+            'ai_response': ai_response,
+            'nlp_analysis': public_result(nlp_result),
+            'message_count': therapy_session.message_count,
+            'session_context': therapy_session.session_context,
+            'debug_info': {
+                'was_first_message': was_first_message,
+                'previous_message_count': previous_message_count
+            }
+        })
+    
+    except Exception as e:
+        logger.error(f"Error in text therapy: {e}")
+        return error(str(e), 500)
+
+def _sse_event(event: str, payload: dict) -> str:
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(payload, default=_json_default)}\n\n"
+
+_END = object()
+
+class PooledTokenStream:
+    """
+    A response generator driven to completion by one inference pool job.
+    
+    The job runs the whole generation on a pool thread and hands each chunk to
+    the event loop through an asyncio.Queue, so a token costs a queue put, not
+    a pool round trip. Iterate it with `async for`; the generator's return
+    value (the final response) is in `response` afterwards. stop() sets the
+    generator's cancel event, which also halts the model mid-generation.
+    """
+    
+    def __init__(self, stream_fn, *args):
+        self.stopped = threading.Event()
+        self._generator = stream_fn(*args, cancel=self.stopped)
+        self._queue = asyncio.Queue()
+        self._job = None
+        self.response = None
+    
+    def _drive(self, loop):
+        try:
+            while not self.stopped.is_set():
+                try:
+                    chunk = next(self._generator)
+                except StopIteration as done:
+                    return done.value
+                loop.call_soon_threadsafe(self._queue.put_nowait, chunk)
+        finally:
+            self._generator.close()
+            try:
+                loop.call_soon_threadsafe(self._queue.put_nowait, _END)
+            except RuntimeError:
+                # The loop has already shut down
+                pass
+    
+    def __aiter__(self):
+        if self._job is None:
+            self._job = asyncio.ensure_future(inference_pool.run(self._drive, asyncio.get_running_loop()))
+        return self
+    
+    async def __anext__(self):
+        chunk = await self._queue.get()
+        if chunk is _END:
+            self.response = await self._job
+            raise StopAsyncIteration
+        return chunk
+    
+    def stop(self):
+        """Stop generating; the pool job ends after the current decode step"""
+        self.stopped.set()
+        if self._job is not None:
+            # Nobody awaits the job any more, so retrieve its outcome here
+            self._job.add_done_callback(lambda job: job.cancelled() or job.exception())
+
+async def text_therapy_stream(request: Request):
+    """Text-based therapy interaction streamed token by token as Server-Sent Events"""
+    try:
+        data = await read_json(request)
+        if 'text' not in data:
+            return error('No text provided', 400)
+        
+        user_input = data['text']
+        session_id = data.get('session_id')
+        
+        if not session_id:
+            return error('Session ID required. Please start a session first.', 400)
+        
+        therapy_session = await get_session(session_id)
+        if not therapy_session:
+            return error(f'Session {session_id} not found. Please start a new session.', 404)
+        
+        # Analyze up front so input errors still come back as plain JSON
+        nlp_result = await inference_pool.run(process_text, user_input)
+        context = therapy_session.get_conversation_context()
+    
+    except Exception as e:
+        logger.error(f"Error in streaming text therapy: {e}")
+        return error(str(e), 500)
+    
+    async def event_stream():
+        started = time.perf_counter()
+        first_token_at = None
+        token_stream = PooledTokenStream(stream_hybrid_therapy_response, nlp_result, context)
+        try:
+            # Generation runs as one job on the inference pool; the loop only relays tokens
+            async for value in token_stream:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                if isinstance(value, StreamCorrection):
+                    # Replaces the text streamed so far
+                    yield _sse_event('correction', {'text': str(value)})
+                else:
+                    yield _sse_event('token', {'text': value})
+            ai_response = token_stream.response
+            
+            therapy_session.add_exchange(user_input, nlp_result, ai_response)
+            
+            yield _sse_event('done', {
+                'success': True,
+                'session_id': session_id,
+                'user_input': user_input,
+                'ai_response': ai_response,
+                'nlp_analysis': public_result(nlp_result),
+                'message_count': therapy_session.message_count,
+                'session_context': therapy_session.session_context,
+                'timing': {
+                    'time_to_first_token_ms': (first_token_at - started) * 1000 if first_token_at else None,
+                    'total_ms': (time.perf_counter() - started) * 1000
+                }
+            })
+        
+        except Exception as e:
+            logger.error(f"Error while streaming therapy response: {e}")
+            yield _sse_event('error', {
+                'success': False,
+                'error': str(e)
+            })
+        finally:
+            # Client went away mid-stream: stop generating on its behalf
+            token_stream.stop()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+async def batch_text_analysis(request: Request):
+    """Analyze a list of texts in one call; results come back in input order"""
+    try:
+        data = await read_json(request)
+        texts = data.get('texts')
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            return error('Provide "texts" as a list of strings', 400)
+        
+        if len(texts) > BATCH_MAX_TEXTS:
+            return error(f'At most {BATCH_MAX_TEXTS} texts per request', 413)
+        
+        started = time.perf_counter()
+        results = await inference_pool.run(process_texts, texts)
+        elapsed = time.perf_counter() - started
+        
+        return JSONResponse({
+            'success': True,
+            'count': len(results),
+            'results': [public_result(result) for result in results],
+            'total_ms': round(elapsed * 1000, 1)
+        })
+    
+    except Exception as e:
+        logger.error(f"Error in batch text analysis: {e}")
+        return error(str(e), 500)
+
+# Legacy endpoints (keep for compatibility)
+
+async def test_mic(request: Request):
+    return JSONResponse(await audio_pool.run(test_microphone))
+
+async def stt_endpoint(request: Request):
+    try:
+        data = await read_json(request)
+        timeout = data.get('timeout', 5)
+        phrase_time_limit = data.get('phrase_time_limit', 10)
+        
+        result = await audio_pool.run(speech_to_text, timeout=timeout, phrase_time_limit=phrase_time_limit)
+        return JSONResponse(result)
+    
+    except Exception as e:
+        return error(str(e), 500, text='')
+
+async def stt_upload_endpoint(request: Request):
+    """Transcribe audio recorded by the client: a raw (optionally chunked) body or a multipart 'audio' file"""
+    try:
+        mimetype = audio_mimetype(request)
+        if mimetype is None:
+            return error('No audio provided. Send an audio/* body or a multipart "audio" file.', 400, text='')
+        
+        form = await request.form() if mimetype == 'multipart/form-data' else None
+        return JSONResponse(await transcribe_request_audio(request, form))
+    
+    except Exception as e:
+        return error(str(e), 500, text='')
+
+async def tts_endpoint(request: Request):
+    try:
+        data = await read_json(request)
+        if 'text' not in data:
+            return error('No text provided in request body', 400)
+        
+        # With "async" the text is only queued, so answer straight away
+        if data.get('async', False):
+            return JSONResponse(text_to_speech(data['text'], async_mode=True))
+        return JSONResponse(await asyncio.wrap_future(speak(data['text'])))
+    
+    except Exception as e:
+        return error(str(e), 500)
+
+async def voices_endpoint(request: Request):
+    return JSONResponse(await asyncio.to_thread(get_available_voices))
+
+async def complete_voice_therapy(request: Request):
+    """Complete voice-to-voice therapy session with full context"""
+    try:
+        # Audio recorded by the client replaces the server microphone
+        upload = audio_mimetype(request)
+        form = await request.form() if upload == 'multipart/form-data' else None
+        if upload:
+            data = {**request.query_params, **{key: value for key, value in (form or {}).items() if isinstance(value, str)}}
+        else:
+            data = await read_json(request)
+        session_id = data.get('session_id')
+        timeout = data.get('timeout', 12)
+        phrase_time_limit = data.get('phrase_time_limit', 20)
+        
+        if not session_id:
+            return error('Session ID required. Please start a session first.', 400)
+        
+        therapy_session = await get_session(session_id)
+        if not therapy_session:
+            return error('Session not found. Please start a new session.', 404)
+        
+        logger.info(f"Starting complete voice therapy for session {session_id}")
+        
+        # Step 1: Listen with encouraging prompts (uploads were already recorded by the client,
+        # and a listening session is heard whenever the user speaks)
+        if therapy_session.message_count == 0:
+            # First message - give more time and encouragement
+            prompt_message = "I'm listening. Please share what's on your mind."
+            timeout = 15
+            phrase_time_limit = 25
+        else:
+            # Continuing conversation
+            prompt_message = "I'm here to listen."
+        if not upload and not voice_listener.is_listening(session_id):
+            await asyncio.wrap_future(speak(prompt_message, PRIORITY_INTERACTIVE))
+        
+        # Step 2: Capture speech with extended timeouts
+        if upload:
+            stt_result = await transcribe_request_audio(request, form)
+        else:
+            stt_result = await audio_pool.run(voice_listener.capture_utterance, session_id, timeout=timeout, phrase_time_limit=phrase_time_limit)
+        if not stt_result['success']:
+            # Gentle error handling
+            error_response = "I didn't catch that. Would you like to try again? Take your time."
+            await asyncio.wrap_future(speak(error_response, PRIORITY_INTERACTIVE))
+            return JSONResponse({
+                'success': False,
+                'step': 'speech-to-text',
+                'error': stt_result['error'],
+                'gentle_error': error_response
+            })
+        
+        user_input = stt_result['text']
+        logger.info(f"User said: {user_input}")
+        
+        # Steps 3-4: Full NLP pipeline and contextual response
+        nlp_result = await inference_pool.run(process_text, user_input)
+        context = therapy_session.get_conversation_context()
+        ai_response = await inference_pool.run(generate_advanced_therapy_response, nlp_result, context)
+        
+        # Step 5: Add to session history
+        therapy_session.add_exchange(user_input, nlp_result, ai_response)
+        
+        # Step 6: Speak response with proper pacing
+        tts_result = await asyncio.wrap_future(speak(ai_response, PRIORITY_INTERACTIVE))
+        
+        # Step 7: Return comprehensive session data
+        return JSONResponse({
+            'success': True,
+            'session_id': session_id,
+            'conversation_exchange': {
+                'user_input': user_input,
+                'ai_response': ai_response,
+                'sentiment': nlp_result['sentiment']['sentiment'],
+                'confidence': nlp_result['sentiment']['confidence'],
+                'topic': nlp_result['topic_category'],
+                'message_count': therapy_session.message_count
+            },
+            'session_context': {
+                'dominant_sentiment': therapy_session.session_context['dominant_sentiment'],
+                'main_topics': therapy_session.session_context['main_topics'],
+                'session_duration': str(datetime.now() - therapy_session.start_time),
+                'progress_indicators': therapy_session.session_context.get('progress_notes', [])
+            },
+            'speech_success': tts_result['success']
+        })
+    
+    except Exception as e:
+        logger.error(f"Error in complete voice therapy: {e}")
+        # Gentle error response even for system errors
+        error_message = "I'm experiencing some technical difficulties. Let's try again in a moment."
+        await asyncio.wrap_future(speak(error_message))
+        return error(str(e), 500, step='system')
+
+async def start_listening(request: Request):
+    """Keep the microphone open for a session; what the user says is queued for its voice turns"""
+    try:
+        data = await read_json(request)
+        session_id = data.get('session_id') or request.session.get('current_session_id')
+        if not session_id or not await get_session(session_id):
+            return error('Session not found. Please start a new session.', 404)
+        
+        # Opening the device may wait for a turn that is still listening
+        previous = await audio_pool.run(voice_listener.start, session_id)
+        return JSONResponse({
+            'success': True,
+            'session_id': session_id,
+            'listening': True,
+            'previous_session_id': previous
+        })
+    
+    except Exception as e:
+        logger.error(f"Error starting background listening: {e}")
+        return error(str(e), 500)
+
+async def stop_listening(request: Request):
+    """Close the microphone; utterances already queued stay available to the session"""
+    try:
+        data = await read_json(request)
+        session_id = data.get('session_id') or request.session.get('current_session_id')
+        stopped = await audio_pool.run(voice_listener.stop, session_id)
+        return JSONResponse({
+            'success': True,
+            'session_id': session_id,
+            'listening': False,
+            'was_listening': stopped,
+            'pending_utterances': voice_listener.pending(session_id) if session_id else 0
+        })
+    
+    except Exception as e:
+        logger.error(f"Error stopping background listening: {e}")
+        return error(str(e), 500)
+
+# Full-duplex voice session over a WebSocket
+
+class VoiceSocket:
+    """
+    One therapy session carried over a single WebSocket.
+    
+    The client streams 16-bit mono PCM up as binary frames. They are written
+    into a ring buffer allocated once for the connection, and an utterance
+    detector walks it 30 ms at a time; only a finished utterance is copied out
+    for recognition. Partial transcripts, the streamed response text and the
+    synthesized WAV come back on the same socket. Speech that starts while a
+    response is still being generated or sent cancels it (barge-in).
+    """
+    
+    connections = 0
+    active = 0
+    turns = 0
+    barge_ins = 0
+    
+    def __init__(self, websocket: WebSocket, session_id: str, therapy_session, sample_rate: int):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.therapy_session = therapy_session
+        self.sample_rate = sample_rate
+        frame_bytes = UtteranceDetector.frame_bytes_for(sample_rate)
+        # Room for the longest utterance plus its pre-roll and a little slack
+        capacity = int((STREAM_MAX_UTTERANCE_SECONDS + STREAM_PREROLL_SECONDS + 2) * sample_rate * 2)
+        self.ring = AudioRingBuffer(capacity, frame_bytes)
+        self.detector = UtteranceDetector(self.ring, sample_rate, vad=load_vad())
+        self._send_lock = asyncio.Lock()
+        self._turn = None
+        self._stream = None
+        self._partial = None
+        self._last_partial_at = 0.0
+    
+    @classmethod
+    def stats(cls) -> dict:
+        return {
+            'connections': cls.connections,
+            'active': cls.active,
+            'turns': cls.turns,
+            'barge_ins': cls.barge_ins
+        }
+    
+    async def send(self, message: dict):
+        async with self._send_lock:
+            await self.websocket.send_text(json.dumps(message, default=_json_default))
+    
+    async def send_audio(self, audio: bytes):
+        """Send a WAV as binary frames between 'audio' and 'audio_end' messages"""
+        view = memoryview(audio)
+        await self.send({'type': 'audio', 'format': 'wav', 'bytes': len(audio)})
+        for offset in range(0, len(view), WS_AUDIO_CHUNK_BYTES):
+            async with self._send_lock:
+                await self.websocket.send_bytes(view[offset:offset + WS_AUDIO_CHUNK_BYTES])
+        await self.send({'type': 'audio_end'})
+    
+    async def run(self):
+        VoiceSocket.connections += 1
+        VoiceSocket.active += 1
+        try:
+            await self.send({
+                'type': 'session',
+                'session_id': self.session_id,
+                'sample_rate': self.sample_rate,
+                'format': 's16le',
+                'vad': 'webrtcvad' if self.detector.vad is not None else 'energy'
+            })
+            while True:
+                message = await self.websocket.receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                if message.get('bytes') is not None:
+                    await self.on_audio(message['bytes'])
+                elif message.get('text') is not None:
+                    if not await self.on_control(message['text']):
+                        break
+        except WebSocketDisconnect:
+            pass
+        finally:
+            VoiceSocket.active -= 1
+            self.cancel_turn()
+            if self._partial is not None:
+                self._partial.cancel()
+    
+    async def on_audio(self, chunk: bytes):
+        self.ring.write(chunk)
+        for event in self.detector.feed():
+            if event[0] == 'speech_start':
+                self._last_partial_at = time.monotonic()
+                await self.barge_in()
+            else:
+                self.start_turn(audio=self.ring.copy(event[1], event[2]))
+        self.maybe_send_partial()
+    
+    async def on_control(self, text: str) -> bool:
+        """Handle a JSON control message; False ends the connection"""
+        try:
+            message = json.loads(text)
+        except ValueError:
+            message = None
+        kind = message.get('type') if isinstance(message, dict) else None
+        
+        if kind == 'end_turn':
+            # Push-to-talk release: don't wait for the pause
+            span = self.detector.end_utterance()
+            if span:
+                self.start_turn(audio=self.ring.copy(*span))
+        elif kind == 'text':
+            if not str(message.get('text', '')).strip():
+                await self.send({'type': 'error', 'error': 'No text provided'})
+            else:
+                await self.barge_in()
+                self.start_turn(text=str(message['text']))
+        elif kind == 'interrupt':
+            await self.barge_in()
+        elif kind == 'end_session':
+            await self.barge_in()
+            summary = await asyncio.to_thread(session_manager.end_session, self.session_id)
+            await self.send({'type': 'session_ended', 'session_id': self.session_id, 'session_summary': summary})
+            await self.websocket.close()
+            return False
+        else:
+            await self.send({'type': 'error', 'error': f"Unknown message type: {kind}"})
+        return True
+    
+    async def barge_in(self):
+        """Cancel the response in progress, if any"""
+        if self.cancel_turn():
+            VoiceSocket.barge_ins += 1
+            await self.send({'type': 'barge_in'})
+    
+    def cancel_turn(self) -> bool:
+        """Stop the model generating for the current turn and cancel it; False if none was running"""
+        if self._stream is not None:
+            self._stream.stop()
+        if self._turn is None or self._turn.done():
+            return False
+        self._turn.cancel()
+        return True
+    
+    def start_turn(self, audio: bytes = None, text: str = None):
+        self.cancel_turn()
+        self._turn = asyncio.ensure_future(self.respond(audio, text))
+    
+    def maybe_send_partial(self):
+        """Transcribe the utterance so far, at most once per interval and one at a time"""
+        if WS_PARTIAL_INTERVAL_SECONDS <= 0 or not self.detector.speaking:
+            return
+        if self._partial is not None and not self._partial.done():
+            return
+        now = time.monotonic()
+        if now - self._last_partial_at < WS_PARTIAL_INTERVAL_SECONDS:
+            return
+        self._last_partial_at = now
+        audio = self.ring.copy(self.detector.speech_start, self.detector.position)
+        self._partial = asyncio.ensure_future(self.send_partial(audio))
+    
+    async def send_partial(self, audio: bytes):
+        try:
+            result = await recognition_pool.run(recognize, sr.AudioData(audio, self.sample_rate, 2))
+            # Drop it if the utterance has ended meanwhile; the final transcript supersedes it
+            if result['success'] and self.detector.speaking:
+                await self.send({'type': 'transcript', 'final': False, 'text': result['text']})
+        except Exception as e:
+            logger.debug(f"Partial transcript failed: {e}")
+    
+    async def respond(self, audio: bytes = None, text: str = None):
+        """One turn: transcribe, stream the response text, then send it as speech"""
+        try:
+            if audio is not None:
+                result = await recognition_pool.run(recognize, sr.AudioData(audio, self.sample_rate, 2))
+                if not result['success']:
+                    await self.send({'type': 'transcript', 'final': True, 'success': False, 'error': result['error']})
+                    return
+                user_input = result['text']
+                await self.send({
+                    'type': 'transcript',
+                    'final': True,
+                    'success': True,
+                    'text': user_input,
+                    'latency_ms': result.get('latency_ms')
+                })
+            else:
+                user_input = text
+            VoiceSocket.turns += 1
+            
+            nlp_result = await inference_pool.run(process_text, user_input)
+            context = self.therapy_session.get_conversation_context()
+            token_stream = self._stream = PooledTokenStream(stream_hybrid_therapy_response, nlp_result, context)
+            try:
+                async for value in token_stream:
+                    if isinstance(value, StreamCorrection):
+                        await self.send({'type': 'response_correction', 'text': str(value)})
+                    else:
+                        await self.send({'type': 'response_delta', 'text': value})
+            finally:
+                token_stream.stop()
+            ai_response = token_stream.response
+            
+            self.therapy_session.add_exchange(user_input, nlp_result, ai_response)
+            await self.send({
+                'type': 'response',
+                'user_input': user_input,
+                'ai_response': ai_response,
+                'nlp_analysis': public_result(nlp_result),
+                'message_count': self.therapy_session.message_count
+            })
+            
+            # Cancelling the turn (barge-in) also drops the job if it hasn't started
+            speech = await asyncio.wrap_future(synthesize(ai_response, PRIORITY_INTERACTIVE))
+            if speech['success']:
+                await self.send_audio(speech['audio'])
+            else:
+                await self.send({'type': 'audio_error', 'error': speech['error']})
+        
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in voice session turn: {e}")
+            try:
+                await self.send({'type': 'error', 'error': str(e)})
+            except Exception:
+                pass
+
+async def voice_session_socket(websocket: WebSocket):
+    """Full-duplex voice session; see VoiceSocket for the protocol"""
+    await websocket.accept()
+    params = websocket.query_params
+    sample_rate = params.get('sample_rate', str(WS_SAMPLE_RATE))
+    if not sample_rate.isdigit() or not 8000 <= int(sample_rate) <= 48000:
+        await websocket.send_text(json.dumps({'type': 'error', 'error': 'sample_rate must be between 8000 and 48000'}))
+        await websocket.close(code=1003)
+        return
+    
+    session_id = params.get('session_id')
+    if session_id:
+        therapy_session = await get_session(session_id)
+        if not therapy_session:
+            await websocket.send_text(json.dumps({'type': 'error', 'error': f'Session {session_id} not found. Please start a new session.'}))
+            await websocket.close(code=1008)
+            return
+    else:
+        session_id = session_manager.create_session(websocket.headers.get(SHARD_KEY_HEADER))
+        therapy_session = await get_session(session_id)
+    
+    await VoiceSocket(websocket, session_id, therapy_session, int(sample_rate)).run()
+
+async def get_session_summary(request: Request):
+    """Get a comprehensive session summary"""
+    session_id = request.path_params['session_id']
+    try:
+        # Ended sessions are served from the archive, which may read from disk
+        therapy_session = await get_session(session_id) or await asyncio.to_thread(session_manager.get_archived_session, session_id)
+        if not therapy_session:
+            return error('Session not found', 404)
+        
+        summary = therapy_session.generate_session_summary()
+        
+        # Add therapeutic insights
+        insights = []
+        if summary['total_exchanges'] >= 3:
+            insights.append("Client engaged in meaningful conversation")
+        
+        if summary['dominant_sentiment'] == 'negative':
+            insights.append("Client expressed distress - follow-up recommended")
+        elif summary['dominant_sentiment'] == 'positive':
+            insights.append("Client showed positive emotional indicators")
+        
+        if 'work_stress' in summary['main_topics']:
+            insights.append("Work-related stress identified as primary concern")
+        
+        summary['therapeutic_insights'] = insights
+        
+        return JSONResponse({
+            'success': True,
+            'session_summary': summary
+        })
+    
+    except Exception as e:
+        logger.error(f"Error getting session summary: {e}")
+        return error(str(e), 500)
+
+# Worker-to-worker session handoff, used by the dispatcher when the hash ring changes
+
+def _internal_allowed(request: Request) -> bool:
+    host = request.client.host if request.client is not None else None
+    return internal_request_allowed(host, request.headers.get(INTERNAL_TOKEN_HEADER))
+
+async def handoff_session(request: Request):
+    """Release an active session and return its record for another worker"""
+    if not _internal_allowed(request):
+        return error('Forbidden', 403)
+    
+    record = await asyncio.to_thread(session_manager.export_session, request.path_params['session_id'])
+    if record is None:
+        return error('Session not found', 404)
+    return JSONResponse({'success': True, 'session': record})
+
+async def adopt_session(request: Request):
+    """Take over an active session handed off by another worker"""
+    if not _internal_allowed(request):
+        return error('Forbidden', 403)
+    
+    record = (await read_json(request)).get('session')
+    if not isinstance(record, dict) or 'session_id' not in record:
+        return error('Session record required', 400)
+    
+    try:
+        therapy_session = session_manager.import_session(record)
+        return JSONResponse({'success': True, 'session_id': therapy_session.session_id})
+    except Exception as e:
+        logger.error(f"Error adopting session: {e}")
+        return error(str(e), 500)
+
+routes = [
+    Route('/', home),
+    Route('/healthz', healthz),
+    Route('/readyz', readyz),
+    Route('/metrics', metrics),
+    Route('/start-therapy-session', start_therapy_session, methods=['POST']),
+    Route('/continue-session', continue_session, methods=['POST']),
+    Route('/end-session/{session_id}', end_therapy_session),
+    Route('/session-status/{session_id}', get_session_status),
+    Route('/text-therapy', text_therapy, methods=['POST']),
+    Route('/text-therapy/stream', text_therapy_stream, methods=['POST']),
+    Route('/batch-text-analysis', batch_text_analysis, methods=['POST']),
+    Route('/test-microphone', test_mic),
+    Route('/speech-to-text', stt_endpoint, methods=['POST']),
+    Route('/speech-to-text/upload', stt_upload_endpoint, methods=['POST']),
+    Route('/text-to-speech', tts_endpoint, methods=['POST']),
+    Route('/voices', voices_endpoint),
+    Route('/complete-voice-therapy', complete_voice_therapy, methods=['POST']),
+    Route('/listening/start', start_listening, methods=['POST']),
+    Route('/listening/stop', stop_listening, methods=['POST']),
+    Route('/session-summary/{session_id}', get_session_summary),
+    WebSocketRoute('/ws/voice-session', voice_session_socket),
+    Route('/internal/sessions/{session_id}/handoff', handoff_session, methods=['POST']),
+    Route('/internal/sessions', adopt_session, methods=['POST'])
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+        Middleware(SessionMiddleware, secret_key=SECRET_KEY)
+    ],
+    lifespan=lifespan
+)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=HOST, port=PORT)
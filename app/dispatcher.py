@@ -0,0 +1,494 @@
+"""
+Front dispatcher for running the API on several worker processes.
+
+Starts worker processes (main.py, each on its own loopback port) and routes
+every request to the worker that owns its session on a consistent-hash ring:
+
+    python dispatcher.py --workers 4 --port 5000
+
+New session ids carry a shard key minted here ('<shard>_<uuid>'), so later
+requests for a session - by URL, JSON body, form, query string or the session
+cookie - reach the same worker with no shared state on the request path.
+When workers join or leave the ring, only sessions whose owner changed move:
+each is handed off from its previous owner on its next request.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import posixpath
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+from sharding import SESSION_COOKIE, SHARD_KEY_HEADER, INTERNAL_TOKEN_HEADER, HashRing, new_shard_key, shard_key_of
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DISPATCHER_HOST = os.getenv('DISPATCHER_HOST', '127.0.0.1')
+DISPATCHER_PORT = int(os.getenv('DISPATCHER_PORT', '5000'))
+DISPATCHER_WORKERS = int(os.getenv('DISPATCHER_WORKERS', str(os.cpu_count() or 1)))
+DISPATCHER_WORKER_BASE_PORT = int(os.getenv('DISPATCHER_WORKER_BASE_PORT', '5001'))
+
+# Voice endpoints listen and synthesize speech, so forwarded requests may take a while
+DISPATCHER_TIMEOUT_SECONDS = float(os.getenv('DISPATCHER_TIMEOUT_SECONDS', '300'))
+
+# Workers failing this many health checks in a row leave the ring until they recover
+DISPATCHER_HEALTH_INTERVAL_SECONDS = float(os.getenv('DISPATCHER_HEALTH_INTERVAL_SECONDS', '5'))
+DISPATCHER_MAX_FAILURES = int(os.getenv('DISPATCHER_MAX_FAILURES', '3'))
+
+# Bodies are buffered before they are forwarded, so none may be larger than the largest upload
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(25 * 1024 * 1024)))
+
+# Sent on /internal/ requests to workers; workers added by URL must be started with the same value
+INTERNAL_TOKEN = os.getenv('INTERNAL_TOKEN') or secrets.token_hex(32)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Routes whose last path segment is the session id
+SESSION_PATH_PREFIXES = ('/end-session/', '/session-status/', '/session-summary/')
+START_SESSION_PATH = '/start-therapy-session'
+ADMIN_PREFIX = '/_dispatcher/'
+INTERNAL_PREFIX = '/internal/'
+
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailers', 'transfer-encoding', 'upgrade'
+}
+
+class Worker:
+    """One app process behind the dispatcher"""
+    
+    def __init__(self, url: str, process: Optional[subprocess.Popen] = None):
+        parts = urlsplit(url)
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.process = process
+        self.healthy = False
+        self.failures = 0
+        self.requests = 0
+    
+    def connection(self, timeout: float = DISPATCHER_TIMEOUT_SECONDS) -> http.client.HTTPConnection:
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+    
+    def call(self, method: str, path: str, payload: Optional[dict] = None, timeout: float = 10):
+        """JSON request to the worker; returns (status, parsed body)"""
+        connection = self.connection(timeout)
+        try:
+            body = json.dumps(payload).encode('utf-8') if payload is not None else None
+            headers = {'Content-Type': 'application/json'} if body is not None else {}
+            headers[INTERNAL_TOKEN_HEADER] = INTERNAL_TOKEN
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            data = response.read()
+            try:
+                return response.status, json.loads(data) if data else {}
+            except ValueError:
+                return response.status, {}
+        finally:
+            connection.close()
+    
+    def stats(self) -> dict:
+        return {
+            'healthy': self.healthy,
+            'pid': self.process.pid if self.process else None,
+            'requests': self.requests,
+            'failed_health_checks': self.failures
+        }
+
+class Dispatcher:
+    """Consistent-hash routing of sessions to workers, with handoff when the ring changes"""
+    
+    def __init__(self):
+        self.workers: Dict[str, Worker] = {}
+        # Replaced, never mutated, so request threads can read it without a lock
+        self.ring = HashRing()
+        self.previous_ring: Optional[HashRing] = None
+        
+        self._lock = threading.Lock()
+        self._migration_lock = threading.Lock()
+        self._migrated = set()
+        self._next = 0
+        self._stopped = threading.Event()
+        
+        self.routed = 0
+        self.migrations = 0
+        self.migration_failures = 0
+    
+    # Membership
+    
+    @staticmethod
+    def _start_process(port: int) -> subprocess.Popen:
+        env = dict(os.environ, HOST='127.0.0.1', PORT=str(port), FLASK_DEBUG='0', INTERNAL_TOKEN=INTERNAL_TOKEN)
+        process = subprocess.Popen([sys.executable, 'main.py'], cwd=APP_DIR, env=env)
+        logger.info(f"Started worker pid {process.pid} on port {port}")
+        return process
+    
+    def spawn_worker(self, port: int) -> Worker:
+        """Start main.py on a loopback port; it joins the ring once healthy"""
+        return self.add_worker(f"http://127.0.0.1:{port}", self._start_process(port))
+    
+    def add_worker(self, url: str, process: Optional[subprocess.Popen] = None) -> Worker:
+        with self._lock:
+            worker = self.workers.get(url)
+            if worker is None:
+                worker = self.workers[url] = Worker(url, process)
+        return worker
+    
+    def remove_worker(self, url: str) -> bool:
+        """Take a worker out of rotation and stop it if the dispatcher started it"""
+        with self._lock:
+            worker = self.workers.pop(url, None)
+        if worker is None:
+            return False
+        self._update_ring(lambda ring: ring.remove(url))
+        if worker.process is not None:
+            worker.process.terminate()
+        return True
+    
+    def _update_ring(self, change: Callable[[HashRing], None]):
+        with self._lock:
+            ring = self.ring.copy()
+            change(ring)
+            if ring.nodes == self.ring.nodes:
+                return
+            self.previous_ring, self.ring = self.ring, ring
+            self._migrated.clear()
+        logger.info(f"Hash ring now has {len(ring)} workers: {ring.nodes}")
+    
+    def next_port(self) -> int:
+        used = {worker.port for worker in self.workers.values()}
+        port = DISPATCHER_WORKER_BASE_PORT
+        while port in used:
+            port += 1
+        return port
+    
+    # Health
+    
+    def check_health(self):
+        """Probe every worker, restart dead ones and keep the ring to the healthy set"""
+        for worker in list(self.workers.values()):
+            if worker.process is not None and worker.process.poll() is not None:
+                logger.warning(f"Worker {worker.url} exited with {worker.process.returncode}; restarting")
+                worker.process = self._start_process(worker.port)
+            
+            try:
+                status, _ = worker.call('GET', '/healthz', timeout=2)
+                healthy = status == 200
+            except OSError:
+                healthy = False
+            
+            if healthy:
+                worker.failures = 0
+                worker.healthy = True
+                if worker.url not in self.ring:
+                    self._update_ring(lambda ring: ring.add(worker.url))
+            else:
+                worker.failures += 1
+                if worker.failures >= DISPATCHER_MAX_FAILURES and worker.healthy:
+                    worker.healthy = False
+                    logger.warning(f"Worker {worker.url} failed {worker.failures} health checks; removing from ring")
+                    self._update_ring(lambda ring: ring.remove(worker.url))
+    
+    def wait_until_healthy(self, timeout: float = 120):
+        """Block until every worker has joined the ring (or the timeout passes)"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self.check_health()
+            if self.workers and all(worker.healthy for worker in self.workers.values()):
+                return True
+            time.sleep(0.5)
+        return False
+    
+    def _health_loop(self):
+        while not self._stopped.wait(DISPATCHER_HEALTH_INTERVAL_SECONDS):
+            try:
+                self.check_health()
+            except Exception as e:
+                logger.error(f"Health check failed: {e}")
+    
+    def start_health_checks(self):
+        threading.Thread(target=self._health_loop, name='dispatcher-health', daemon=True).start()
+    
+    def stop(self):
+        self._stopped.set()
+        for worker in self.workers.values():
+            if worker.process is not None:
+                worker.process.terminate()
+    
+    # Routing
+    
+    def session_id_of(self, path: str, query: str, headers, body: bytes) -> Optional[str]:
+        """Find the session a request belongs to, wherever the endpoint takes it from"""
+        for prefix in SESSION_PATH_PREFIXES:
+            if path.startswith(prefix):
+                return path[len(prefix):].split('/', 1)[0] or None
+        
+        session_id = parse_qs(query).get('session_id', [None])[0]
+        
+        content_type = headers.get('Content-Type', '')
+        if not session_id and body and 'application/json' in content_type:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                data = None
+            if isinstance(data, dict) and isinstance(data.get('session_id'), str):
+                session_id = data['session_id']
+        elif not session_id and body and 'application/x-www-form-urlencoded' in content_type:
+            session_id = parse_qs(body.decode('utf-8', 'replace')).get('session_id', [None])[0]
+        
+        if not session_id and headers.get('Cookie'):
+            morsel = SimpleCookie(headers.get('Cookie')).get(SESSION_COOKIE)
+            session_id = morsel.value if morsel else None
+        return session_id or None
+    
+    def worker_for(self, session_id: Optional[str], shard_key: Optional[str] = None) -> Optional[Worker]:
+        """The owning worker for a session (or shard key); requests without one are spread round-robin"""
+        ring = self.ring
+        key = shard_key or (shard_key_of(session_id) if session_id else None)
+        if key is not None:
+            url = ring.node_for(key)
+        else:
+            nodes = ring.nodes
+            if not nodes:
+                return None
+            with self._lock:
+                self._next += 1
+                url = nodes[self._next % len(nodes)]
+        return self.workers.get(url) if url else None
+    
+    def migrate(self, session_id: str, owner: Worker):
+        """Move a session from its owner on the previous ring, the first time it is seen after a change"""
+        previous = self.previous_ring
+        if previous is None or session_id in self._migrated:
+            return
+        old_url = previous.node_for(shard_key_of(session_id))
+        old = self.workers.get(old_url) if old_url else None
+        if old is None or old is owner:
+            return
+        
+        with self._migration_lock:
+            if session_id in self._migrated:
+                return
+            try:
+                status, data = old.call('POST', f"/internal/sessions/{session_id}/handoff")
+                if status == 200:
+                    status, _ = owner.call('POST', '/internal/sessions', {'session': data['session']})
+                    if status != 200:
+                        raise RuntimeError(f"{owner.url} refused the session ({status})")
+                    self.migrations += 1
+                    logger.info(f"Moved session {session_id} from {old.url} to {owner.url}")
+                self._migrated.add(session_id)
+            except Exception as e:
+                # The new owner may still rehydrate it from a shared session store
+                self.migration_failures += 1
+                logger.error(f"Could not move session {session_id} from {old.url}: {e}")
+    
+    def handle(self, handler: BaseHTTPRequestHandler):
+        parts = urlsplit(handler.path)
+        # Check the path the worker will route on, not the still-encoded one ('/%69nternal/...');
+        # urlsplit would read '//internal/...' as a host name, so split origin-form targets by hand
+        raw_path = handler.path.split('?', 1)[0] if handler.path.startswith('/') else parts.path
+        path = posixpath.normpath('/' + unquote(raw_path)).lstrip('/')
+        if ('/' + path + '/').startswith(INTERNAL_PREFIX):
+            return self._reply(handler, 403, {'success': False, 'error': 'Forbidden'})
+        if parts.path.startswith(ADMIN_PREFIX):
+            return self._admin(handler, parts.path)
+        
+        body = self._read_body(handler)
+        if body is None:
+            # The rest of the body is never read, so the connection can't be reused
+            handler.close_connection = True
+            return self._reply(handler, 413, {'success': False, 'error': f'Request body exceeds {UPLOAD_MAX_BYTES} bytes'})
+        headers = {
+            key: value for key, value in handler.headers.items()
+            if key.lower() not in HOP_BY_HOP_HEADERS and key.lower() != INTERNAL_TOKEN_HEADER.lower()
+        }
+        
+        session_id = shard_key = None
+        if parts.path == START_SESSION_PATH:
+            shard_key = new_shard_key()
+            headers[SHARD_KEY_HEADER] = shard_key
+        else:
+            session_id = self.session_id_of(parts.path, parts.query, handler.headers, body)
+        
+        worker = self.worker_for(session_id, shard_key)
+        if worker is None:
+            return self._reply(handler, 503, {'success': False, 'error': 'No healthy workers'})
+        if session_id:
+            self.migrate(session_id, worker)
+        
+        worker.requests += 1
+        self.routed += 1
+        self._proxy(handler, worker, body, headers, set_session_cookie=shard_key is not None)
+    
+    @staticmethod
+    def _read_body(handler: BaseHTTPRequestHandler) -> Optional[bytes]:
+        """
+        Request body, or None if it is larger than UPLOAD_MAX_BYTES; chunked
+        uploads are reassembled and sent on with a Content-Length
+        """
+        if 'chunked' not in handler.headers.get('Transfer-Encoding', '').lower():
+            length = int(handler.headers.get('Content-Length') or 0)
+            if length > UPLOAD_MAX_BYTES:
+                return None
+            return handler.rfile.read(length) if length else b''
+        
+        chunks = []
+        received = 0
+        while True:
+            size = int(handler.rfile.readline().split(b';', 1)[0].strip() or b'0', 16)
+            received += size
+            if received > UPLOAD_MAX_BYTES:
+                return None
+            if size == 0:
+                # Skip any trailers up to the blank line ending the body
+                while handler.rfile.readline() not in (b'\r\n', b'\n', b''):
+                    pass
+                return b''.join(chunks)
+            chunks.append(handler.rfile.read(size))
+            handler.rfile.readline()
+    
+    def _proxy(self, handler: BaseHTTPRequestHandler, worker: Worker, body: bytes, headers: dict,
+               set_session_cookie: bool = False):
+        connection = worker.connection()
+        try:
+            try:
+                connection.request(handler.command, handler.path, body or None, headers)
+                response = connection.getresponse()
+            except OSError as e:
+                logger.error(f"Worker {worker.url} unreachable: {e}")
+                return self._reply(handler, 502, {'success': False, 'error': 'Worker unavailable'})
+            
+            handler.send_response(response.status, response.reason)
+            for key, value in response.getheaders():
+                if key.lower() not in HOP_BY_HOP_HEADERS and key.lower() not in ('server', 'date'):
+                    handler.send_header(key, value)
+            
+            if set_session_cookie:
+                # Small JSON body: read it to pin cookie-based clients to the new session
+                data = response.read()
+                try:
+                    session_id = json.loads(data).get('session_id')
+                except (ValueError, AttributeError):
+                    session_id = None
+                if session_id:
+                    handler.send_header('Set-Cookie', f"{SESSION_COOKIE}={session_id}; Path=/; HttpOnly; SameSite=Lax")
+                handler.end_headers()
+                handler.wfile.write(data)
+                return
+            
+            handler.end_headers()
+            # Stream as it arrives so Server-Sent Events reach the client token by token
+            while True:
+                chunk = response.read1(65536)
+                if not chunk:
+                    break
+                handler.wfile.write(chunk)
+                handler.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info(f"Client disconnected during {handler.command} {handler.path}")
+        finally:
+            connection.close()
+    
+    def _admin(self, handler: BaseHTTPRequestHandler, path: str):
+        """Status and worker membership; only reachable from this machine"""
+        if handler.client_address[0] not in ('127.0.0.1', '::1'):
+            return self._reply(handler, 403, {'success': False, 'error': 'Forbidden'})
+        
+        if path == ADMIN_PREFIX + 'status' and handler.command == 'GET':
+            return self._reply(handler, 200, self.stats())
+        
+        if path == ADMIN_PREFIX + 'workers' and handler.command in ('POST', 'DELETE'):
+            length = int(handler.headers.get('Content-Length') or 0)
+            try:
+                data = json.loads(handler.rfile.read(length) or b'{}')
+            except ValueError:
+                data = {}
+            url = data.get('url') if isinstance(data, dict) else None
+            
+            if handler.command == 'POST':
+                # Without a url, start a new local worker
+                worker = self.add_worker(url) if url else self.spawn_worker(self.next_port())
+                return self._reply(handler, 200, {'success': True, 'worker': worker.url})
+            
+            if not url:
+                return self._reply(handler, 400, {'success': False, 'error': 'Worker url required'})
+            removed = self.remove_worker(url)
+            return self._reply(handler, 200 if removed else 404, {'success': removed, 'worker': url})
+        
+        return self._reply(handler, 404, {'success': False, 'error': 'Not found'})
+    
+    @staticmethod
+    def _reply(handler: BaseHTTPRequestHandler, status: int, payload: dict):
+        data = json.dumps(payload).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+    
+    def stats(self) -> dict:
+        return {
+            'workers': {url: worker.stats() for url, worker in self.workers.items()},
+            'ring': self.ring.nodes,
+            'previous_ring': self.previous_ring.nodes if self.previous_ring else None,
+            'requests_routed': self.routed,
+            'sessions_moved': self.migrations,
+            'session_move_failures': self.migration_failures
+        }
+
+class DispatchHandler(BaseHTTPRequestHandler):
+    dispatcher: Dispatcher = None
+    
+    def do_GET(self):
+        self.dispatcher.handle(self)
+    
+    do_POST = do_PUT = do_PATCH = do_DELETE = do_OPTIONS = do_HEAD = do_GET
+    
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Route sessions across several API worker processes")
+    parser.add_argument('--host', default=DISPATCHER_HOST, help="address to listen on")
+    parser.add_argument('--port', type=int, default=DISPATCHER_PORT, help="port to listen on")
+    parser.add_argument('-w', '--workers', type=int, default=DISPATCHER_WORKERS, help="worker processes to start")
+    parser.add_argument('--worker', action='append', default=[], metavar='URL',
+                        help="route to an already running worker instead of starting them (repeatable)")
+    args = parser.parse_args(argv)
+    
+    dispatcher = Dispatcher()
+    if args.worker:
+        for url in args.worker:
+            dispatcher.add_worker(url)
+    else:
+        for index in range(args.workers):
+            dispatcher.spawn_worker(DISPATCHER_WORKER_BASE_PORT + index)
+    
+    if not dispatcher.wait_until_healthy():
+        logger.warning("Not every worker is healthy yet; they join the ring as they come up")
+    dispatcher.start_health_checks()
+    
+    DispatchHandler.dispatcher = dispatcher
+    server = ThreadingHTTPServer((args.host, args.port), DispatchHandler)
+    logger.info(f"Dispatching on http://{args.host}:{args.port} to {len(dispatcher.workers)} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        dispatcher.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import re
+from dataclasses import dataclass, replace
+from typing import Dict, Optional, Tuple
+from lexicon import TOKEN_PATTERN, LexiconMatches, lexicon, normalize
+
+WHITESPACE = re.compile(r'\s+')
+
+@dataclass(frozen=True)
+class AnalyzedDocument:
+    """
+    One utterance, normalized and scanned once by process_text and shared
+    with every downstream consumer instead of re-cleaning the text.
+    """
+    original: str                 # text as received
+    normalized: str               # whitespace collapsed, case preserved
+    lowered: str                  # normalized, lowercased, apostrophes straightened
+    tokens: Tuple[str, ...]       # lowercase word tokens
+    matches: LexiconMatches       # lexicon hits for every category
+    
+    def has(self, category: str) -> bool:
+        """Check whether any keyword of a lexicon category occurs"""
+        return category in self.matches
+    
+    def with_original(self, text: str) -> 'AnalyzedDocument':
+        """Same analysis for a different raw form of the same text (e.g. a cache hit)"""
+        return self if text == self.original else replace(self, original=text)
+    
+    # Immutable, so copies of a result dict can share it
+    def __copy__(self):
+        return self
+    
+    def __deepcopy__(self, memo):
+        return self
+
+def analyze_document(text: str) -> AnalyzedDocument:
+    """Normalize, lowercase, tokenize and lexicon-scan text in one place"""
+    text = text or ''
+    normalized = WHITESPACE.sub(' ', text.strip())
+    lowered = normalize(normalized)
+    return AnalyzedDocument(
+        original=text,
+        normalized=normalized,
+        lowered=lowered,
+        tokens=tuple(TOKEN_PATTERN.findall(lowered)),
+        matches=lexicon.scan(lowered, normalized=True)
+    )
+
+def document_for(nlp_result: Dict, text: Optional[str] = None) -> AnalyzedDocument:
+    """The document process_text attached to a result, or a fresh one for hand-built results"""
+    document = nlp_result.get('document')
+    if document is None:
+        document = analyze_document(text if text is not None else nlp_result.get('original_text', ''))
+    return document
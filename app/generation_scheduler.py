@@ -0,0 +1,374 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def to_legacy_cache(past_key_values):
+    """Per-layer (key, value) tuples from either a transformers Cache or legacy tuples"""
+    if past_key_values is None:
+        return None
+    if hasattr(past_key_values, 'to_legacy_cache'):
+        return past_key_values.to_legacy_cache()
+    return tuple(past_key_values)
+
+def to_model_cache(legacy_cache):
+    """Wrap legacy tuples in the Cache object newer transformers models expect"""
+    if legacy_cache is None:
+        return None
+    try:
+        from transformers import DynamicCache
+    except ImportError:
+        return legacy_cache
+    return DynamicCache.from_legacy_cache(legacy_cache)
+
+class _Sequence:
+    """One request while it is in the running batch"""
+    
+    def __init__(self, request):
+        self.request = request
+        self.tokens: List[int] = request.input_ids[0].tolist()
+        self.generated = 0
+        self.cached = 0         # tokens held in this row's KV cache
+        self.next_token = None  # sampled but not yet fed to the model
+
+class GenerationRequest:
+    __slots__ = ('input_ids', 'past_key_values', 'max_new_tokens', 'streamer', 'cancel', 'future', 'enqueued_at')
+    
+    def __init__(self, input_ids, past_key_values, max_new_tokens: int, streamer, cancel=None):
+        self.input_ids = input_ids
+        self.past_key_values = past_key_values
+        self.max_new_tokens = max_new_tokens
+        self.streamer = streamer
+        self.cancel = cancel
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+class ContinuousBatchScheduler:
+    """
+    Continuous-batching decoder for a GPT-2 style causal LM.
+
+    Keeps a running batch of active sequences and decodes them in lockstep,
+    one token per step. New requests are prefilled and admitted between steps,
+    and finished sequences leave the batch immediately instead of waiting for
+    the longest one. Rows are left-padded in a shared KV cache with an
+    attention mask and explicit position ids.
+
+    Each request resolves to (sequences, past_key_values), matching what
+    model.generate(..., return_dict_in_generate=True) returns, so the
+    per-session KV cache works the same way on both paths.
+    """
+    
+    def __init__(self, model, eos_token_id: int, max_batch_size: int = 8, temperature: float = 0.7,
+                 repetition_penalty: float = 1.2, top_k: int = 50):
+        self.model = model
+        self.eos_token_id = eos_token_id
+        self.max_batch_size = max(1, max_batch_size)
+        self.temperature = temperature
+        self.repetition_penalty = repetition_penalty
+        self.top_k = top_k
+        self.n_positions = model.config.n_positions
+        
+        self._queue = queue.Queue()
+        self._active: List[_Sequence] = []
+        self._keys = None    # per layer: [batch, heads, time, head_dim]
+        self._values = None
+        self._mask = None    # [batch, time], 0 marks left padding
+        
+        self._stats_lock = threading.Lock()
+        self._steps = 0
+        self._step_rows = 0
+        self._tokens_generated = 0
+        self._requests_completed = 0
+        self._busy_seconds = 0.0
+        
+        self._worker = threading.Thread(target=self._run, name='generation-scheduler', daemon=True)
+        self._worker.start()
+    
+    def submit(self, input_ids, past_key_values=None, max_new_tokens: int = 100, streamer=None,
+               cancel: threading.Event = None) -> Future:
+        """
+        Queue a prompt for generation
+
+        Args:
+            input_ids: [1, length] prompt tokens
+            past_key_values: optional cache covering a prefix of input_ids
+            max_new_tokens: upper bound on generated tokens
+            streamer: optional transformers streamer fed as tokens are sampled
+            cancel: optional event; once set, the sequence leaves the batch at its next token
+
+        Returns:
+            Future resolving to (sequences, past_key_values)
+        """
+        request = GenerationRequest(input_ids, past_key_values, max_new_tokens, streamer, cancel)
+        self._queue.put(request)
+        return request.future
+    
+    def generate(self, input_ids, past_key_values=None, max_new_tokens: int = 100, streamer=None, cancel=None):
+        """Blocking form of submit()"""
+        return self.submit(input_ids, past_key_values, max_new_tokens, streamer, cancel).result()
+    
+    def _run(self):
+        import torch
+        
+        with torch.no_grad():
+            while True:
+                # Nothing may end this thread: every generate() would then wait forever
+                try:
+                    self._cycle()
+                except Exception as e:
+                    logger.error(f"Generation scheduler failed with {len(self._active)} sequences running: {e}")
+                    self._abort(e)
+    
+    def _cycle(self):
+        """Admit what fits into the batch, then decode one step"""
+        # Sleep on the queue only when there is nothing to decode
+        if not self._active:
+            self._admit(self._queue.get())
+        while len(self._active) < self.max_batch_size:
+            try:
+                self._admit(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        
+        if not self._active:
+            return
+        
+        started = time.perf_counter()
+        try:
+            self._step()
+        except Exception as e:
+            logger.error(f"Generation step failed for {len(self._active)} sequences: {e}")
+            self._abort(e)
+        with self._stats_lock:
+            self._busy_seconds += time.perf_counter() - started
+    
+    def _abort(self, error: Exception):
+        """Fail every running sequence and start over with an empty batch"""
+        for sequence in self._active:
+            self._fail(sequence, error)
+        self._active = []
+        self._keys = self._values = self._mask = None
+    
+    def _admit(self, request: GenerationRequest):
+        """Prefill a new request on its own and add it to the running batch"""
+        import torch
+        
+        sequence = _Sequence(request)
+        try:
+            legacy = to_legacy_cache(request.past_key_values)
+            prefix = legacy[0][0].shape[2] if legacy else 0
+            length = request.input_ids.shape[1]
+            
+            outputs = self.model(
+                input_ids=request.input_ids[:, prefix:],
+                past_key_values=to_model_cache(legacy),
+                attention_mask=torch.ones((1, length), dtype=torch.long),
+                position_ids=torch.arange(prefix, length).unsqueeze(0),
+                use_cache=True
+            )
+            cache = to_legacy_cache(outputs.past_key_values)
+            sequence.cached = length
+            request.max_new_tokens = min(request.max_new_tokens, self.n_positions - length)
+            
+            if request.streamer is not None:
+                request.streamer.put(request.input_ids[0])
+            
+            token = self._sample(outputs.logits[:, -1, :], [sequence])[0]
+            self._merge(cache)
+        except Exception as e:
+            logger.error(f"Prefill failed: {e}")
+            self._fail(sequence, e)
+            return
+        
+        self._active.append(sequence)
+        row = len(self._active) - 1
+        try:
+            self._emit(sequence, token)
+            if self._finished(sequence, token):
+                self._retire([row])
+        except Exception as e:
+            logger.error(f"Streaming the first token failed: {e}")
+            self._retire([row], {row: e})
+    
+    def _merge(self, cache):
+        """
+        Append a prefilled row to the batched cache, left-padding to a common length
+
+        The batch is only replaced once every tensor is built, so a failure leaves it intact.
+        """
+        import torch
+        import torch.nn.functional as F
+        
+        keys = [key for key, _ in cache]
+        values = [value for _, value in cache]
+        length = keys[0].shape[2]
+        mask = torch.ones((1, length), dtype=torch.long)
+        
+        if self._mask is None:
+            self._keys, self._values, self._mask = keys, values, mask
+            return
+        
+        width = max(self._mask.shape[1], length)
+        grow = width - self._mask.shape[1]
+        pad = width - length
+        
+        merged_keys = [torch.cat([F.pad(old, (0, 0, grow, 0)), F.pad(new, (0, 0, pad, 0))]) for old, new in zip(self._keys, keys)]
+        merged_values = [torch.cat([F.pad(old, (0, 0, grow, 0)), F.pad(new, (0, 0, pad, 0))]) for old, new in zip(self._values, values)]
+        merged_mask = torch.cat([F.pad(self._mask, (grow, 0)), F.pad(mask, (pad, 0))])
+        self._keys, self._values, self._mask = merged_keys, merged_values, merged_mask
+    
+    def _step(self):
+        """Decode one token for every active sequence"""
+        import torch
+        
+        batch = len(self._active)
+        input_ids = torch.tensor([[sequence.next_token] for sequence in self._active])
+        position_ids = torch.tensor([[sequence.cached] for sequence in self._active])
+        mask = torch.cat([self._mask, torch.ones((batch, 1), dtype=torch.long)], dim=1)
+        
+        outputs = self.model(
+            input_ids=input_ids,
+            past_key_values=to_model_cache(tuple(zip(self._keys, self._values))),
+            attention_mask=mask,
+            position_ids=position_ids,
+            use_cache=True
+        )
+        cache = to_legacy_cache(outputs.past_key_values)
+        self._keys = [key for key, _ in cache]
+        self._values = [value for _, value in cache]
+        self._mask = mask
+        
+        for sequence in self._active:
+            sequence.cached += 1
+        
+        tokens = self._sample(outputs.logits[:, -1, :], self._active)
+        finished = []
+        errors = {}
+        for row, (sequence, token) in enumerate(zip(self._active, tokens)):
+            try:
+                self._emit(sequence, token)
+                if self._finished(sequence, token):
+                    finished.append(row)
+            except Exception as e:
+                # A broken streamer only takes its own sequence out of the batch
+                logger.error(f"Streaming a token failed: {e}")
+                finished.append(row)
+                errors[row] = e
+        
+        with self._stats_lock:
+            self._steps += 1
+            self._step_rows += batch
+        
+        if finished:
+            self._retire(finished, errors)
+    
+    def _sample(self, logits, sequences: List[_Sequence]) -> List[int]:
+        """Repetition penalty, temperature and top-k sampling, as in model.generate"""
+        import torch
+        
+        logits = logits.clone()
+        if self.repetition_penalty != 1.0:
+            for row, sequence in enumerate(sequences):
+                seen = torch.tensor(sorted(set(sequence.tokens)))
+                scores = logits[row, seen]
+                logits[row, seen] = torch.where(scores < 0, scores * self.repetition_penalty, scores / self.repetition_penalty)
+        
+        logits = logits / self.temperature
+        if self.top_k and self.top_k < logits.shape[-1]:
+            threshold = torch.topk(logits, self.top_k, dim=-1).values[:, -1:]
+            logits = logits.masked_fill(logits < threshold, float('-inf'))
+        
+        probabilities = torch.softmax(logits, dim=-1)
+        return torch.multinomial(probabilities, num_samples=1).squeeze(-1).tolist()
+    
+    def _emit(self, sequence: _Sequence, token: int):
+        sequence.tokens.append(token)
+        sequence.generated += 1
+        sequence.next_token = token
+        if sequence.request.streamer is not None:
+            import torch
+            sequence.request.streamer.put(torch.tensor([token]))
+        with self._stats_lock:
+            self._tokens_generated += 1
+    
+    def _finished(self, sequence: _Sequence, token: int) -> bool:
+        cancel = sequence.request.cancel
+        return (token == self.eos_token_id or sequence.generated >= sequence.request.max_new_tokens
+                or (cancel is not None and cancel.is_set()))
+    
+    def _retire(self, rows: List[int], errors: Optional[Dict[int, Exception]] = None):
+        """Resolve finished sequences (or fail those with an error) and drop their rows from the batch"""
+        import torch
+        
+        width = self._mask.shape[1]
+        completed = 0
+        for row in rows:
+            sequence = self._active[row]
+            error = errors.get(row) if errors else None
+            if error is None:
+                try:
+                    start = width - sequence.cached
+                    # Clone so the result does not pin the whole batched cache in memory
+                    cache = tuple(
+                        (key[row:row + 1, :, start:, :].clone(), value[row:row + 1, :, start:, :].clone())
+                        for key, value in zip(self._keys, self._values)
+                    )
+                    if sequence.request.streamer is not None:
+                        sequence.request.streamer.end()
+                    sequence.request.future.set_result((torch.tensor([sequence.tokens]), to_model_cache(cache)))
+                    completed += 1
+                except Exception as e:
+                    error = e
+            if error is not None:
+                self._fail(sequence, error)
+        
+        with self._stats_lock:
+            self._requests_completed += completed
+        
+        retired = set(rows)
+        keep = [row for row in range(len(self._active)) if row not in retired]
+        self._active = [self._active[row] for row in keep]
+        if not keep:
+            self._keys = self._values = self._mask = None
+            return
+        
+        index = torch.tensor(keep)
+        self._keys = [key.index_select(0, index) for key in self._keys]
+        self._values = [value.index_select(0, index) for value in self._values]
+        self._mask = self._mask.index_select(0, index)
+        
+        # Trim padding columns that no remaining row needs
+        trim = width - max(sequence.cached for sequence in self._active)
+        if trim > 0:
+            self._keys = [key[:, :, trim:, :] for key in self._keys]
+            self._values = [value[:, :, trim:, :] for value in self._values]
+            self._mask = self._mask[:, trim:]
+    
+    def _fail(self, sequence: _Sequence, error: Exception):
+        if sequence.request.streamer is not None:
+            try:
+                sequence.request.streamer.end()
+            except Exception:
+                pass
+        if not sequence.request.future.done():
+            sequence.request.future.set_exception(error)
+    
+    def stats(self) -> dict:
+        """Occupancy and throughput metrics"""
+        with self._stats_lock:
+            return {
+                'max_batch_size': self.max_batch_size,
+                'active_sequences': len(self._active),
+                'queued_requests': self._queue.qsize(),
+                'decode_steps': self._steps,
+                'mean_batch_occupancy': self._step_rows / self._steps if self._steps else 0.0,
+                'tokens_generated': self._tokens_generated,
+                'requests_completed': self._requests_completed,
+                'tokens_per_busy_second': self._tokens_generated / self._busy_seconds if self._busy_seconds else 0.0
+            }
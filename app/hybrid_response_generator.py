@@ -1,26 +1,108 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer
-import torch
 import logging
+import os
 import random
+import re
+import threading
 from typing import Dict, List
+from model_registry import model_registry
+from kv_cache import KVCacheEntry, SessionKVCache
+from generation_scheduler import ContinuousBatchScheduler
+from document import document_for
 
 logger = logging.getLogger(__name__)
 
+# Generator precision chosen at load time: 'fp32' (default) or 'int8' (dynamic quantization)
+DIALOGPT_QUANTIZATION = os.getenv('DIALOGPT_QUANTIZATION', 'fp32')
+
+# Seconds to wait for the next streamed token before giving up
+STREAM_TOKEN_TIMEOUT = float(os.getenv('STREAM_TOKEN_TIMEOUT', '30'))
+
+# Longest reply generated per turn
+MAX_RESPONSE_TOKENS = 100
+
+# Per-session reuse of past_key_values across turns, capped by total memory
+KV_CACHE_ENABLED = os.getenv('KV_CACHE_ENABLED', '1') == '1'
+KV_CACHE_MAX_MB = float(os.getenv('KV_CACHE_MAX_MB', '256'))
+
+# Decode concurrent requests together in one continuously refilled batch
+DIALOGPT_CONTINUOUS_BATCHING = os.getenv('DIALOGPT_CONTINUOUS_BATCHING', '0') == '1'
+DIALOGPT_MAX_BATCH_SIZE = int(os.getenv('DIALOGPT_MAX_BATCH_SIZE', '8'))
+
+# Where the last word of a partial reply starts; it is held back until the next chunk completes it
+TRAILING_WORD = re.compile(r'\s+\S*$')
+
+class StreamCorrection(str):
+    """
+    Streamed chunk that replaces everything sent so far for the reply.
+
+    Only sent when the final response doesn't extend the text already
+    streamed, so clients never keep showing words the stored reply lacks.
+    """
+
+class _LinkedEvent:
+    """Read-only view of several events that counts as set once any of them is"""
+    
+    def __init__(self, *events: threading.Event):
+        self.events = events
+    
+    def is_set(self) -> bool:
+        return any(event.is_set() for event in self.events)
+
+def _stop_on(event: threading.Event):
+    """StoppingCriteriaList that ends generate() once `event` is set"""
+    import torch
+    from transformers import StoppingCriteria, StoppingCriteriaList
+    
+    class EventStoppingCriteria(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return torch.full((input_ids.shape[0],), event.is_set(), dtype=torch.bool, device=input_ids.device)
+    
+    return StoppingCriteriaList([EventStoppingCriteria()])
+
+def quantize_dynamic_int8(model):
+    """
+    Dynamically quantize a GPT-2 style model to int8 for CPU inference.
+    
+    GPT-2 blocks use transformers' Conv1D instead of nn.Linear, which torch
+    dynamic quantization ignores, so those layers are converted to equivalent
+    Linear layers first.
+    """
+    import torch
+    try:
+        from transformers.pytorch_utils import Conv1D
+    except ImportError:
+        from transformers.modeling_utils import Conv1D
+    
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if isinstance(child, Conv1D):
+                # Conv1D stores its weight as (in_features, out_features)
+                in_features, out_features = child.weight.shape
+                linear = torch.nn.Linear(in_features, out_features)
+                linear.weight.data = child.weight.data.t().contiguous()
+                linear.bias.data = child.bias.data
+                setattr(parent, name, linear)
+    
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
 class HybridTherapyResponseGenerator:
-    def __init__(self):
-        # Load DialoGPT model for conversational AI
+    def __init__(self, quantization: str = DIALOGPT_QUANTIZATION):
+        # DialoGPT model for conversational AI, loaded lazily through the model registry
         self.model_name = "microsoft/DialoGPT-small"
+        self.quantization = quantization
         self.tokenizer = None
         self.model = None
-        self.load_model()
-        
-        # Simple intent patterns for routing decisions
-        self.simple_intents = {
-            'greeting': ['hello', 'hi', 'hey', 'good morning', 'good afternoon'],
-            'direct_question': ['how', 'what', 'why', 'when', 'can you help', 'strategies', 'advice'],
-            'crisis': ['suicide', 'kill myself', 'end it all', 'want to die'],
-            'simple_affirmation': ['yes', 'no', 'okay', 'sure', 'thanks']
-        }
+        self.kv_cache = SessionKVCache(int(KV_CACHE_MAX_MB * 1024 * 1024))
+        self.scheduler = None
+        
+        # Lexicon categories that are answered with rule-based responses
+        self.rule_based_intents = ['intent.greeting', 'intent.simple_affirmation', 'crisis']
+        
+        # Replaced with 'challenging' in every reply, streamed or not
+        self.inappropriate_words = ['stupid', 'dumb', 'pathetic', 'worthless']
+        
+        # Fallback when the model produces nothing
+        self.empty_response = "I hear what you're saying. Can you tell me more about how this is affecting you?"
         
         # Therapy-specific prompt templates
         self.therapy_prompts = {
@@ -34,47 +116,56 @@ class HybridTherapyResponseGenerator:
         """Load the DialoGPT model"""
         try:
             logger.info("Loading DialoGPT model for conversational generation...")
+            from transformers import AutoModelForCausalLM, AutoTokenizer
             self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
             self.model = AutoModelForCausalLM.from_pretrained(self.model_name)
+            self.model.eval()
+            
+            if self.quantization == 'int8':
+                logger.info("Quantizing DialoGPT linear layers to int8...")
+                self.model = quantize_dynamic_int8(self.model)
             
             # Add pad token if not present
             if self.tokenizer.pad_token is None:
                 self.tokenizer.pad_token = self.tokenizer.eos_token
+            
+            if DIALOGPT_CONTINUOUS_BATCHING:
+                self.scheduler = ContinuousBatchScheduler(
+                    self.model,
+                    eos_token_id=self.tokenizer.eos_token_id,
+                    max_batch_size=DIALOGPT_MAX_BATCH_SIZE,
+                    temperature=0.7,
+                    repetition_penalty=1.2
+                )
                 
             logger.info("DialoGPT model loaded successfully")
         except Exception as e:
             logger.error(f"Failed to load DialoGPT model: {e}")
             self.model = None
             self.tokenizer = None
+        return self.model
     
     def determine_response_strategy(self, user_input: str, nlp_result: Dict, session_context: Dict) -> str:
         """Decide whether to use rule-based or AI generation"""
-        user_text = user_input.lower()
+        document = document_for(nlp_result, user_input)
         message_count = session_context.get('message_count', 0)
         confidence = nlp_result.get('sentiment', {}).get('confidence', 0)
+        matches = document.matches
         
         # Use rule-based for simple, clear cases
-        for intent, keywords in self.simple_intents.items():
-            if any(keyword in user_text for keyword in keywords):
-                if intent in ['greeting', 'simple_affirmation', 'crisis']:
-                    return 'rule_based'
+        if any(intent in matches for intent in self.rule_based_intents):
+            return 'rule_based'
         
         # Use rule-based for very first message
         if message_count == 0:
             return 'rule_based'
         
         # Use AI generation for complex emotional content
-        complex_indicators = [
-            'feel', 'feeling', 'emotion', 'burnout', 'exhausted', 'overwhelmed',
-            'anxious', 'depressed', 'stressed', 'worried', 'scared', 'lost',
-            'relationship', 'work', 'career', 'dream', 'passion'
-        ]
-        
-        if any(indicator in user_text for indicator in complex_indicators):
+        if 'complex_emotion' in matches:
             return 'ai_generation'
         
         # Use AI for questions requiring thoughtful responses
-        if nlp_result.get('is_question', False) and len(user_text.split()) > 5:
+        if nlp_result.get('is_question', False) and len(document.tokens) > 5:
             return 'ai_generation'
         
         # Default to AI generation for richer responses
@@ -82,73 +173,270 @@ class HybridTherapyResponseGenerator:
     
     def generate_with_transformer(self, user_input: str, nlp_result: Dict, session_context: Dict) -> str:
         """Generate response using DialoGPT transformer"""
+        model_registry.get('dialogpt')
         if not self.model or not self.tokenizer:
             return "I'm having some technical difficulties. Could you please rephrase that?"
         
         try:
-            # Select appropriate prompt based on detected topic
-            topic = nlp_result.get('topic_category', 'general')
-            sentiment = nlp_result.get('sentiment', {}).get('sentiment', 'neutral')
-            
-            # Map topics to prompt templates
-            if topic == 'work_stress' or 'work' in user_input.lower():
-                prompt_key = 'work_stress'
-            elif sentiment == 'negative' and any(word in user_input.lower() for word in ['exhausted', 'burnout', 'overwhelming']):
-                prompt_key = 'burnout'
-            elif sentiment == 'negative' and any(word in user_input.lower() for word in ['anxious', 'worried', 'scared']):
-                prompt_key = 'anxiety'
-            else:
-                prompt_key = 'general'
-            
-            # Build context-aware prompt
-            prompt = self.therapy_prompts[prompt_key] + user_input
-            
-            # Add conversation context if available
-            recent_history = session_context.get('recent_history', [])
-            if recent_history:
-                context_summary = self._build_context_summary(recent_history)
-                prompt = f"Previous context: {context_summary}\n\n{prompt}"
+            # Encode only what the session's KV cache has not seen yet
+            inputs, past_key_values, session_id, message_count = self._prepare_turn(user_input, nlp_result, session_context)
             
             # Generate response
-            response = self._generate_response(prompt)
+            sequences, past_key_values = self._run_generate(inputs, past_key_values)
+            self._remember_turn(session_id, sequences, past_key_values, message_count)
+            response = self._decode_reply(sequences, inputs.shape[1])
             
             # Post-process to ensure therapeutic quality
             response = self._post_process_response(response, nlp_result)
             
             logger.info(f"AI generated response: {response[:50]}...")
             return response
-            
+        
         except Exception as e:
             logger.error(f"Error in transformer generation: {e}")
             return "I want to make sure I understand what you're sharing. Could you tell me more about how you're feeling?"
     
-    def _generate_response(self, prompt: str) -> str:
-        """Core transformer generation logic"""
-        # Encode the prompt
+    def stream_with_transformer(self, user_input: str, nlp_result: Dict, session_context: Dict,
+                                cancel: threading.Event = None):
+        """
+        Stream a DialoGPT response as tokens are decoded
+
+        Yields text chunks as they arrive and returns the final post-processed
+        response (retrieve it with `yield from` or StopIteration.value). Chunks
+        are word-filtered before they are sent, so they always prefix the final
+        response; setting `cancel` stops generation at the next token.
+        """
+        model_registry.get('dialogpt')
+        if not self.model or not self.tokenizer:
+            response = "I'm having some technical difficulties. Could you please rephrase that?"
+            yield response
+            return response
+        
+        raw = ''
+        shown = ''
+        try:
+            inputs, past_key_values, session_id, message_count = self._prepare_turn(user_input, nlp_result, session_context)
+            
+            pending = ''
+            for chunk in self._stream_response(inputs, past_key_values, session_id, message_count, cancel):
+                raw += chunk
+                pending += chunk
+                # Send only whole words; the last one may still be growing into a filtered word
+                match = TRAILING_WORD.search(pending)
+                cut = match.start() if match else 0
+                if cut <= 0:
+                    continue
+                text, pending = self._filter_words(pending[:cut]), pending[cut:]
+                text = text if shown else text.lstrip()
+                if text:
+                    shown += text
+                    yield text
+            
+            text = self._filter_words(pending).rstrip()
+            text = text if shown else text.lstrip()
+            if text:
+                shown += text
+                yield text
+            
+            response = self._post_process_response(raw.strip() or self.empty_response, nlp_result)
+        
+        except Exception as e:
+            if shown:
+                # A fallback reply would contradict the words already on screen; let the caller report the error
+                logger.error(f"Streaming transformer generation failed mid-reply: {e}")
+                raise
+            logger.error(f"Error in streaming transformer generation: {e}")
+            response = "I want to make sure I understand what you're sharing. Could you tell me more about how you're feeling?"
+        
+        if response.startswith(shown):
+            # Send whatever post-processing appended (e.g. a follow-up question)
+            if len(response) > len(shown):
+                yield response[len(shown):]
+        else:
+            yield StreamCorrection(response)
+        
+        logger.info(f"AI streamed response: {response[:50]}...")
+        return response
+    
+    def release_session(self, session_id: str):
+        """Drop a session's cached keys/values once the session has ended"""
+        self.kv_cache.invalidate(session_id)
+    
+    def _turn_prompt(self, user_input: str, nlp_result: Dict) -> str:
+        """Therapy prompt for the current message"""
+        # Select appropriate prompt based on detected topic
+        topic = nlp_result.get('topic_category', 'general')
+        sentiment = nlp_result.get('sentiment', {}).get('sentiment', 'neutral')
+        
+        matches = document_for(nlp_result, user_input).matches
+        
+        # Map topics to prompt templates
+        if topic == 'work_stress' or 'prompt.work' in matches:
+            prompt_key = 'work_stress'
+        elif sentiment == 'negative' and 'prompt.burnout' in matches:
+            prompt_key = 'burnout'
+        elif sentiment == 'negative' and 'prompt.anxiety' in matches:
+            prompt_key = 'anxiety'
+        else:
+            prompt_key = 'general'
+        
+        return self.therapy_prompts[prompt_key] + user_input
+    
+    def _build_prompt(self, user_input: str, nlp_result: Dict, session_context: Dict) -> str:
+        """Build the therapy prompt for the transformer"""
+        # Build context-aware prompt
+        prompt = self._turn_prompt(user_input, nlp_result)
+        
+        # Add conversation context if available
+        recent_history = session_context.get('recent_history', [])
+        if recent_history:
+            context_summary = self._build_context_summary(recent_history)
+            prompt = f"Previous context: {context_summary}\n\n{prompt}"
+        
+        return prompt
+    
+    def _prepare_turn(self, user_input: str, nlp_result: Dict, session_context: Dict):
+        """
+        Build model inputs for a turn, reusing the session's KV cache when possible
+
+        Returns:
+            tuple: (input_ids, past_key_values or None, session_id, message count once this reply is recorded)
+        """
+        import torch
+        
+        session_id = session_context.get('session_id')
+        message_count = session_context.get('message_count', 0)
+        entry = self.kv_cache.take(session_id) if KV_CACHE_ENABLED and session_id else None
+        
+        if entry is not None and entry.message_count != message_count:
+            # The cached reply was never recorded (client gone, barge-in) or turns were added
+            # without the model; the session history no longer matches the cache
+            logger.info(f"KV cache for session {session_id} is out of step with its history, re-priming")
+            entry = None
+        
+        if entry is not None:
+            # The cache already holds the earlier turns, so no context summary is needed
+            turn_ids = self.tokenizer.encode(self._turn_prompt(user_input, nlp_result) + self.tokenizer.eos_token, return_tensors='pt')
+            inputs = torch.cat([entry.token_ids, turn_ids], dim=-1)
+            if inputs.shape[1] + MAX_RESPONSE_TOKENS <= self.model.config.n_positions:
+                return inputs, entry.past_key_values, session_id, message_count + 1
+            # The conversation outgrew the context window; start over from a summary prompt
+            logger.info(f"KV cache for session {session_id} is full, re-priming from summary")
+        
+        prompt = self._build_prompt(user_input, nlp_result, session_context)
         inputs = self.tokenizer.encode(prompt + self.tokenizer.eos_token, return_tensors='pt')
+        return inputs, None, session_id, message_count + 1
+    
+    def _remember_turn(self, session_id: str, sequences, past_key_values, message_count: int):
+        """Keep the session's tokens and KV cache so the next turn only encodes new tokens"""
+        if not KV_CACHE_ENABLED or not session_id or past_key_values is None:
+            return
+        config = self.model.config
+        # fp32 keys and values for every layer, for every cached token
+        nbytes = sequences.shape[1] * 2 * config.n_layer * config.n_embd * 4
+        self.kv_cache.put(session_id, KVCacheEntry(sequences, past_key_values, nbytes, message_count))
+    
+    def _run_generate(self, inputs, past_key_values=None, streamer=None, cancel: threading.Event = None):
+        """
+        Run model.generate with the therapy sampling parameters; setting `cancel` ends it early
+
+        Returns:
+            tuple: (sequences, past_key_values)
+        """
+        import torch
+        
+        if self.scheduler:
+            return self.scheduler.generate(inputs, past_key_values, MAX_RESPONSE_TOKENS, streamer, cancel)
         
-        # Generate response with controlled parameters
         with torch.no_grad():
             outputs = self.model.generate(
                 inputs,
-                max_length=inputs.shape[1] + 100,  # Limit response length
+                attention_mask=torch.ones_like(inputs),
+                past_key_values=past_key_values,
+                max_length=inputs.shape[1] + MAX_RESPONSE_TOKENS,  # Limit response length
                 num_return_sequences=1,
                 temperature=0.7,  # Balanced creativity
                 do_sample=True,
                 pad_token_id=self.tokenizer.eos_token_id,
-                repetition_penalty=1.2  # Reduce repetition
+                repetition_penalty=1.2,  # Reduce repetition
+                streamer=streamer,
+                stopping_criteria=_stop_on(cancel) if cancel is not None else None,
+                use_cache=True,
+                return_dict_in_generate=True
             )
-        
-        # Decode only the generated part
-        response = self.tokenizer.decode(outputs[0][inputs.shape[1]:], skip_special_tokens=True)
+        return outputs.sequences, outputs.past_key_values
+    
+    def _decode_reply(self, sequences, prompt_length: int) -> str:
+        """Decode only the generated part"""
+        response = self.tokenizer.decode(sequences[0][prompt_length:], skip_special_tokens=True)
         
         # Clean up the response
         response = response.strip()
         if not response:
-            response = "I hear what you're saying. Can you tell me more about how this is affecting you?"
+            response = self.empty_response
         
         return response
     
+    def _generate_response(self, prompt: str) -> str:
+        """Core transformer generation logic"""
+        # Encode the prompt
+        inputs = self.tokenizer.encode(prompt + self.tokenizer.eos_token, return_tensors='pt')
+        
+        # Generate response with controlled parameters
+        sequences, _ = self._run_generate(inputs)
+        return self._decode_reply(sequences, inputs.shape[1])
+    
+    def _stream_response(self, inputs, past_key_values=None, session_id: str = None, message_count: int = 0,
+                         cancel: threading.Event = None):
+        """
+        Yield decoded text chunks while generation runs on a worker thread
+
+        Generation stops at the next token once `cancel` is set or the consumer
+        closes this generator (e.g. a client disconnect).
+        """
+        from transformers import TextIteratorStreamer
+        
+        streamer = TextIteratorStreamer(
+            self.tokenizer,
+            skip_prompt=True,
+            skip_special_tokens=True,
+            timeout=STREAM_TOKEN_TIMEOUT
+        )
+        
+        errors = []
+        # Set only when this generator is abandoned; the caller's event is watched, never set
+        stop = threading.Event()
+        halt = _LinkedEvent(stop, cancel) if cancel is not None else stop
+        
+        def generate():
+            try:
+                sequences, cache = self._run_generate(inputs, past_key_values, streamer, halt)
+                # A cut-off reply is never recorded, so don't build the next turn on it
+                if not halt.is_set():
+                    self._remember_turn(session_id, sequences, cache, message_count)
+            except Exception as e:
+                # Unblock the consumer instead of letting it wait for the token timeout
+                errors.append(e)
+                streamer.end()
+        
+        worker = threading.Thread(target=generate, daemon=True)
+        worker.start()
+        completed = False
+        try:
+            for chunk in streamer:
+                if chunk:
+                    yield chunk
+            completed = True
+        finally:
+            # Closed early or failed: stop generating. A drained stream is left alone so
+            # the worker can still remember the turn before it is joined
+            if not completed:
+                stop.set()
+            worker.join()
+        
+        if errors:
+            raise errors[0]
+    
     def _build_context_summary(self, recent_history: List[Dict]) -> str:
         """Build a concise context summary from recent conversation"""
         if not recent_history:
@@ -164,12 +452,15 @@ class HybridTherapyResponseGenerator:
         
         return " ".join(context_parts)
     
+    def _filter_words(self, text: str) -> str:
+        for word in self.inappropriate_words:
+            text = text.replace(word, 'challenging')
+        return text
+    
     def _post_process_response(self, response: str, nlp_result: Dict) -> str:
         """Ensure response meets therapeutic standards"""
         # Remove any inappropriate content (basic filtering)
-        inappropriate_words = ['stupid', 'dumb', 'pathetic', 'worthless']
-        for word in inappropriate_words:
-            response = response.replace(word, 'challenging')
+        response = self._filter_words(response)
         
         # Ensure response ends appropriately
         if not response.endswith(('.', '?', '!')):
@@ -188,3 +479,16 @@ class HybridTherapyResponseGenerator:
 
 # Global instance
 hybrid_generator = HybridTherapyResponseGenerator()
+
+def _load_dialogpt():
+    """Registry loader; raises so /readyz reports a missing model as degraded"""
+    model = hybrid_generator.load_model()
+    if model is None:
+        raise RuntimeError("DialoGPT model unavailable, AI generation disabled")
+    return model
+
+model_registry.register(
+    'dialogpt',
+    _load_dialogpt,
+    warmup=lambda model: hybrid_generator._generate_response("Hello, how are you?")
+)
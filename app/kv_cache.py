@@ -0,0 +1,89 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class KVCacheEntry:
+    """
+    Token ids a session has already run through the model, plus their key/value cache.
+
+    `message_count` is the session's message count once the cached reply is
+    recorded; an entry is only valid while the session is at that count.
+    """
+    __slots__ = ('token_ids', 'past_key_values', 'nbytes', 'message_count')
+
+    def __init__(self, token_ids, past_key_values, nbytes: int, message_count: int):
+        self.token_ids = token_ids
+        self.past_key_values = past_key_values
+        self.nbytes = nbytes
+        self.message_count = message_count
+
+class SessionKVCache:
+    """
+    Per-session transformer key/value caches with a memory cap and LRU eviction.
+
+    Entries are taken out with take() while a turn is being generated, so two
+    concurrent turns in one session never share (and corrupt) the same cache.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def take(self, session_id: str) -> Optional[KVCacheEntry]:
+        """Remove and return a session's cache for exclusive use"""
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.total_bytes -= entry.nbytes
+            self.hits += 1
+            return entry
+
+    def put(self, session_id: str, entry: KVCacheEntry):
+        """Store a session's cache as most recently used, evicting the oldest over the cap"""
+        if entry.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(session_id, None)
+            if previous is not None:
+                self.total_bytes -= previous.nbytes
+            self._entries[session_id] = entry
+            self.total_bytes += entry.nbytes
+
+            while self.total_bytes > self.max_bytes:
+                evicted_id, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted.nbytes
+                self.evictions += 1
+                logger.info(f"Evicted KV cache for session {evicted_id}")
+
+    def invalidate(self, session_id: str):
+        """Drop a session's cache, e.g. when the session ends"""
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is not None:
+                self.total_bytes -= entry.nbytes
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'sessions': len(self._entries),
+                'total_mb': self.total_bytes / (1024 * 1024),
+                'max_mb': self.max_bytes / (1024 * 1024),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
@@ -0,0 +1,224 @@
+import re
+import logging
+from typing import Dict, List
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Lowercase words, keeping contractions like "can't" together
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)*")
+
+# Pieces of the compiled pattern: the rest of a word, the end of a word, and the gap between words
+WORD_REST = r"[a-z0-9]*(?:'[a-z]+)*"
+WORD_END = r"(?![a-z0-9]|'[a-z])"
+WORD_GAP = r"[^a-z0-9]+"
+
+# Distinct matched spans whose keyword outputs are memoized
+SPAN_MEMO_SIZE = 50000
+
+# Every keyword vocabulary used across the NLP stack, by category.
+# Patterns match whole words; a trailing '*' also matches longer words
+# starting with the last word (e.g. 'feel*' matches 'feels' and 'feeling').
+VOCABULARIES = {
+    # Therapy topics (NLPProcessor.extract_keywords)
+    'topic.greeting': ['hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening'],
+    'topic.feelings': ['feel*', 'feeling*', 'felt', 'emotion*', 'emotional'],
+    'topic.problems': ['problem*', 'issue*', 'trouble*', 'difficulty', 'struggle*', 'challenge*'],
+    'topic.relationships': ['relationship*', 'partner*', 'friend*', 'family', 'parents', 'spouse*'],
+    'topic.work_stress': ['work*', 'job*', 'boss*', 'colleague*', 'career*', 'workplace*'],
+    'topic.mental_health': ['anxiety', 'depression*', 'stress*', 'panic*', 'overwhelmed', 'therapy'],
+    
+    # Question and help-request phrasing (NLPProcessor.detect_question)
+    'question': [
+        'how', 'what', 'why', 'when', 'where', 'who', 'which',
+        'can you', 'could you', 'would you', 'should i',
+        'do you have', 'are there', 'is there', 'have you',
+        'any suggestions', 'any advice', 'any strategies', 'any tips',
+        'help me', 'what should', 'how do i', 'how can i'
+    ],
+    
+    # Emotion words (SentimentAnalyzer.detect_emotion_keywords)
+    'emotion.positive': ['happy', 'joy*', 'excited', 'great*', 'wonderful', 'amazing', 'good', 'better', 'best', 'love*', 'like'],
+    'emotion.negative': ['sad*', 'depressed', 'anxious*', 'worried', 'angry', 'frustrated', 'terrible', 'awful', 'hate*', 'worst', 'bad'],
+    'emotion.anxiety': ['anxious*', 'worried', 'nervous*', 'scared', 'afraid', 'panic*', 'stress*', 'overwhelmed'],
+    'emotion.depression': ['sad*', 'depressed', 'hopeless*', 'empty', 'lonely', 'down', 'low'],
+    
+    # Crisis language (crisis detection and session crisis indicators)
+    'crisis': [
+        'want to die', 'kill myself', 'end it all', 'suicide*', 'can\'t go on',
+        'better off dead', 'no point in living', 'want to disappear',
+        'hurt myself', 'end my life'
+    ],
+    
+    # Response routing (HybridTherapyResponseGenerator)
+    'intent.greeting': ['hello', 'hi', 'hey', 'good morning', 'good afternoon'],
+    'intent.simple_affirmation': ['yes', 'no', 'okay', 'sure', 'thanks'],
+    'complex_emotion': [
+        'feel*', 'feeling*', 'emotion*', 'burnout', 'exhausted', 'overwhelmed',
+        'anxious', 'depressed', 'stressed', 'worried', 'scared', 'lost',
+        'relationship*', 'work*', 'career*', 'dream*', 'passion*'
+    ],
+    'prompt.work': ['work*'],
+    'prompt.burnout': ['exhausted', 'burnout', 'overwhelming'],
+    'prompt.anxiety': ['anxious', 'worried', 'scared'],
+    
+    # Contextual rule-based responses (TherapyResponseGenerator)
+    'help_request': ['strategies', 'help*', 'advice', 'suggestions', 'tips', 'how do i', 'what should'],
+    'burnout': ['burnout', 'exhausted', 'overwhelmed', 'pressure*', 'racing mind', 'overthinking'],
+    'work': ['work*', 'job*', 'career*', 'workplace*', 'colleague*'],
+    'distress': ['scared', 'worry', 'anxious', 'fear*', 'losing interest']
+}
+
+def normalize(text: str) -> str:
+    """Lowercase text with typographic apostrophes straightened, as the matcher expects"""
+    return text.lower().replace('’', "'")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens used for matching"""
+    return TOKEN_PATTERN.findall(normalize(text))
+
+class _Node:
+    """Trie node keyed on whole words"""
+    __slots__ = ('children', 'outputs', 'stems')
+    
+    def __init__(self):
+        self.children = {}  # next word -> _Node
+        self.outputs = []   # (category, pattern index) ending at this word
+        self.stems = {}     # word prefix -> outputs for patterns ending in a stem
+
+class LexiconMatches:
+    """Keywords found in one text, grouped by category in vocabulary order"""
+    __slots__ = ('_found',)
+    
+    def __init__(self, found: Dict[str, List[str]]):
+        self._found = found
+    
+    def __contains__(self, category: str) -> bool:
+        return category in self._found
+    
+    def __bool__(self) -> bool:
+        return bool(self._found)
+    
+    def __repr__(self) -> str:
+        return f"LexiconMatches({self._found!r})"
+    
+    def keywords(self, category: str) -> List[str]:
+        """Keywords matched for one category"""
+        return list(self._found.get(category, []))
+    
+    def categories(self, prefix: str = '') -> Dict[str, List[str]]:
+        """Matched categories under a prefix, with the prefix stripped from their names"""
+        return {
+            category[len(prefix):]: list(keywords)
+            for category, keywords in self._found.items()
+            if category.startswith(prefix)
+        }
+
+class Lexicon:
+    """
+    Compiled multi-pattern keyword matcher.
+    
+    All vocabularies are compiled into one trie over words, and the trie into
+    one regular expression that finds the longest pattern starting at each
+    word boundary. A single pass over the text finds every category at once,
+    and 'hi' no longer matches inside 'this'. Each distinct matched span is
+    resolved to its keywords once and memoized.
+    """
+    
+    def __init__(self, vocabularies: Dict[str, List[str]]):
+        self.vocabularies = vocabularies
+        self._root = _Node()
+        self._category_order = {category: position for position, category in enumerate(vocabularies)}
+        self._span_memo = {}
+        
+        for category, patterns in vocabularies.items():
+            for index, pattern in enumerate(patterns):
+                self._add(category, index, pattern)
+        
+        # Zero-width lookahead so overlapping matches at later words are still found
+        self._pattern = re.compile(
+            r"(?<![a-z0-9])(?<![a-z0-9]')(?=(" + self._node_regex(self._root) + "))"
+        )
+        
+        logger.info(f"Compiled lexicon with {sum(len(p) for p in vocabularies.values())} patterns in {len(vocabularies)} categories")
+    
+    def _add(self, category: str, index: int, pattern: str):
+        is_stem = pattern.endswith('*')
+        words = tokenize(pattern.rstrip('*'))
+        if not words:
+            raise ValueError(f"Empty lexicon pattern in category '{category}'")
+        
+        node = self._root
+        for word in words[:-1]:
+            node = node.children.setdefault(word, _Node())
+        
+        if is_stem:
+            node.stems.setdefault(words[-1], []).append((category, index))
+        else:
+            node = node.children.setdefault(words[-1], _Node())
+            node.outputs.append((category, index))
+    
+    def _node_regex(self, node: _Node) -> str:
+        """Alternation over the words that can follow a trie node, grouped by first letter"""
+        branches = {}
+        for word, child in sorted(node.children.items()):
+            branch = re.escape(word[1:]) + WORD_END
+            if child.children or child.stems:
+                # Greedy, so the longest multi-word pattern wins
+                branch += '(?:' + WORD_GAP + self._node_regex(child) + ')?'
+            branches.setdefault(word[0], []).append(branch)
+        for stem in sorted(node.stems):
+            branches.setdefault(stem[0], []).append(re.escape(stem[1:]) + WORD_REST)
+        
+        return '(?:' + '|'.join(
+            re.escape(letter) + '(?:' + '|'.join(alternatives) + ')'
+            for letter, alternatives in sorted(branches.items())
+        ) + ')'
+    
+    def _span_outputs(self, span: str):
+        """Every pattern matched by a span and its leading words"""
+        outputs = self._span_memo.get(span)
+        if outputs is not None:
+            return outputs
+        
+        outputs = []
+        node = self._root
+        for token in TOKEN_PATTERN.findall(span):
+            for stem, stem_outputs in node.stems.items():
+                if token.startswith(stem):
+                    outputs.extend(stem_outputs)
+            node = node.children.get(token)
+            if node is None:
+                break
+            outputs.extend(node.outputs)
+        
+        if len(self._span_memo) >= SPAN_MEMO_SIZE:
+            self._span_memo.clear()
+        self._span_memo[span] = outputs
+        return outputs
+    
+    def scan(self, text: str, normalized: bool = False) -> LexiconMatches:
+        """Find every category's keywords in one pass over the text (pass normalized=True to skip normalize())"""
+        if not text:
+            return LexiconMatches({})
+        
+        hits = set()
+        for span in set(self._pattern.findall(text if normalized else normalize(text))):
+            hits.update(self._span_outputs(span))
+        
+        found = {}
+        for category, index in sorted(hits, key=lambda hit: (self._category_order[hit[0]], hit[1])):
+            found.setdefault(category, []).append(self.vocabularies[category][index].rstrip('*'))
+        return LexiconMatches(found)
+    
+    def contains(self, text: str, category: str) -> bool:
+        """Check a single category"""
+        return category in self.scan(text)
+
+# Global lexicon instance
+lexicon = Lexicon(VOCABULARIES)
+
+def scan(text: str) -> LexiconMatches:
+    """Convenience function for lexicon matching"""
+    return lexicon.scan(text)
@@ -1,16 +1,23 @@
-from flask import Flask, jsonify, request, session
+import os
+import time
+from datetime import datetime
+from dotenv import load_dotenv
+load_dotenv()
+from flask import Flask, Response, jsonify, request, session, stream_with_context
 from flask_cors import CORS 
-from speech_to_text import speech_to_text, test_microphone
-from text_to_speech import text_to_speech, get_available_voices
-from nlp_pipeline import process_text
-from sentiment import analyze_sentiment
+from speech_to_text import speech_to_text, transcribe_audio, test_microphone, calibrated_microphone
+from text_to_speech import text_to_speech, get_available_voices, tts_worker, PRIORITY_INTERACTIVE
+from nlp_pipeline import process_text, process_texts, public_result, nlp_processor
+from sentiment import analyze_sentiment, sentiment_analyzer
 from therapy_responses import generate_advanced_therapy_response
 from session_manager import session_manager
+from stt_backends import stt_stats
+from voice_listener import voice_listener
+from sharding import SHARD_KEY_HEADER, INTERNAL_TOKEN_HEADER, internal_request_allowed
+from model_registry import model_registry
 import logging
-import os
-from dotenv import load_dotenv
-load_dotenv()
-from therapy_responses import generate_hybrid_therapy_response
+from therapy_responses import generate_hybrid_therapy_response, stream_hybrid_therapy_response
+from hybrid_response_generator import hybrid_generator, StreamCorrection
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -19,17 +26,65 @@ app = Flask(__name__)
 CORS(app)
 app.secret_key = os.getenv('SECRET_KEY')  # Change this in production
 
+# Free a session's generation KV cache as soon as the session ends
+session_manager.on_session_end(hybrid_generator.release_session)
+session_manager.on_session_end(voice_listener.release_session)
+
+# Model loading: 'background' warms models on a thread, 'eager' blocks startup, 'lazy' loads on first use
+MODEL_LOADING = os.getenv('MODEL_LOADING', 'background')
+if MODEL_LOADING == 'eager':
+    model_registry.warm_up()
+elif MODEL_LOADING == 'background':
+    model_registry.warm_up_async()
+
+# Upper bound on texts per /batch-text-analysis request
+BATCH_MAX_TEXTS = int(os.getenv('BATCH_MAX_TEXTS', '1000'))
+
+# Where to serve; the dispatcher starts each worker on its own loopback port
+HOST = os.getenv('HOST', '127.0.0.1')
+PORT = int(os.getenv('PORT', '5000'))
+FLASK_DEBUG = os.getenv('FLASK_DEBUG', '1') == '1'
+
 @app.route('/')
 def home():
     return jsonify({"message": "Advanced AI Speech Therapist backend is running!"})
 
+@app.route('/healthz')
+def healthz():
+    """Liveness probe - the process is up and serving requests"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """Readiness probe - all models have finished loading and warming up"""
+    status = model_registry.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/metrics')
+def metrics():
+    """Runtime metrics for the inference stack"""
+    return jsonify({
+        'sentiment_batcher': sentiment_analyzer.batcher.stats() if sentiment_analyzer.batcher else None,
+        'sentiment_cache': sentiment_analyzer.cache.stats(),
+        'nlp_cache': nlp_processor.cache.stats(),
+        'generation_kv_cache': hybrid_generator.kv_cache.stats(),
+        'generation_scheduler': hybrid_generator.scheduler.stats() if hybrid_generator.scheduler else None,
+        'session_store': session_manager.store_stats(),
+        'sessions': session_manager.session_stats(),
+        'speech_to_text': stt_stats(),
+        'microphone': calibrated_microphone.stats(),
+        'voice_listener': voice_listener.stats(),
+        'text_to_speech': tts_worker.stats()
+    })
+
 # Session Management Endpoints
 
 @app.route('/start-therapy-session', methods=['POST'])
 def start_therapy_session():
     """Start a new therapy session"""
     try:
-        session_id = session_manager.create_session()
+        # Behind the dispatcher, the session id carries the shard key it routed this request on
+        session_id = session_manager.create_session(request.headers.get(SHARD_KEY_HEADER))
         session['current_session_id'] = session_id
         
         # Generate welcome message
@@ -76,8 +131,8 @@ def continue_session():
         
         logger.info(f"Continuing session {session_id}...")
         
-        # Step 1: Listen to user
-        stt_result = speech_to_text(timeout=timeout, phrase_time_limit=phrase_time_limit)
+        # Step 1: Listen to user (or take what they said while the session was listening)
+        stt_result = voice_listener.capture_utterance(session_id, timeout=timeout, phrase_time_limit=phrase_time_limit)
         if not stt_result['success']:
             return jsonify({
                 'success': False,
@@ -101,7 +156,7 @@ def continue_session():
         therapy_session.add_exchange(user_input, nlp_result, ai_response)
         
         # Step 6: Speak the response
-        tts_result = text_to_speech(ai_response, async_mode=False)
+        tts_result = text_to_speech(ai_response, priority=PRIORITY_INTERACTIVE)
         
         return jsonify({
             'success': True,
@@ -228,7 +283,7 @@ def text_therapy():
             'session_id': session_id,
             'user_input': user_input,
             'ai_response': ai_response,
-            'nlp_analysis': nlp_result,
+            'nlp_analysis': public_result(nlp_result),
             'message_count': therapy_session.message_count,
             'session_context': therapy_session.session_context,
             'debug_info': {
@@ -245,6 +300,133 @@ def text_therapy():
         }), 500
 
 
+def _sse_event(event: str, payload: dict) -> str:
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {app.json.dumps(payload)}\n\n"
+
+@app.route('/text-therapy/stream', methods=['POST'])
+def text_therapy_stream():
+    """Text-based therapy interaction streamed token by token as Server-Sent Events"""
+    try:
+        data = request.get_json()
+        if not data or 'text' not in data:
+            return jsonify({
+                'success': False,
+                'error': 'No text provided'
+            }), 400
+        
+        user_input = data['text']
+        session_id = data.get('session_id')
+        
+        if not session_id:
+            return jsonify({
+                'success': False,
+                'error': 'Session ID required. Please start a session first.'
+            }), 400
+        
+        therapy_session = session_manager.get_session(session_id)
+        if not therapy_session:
+            return jsonify({
+                'success': False,
+                'error': f'Session {session_id} not found. Please start a new session.'
+            }), 404
+        
+        # Analyze up front so input errors still come back as plain JSON
+        nlp_result = process_text(user_input)
+        context = therapy_session.get_conversation_context()
+        
+    except Exception as e:
+        logger.error(f"Error in streaming text therapy: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+    
+    def event_stream():
+        started = time.perf_counter()
+        first_token_at = None
+        try:
+            token_stream = stream_hybrid_therapy_response(nlp_result, context)
+            while True:
+                try:
+                    chunk = next(token_stream)
+                except StopIteration as done:
+                    ai_response = done.value
+                    break
+                
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                if isinstance(chunk, StreamCorrection):
+                    # Replaces the text streamed so far
+                    yield _sse_event('correction', {'text': str(chunk)})
+                else:
+                    yield _sse_event('token', {'text': chunk})
+            
+            therapy_session.add_exchange(user_input, nlp_result, ai_response)
+            
+            yield _sse_event('done', {
+                'success': True,
+                'session_id': session_id,
+                'user_input': user_input,
+                'ai_response': ai_response,
+                'nlp_analysis': public_result(nlp_result),
+                'message_count': therapy_session.message_count,
+                'session_context': therapy_session.session_context,
+                'timing': {
+                    'time_to_first_token_ms': (first_token_at - started) * 1000 if first_token_at else None,
+                    'total_ms': (time.perf_counter() - started) * 1000
+                }
+            })
+            
+        except Exception as e:
+            logger.error(f"Error while streaming therapy response: {e}")
+            yield _sse_event('error', {
+                'success': False,
+                'error': str(e)
+            })
+    
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/batch-text-analysis', methods=['POST'])
+def batch_text_analysis():
+    """Analyze a list of texts in one call; results come back in input order"""
+    try:
+        data = request.get_json()
+        texts = data.get('texts') if data else None
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            return jsonify({
+                'success': False,
+                'error': 'Provide "texts" as a list of strings'
+            }), 400
+        
+        if len(texts) > BATCH_MAX_TEXTS:
+            return jsonify({
+                'success': False,
+                'error': f'At most {BATCH_MAX_TEXTS} texts per request'
+            }), 413
+        
+        started = time.perf_counter()
+        results = process_texts(texts)
+        elapsed = time.perf_counter() - started
+        
+        return jsonify({
+            'success': True,
+            'count': len(results),
+            'results': [public_result(result) for result in results],
+            'total_ms': round(elapsed * 1000, 1)
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in batch text analysis: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 # Legacy endpoints (keep for compatibility)
 @app.route('/test-microphone')
 def test_mic():
@@ -268,6 +450,38 @@ def stt_endpoint():
             'error': str(e)
         }), 500
 
+def _uploaded_audio():
+    """(stream, content type) of audio sent with the request, or None if there is none"""
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('audio')
+        return (upload.stream, upload.mimetype) if upload else None
+    if request.mimetype.startswith('audio/') or request.mimetype == 'application/octet-stream':
+        return request.stream, request.content_type
+    return None
+
+@app.route('/speech-to-text/upload', methods=['POST'])
+def stt_upload_endpoint():
+    """Transcribe audio recorded by the client: a raw (optionally chunked) body or a multipart 'audio' file"""
+    try:
+        upload = _uploaded_audio()
+        if upload is None:
+            return jsonify({
+                'success': False,
+                'text': '',
+                'error': 'No audio provided. Send an audio/* body or a multipart "audio" file.'
+            }), 400
+        
+        stream, content_type = upload
+        result = transcribe_audio(stream, content_type, sample_rate=request.args.get('sample_rate', type=int))
+        return jsonify(result)
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'text': '',
+            'error': str(e)
+        }), 500
+
 @app.route('/text-to-speech', methods=['POST'])
 def tts_endpoint():
     try:
@@ -299,7 +513,12 @@ def voices_endpoint():
 def complete_voice_therapy():
     """Complete voice-to-voice therapy session with full context"""
     try:
-        data = request.get_json() if request.is_json else {}
+        # Audio recorded by the client replaces the server microphone
+        upload = _uploaded_audio()
+        if upload:
+            data = {**request.args.to_dict(), **request.form.to_dict()}
+        else:
+            data = request.get_json() if request.is_json else {}
         session_id = data.get('session_id')
         timeout = data.get('timeout', 12)
         phrase_time_limit = data.get('phrase_time_limit', 20)
@@ -319,24 +538,30 @@ def complete_voice_therapy():
         
         logger.info(f"Starting complete voice therapy for session {session_id}")
         
-        # Step 1: Listen with encouraging prompts
-        if therapy_session.message_count == 0:
+        # Step 1: Listen with encouraging prompts (uploads were already recorded by the client,
+        # and a listening session is heard whenever the user speaks)
+        prompt = upload is None and not voice_listener.is_listening(session_id)
+        if prompt and therapy_session.message_count == 0:
             # First message - give more time and encouragement
             prompt_message = "I'm listening. Please share what's on your mind."
-            text_to_speech(prompt_message, async_mode=False)
+            text_to_speech(prompt_message, priority=PRIORITY_INTERACTIVE)
             timeout = 15
             phrase_time_limit = 25
-        else:
+        elif prompt:
             # Continuing conversation
             prompt_message = "I'm here to listen."
-            text_to_speech(prompt_message, async_mode=False)
+            text_to_speech(prompt_message, priority=PRIORITY_INTERACTIVE)
         
         # Step 2: Capture speech with extended timeouts
-        stt_result = speech_to_text(timeout=timeout, phrase_time_limit=phrase_time_limit)
+        if upload:
+            stream, content_type = upload
+            stt_result = transcribe_audio(stream, content_type, sample_rate=request.args.get('sample_rate', type=int))
+        else:
+            stt_result = voice_listener.capture_utterance(session_id, timeout=timeout, phrase_time_limit=phrase_time_limit)
         if not stt_result['success']:
             # Gentle error handling
             error_response = "I didn't catch that. Would you like to try again? Take your time."
-            text_to_speech(error_response, async_mode=False)
+            text_to_speech(error_response, priority=PRIORITY_INTERACTIVE)
             return jsonify({
                 'success': False,
                 'step': 'speech-to-text',
@@ -358,7 +583,7 @@ def complete_voice_therapy():
         therapy_session.add_exchange(user_input, nlp_result, ai_response)
         
         # Step 6: Speak response with proper pacing
-        tts_result = text_to_speech(ai_response, async_mode=False)
+        tts_result = text_to_speech(ai_response, priority=PRIORITY_INTERACTIVE)
         
         # Step 7: Return comprehensive session data
         return jsonify({
@@ -392,11 +617,61 @@ def complete_voice_therapy():
             'error': str(e)
         }), 500
 
+@app.route('/listening/start', methods=['POST'])
+def start_listening():
+    """Keep the microphone open for a session; what the user says is queued for its voice turns"""
+    try:
+        data = request.get_json() if request.is_json else {}
+        session_id = data.get('session_id') or session.get('current_session_id')
+        if not session_id or not session_manager.get_session(session_id):
+            return jsonify({
+                'success': False,
+                'error': 'Session not found. Please start a new session.'
+            }), 404
+        
+        previous = voice_listener.start(session_id)
+        return jsonify({
+            'success': True,
+            'session_id': session_id,
+            'listening': True,
+            'previous_session_id': previous
+        })
+        
+    except Exception as e:
+        logger.error(f"Error starting background listening: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/listening/stop', methods=['POST'])
+def stop_listening():
+    """Close the microphone; utterances already queued stay available to the session"""
+    try:
+        data = request.get_json() if request.is_json else {}
+        session_id = data.get('session_id') or session.get('current_session_id')
+        stopped = voice_listener.stop(session_id)
+        return jsonify({
+            'success': True,
+            'session_id': session_id,
+            'listening': False,
+            'was_listening': stopped,
+            'pending_utterances': voice_listener.pending(session_id) if session_id else 0
+        })
+        
+    except Exception as e:
+        logger.error(f"Error stopping background listening: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @app.route('/session-summary/<session_id>')
 def get_session_summary(session_id):
     """Get a comprehensive session summary"""
     try:
-        therapy_session = session_manager.get_session(session_id)
+        # Ended sessions are served from the archive
+        therapy_session = session_manager.get_session(session_id) or session_manager.get_archived_session(session_id)
         if not therapy_session:
             return jsonify({
                 'success': False,
@@ -432,6 +707,46 @@ def get_session_summary(session_id):
             'error': str(e)
         }), 500
 
+# Worker-to-worker session handoff, used by the dispatcher when the hash ring changes
+
+@app.route('/internal/sessions/<session_id>/handoff', methods=['POST'])
+def handoff_session(session_id):
+    """Release an active session and return its record for another worker"""
+    if not internal_request_allowed(request.remote_addr, request.headers.get(INTERNAL_TOKEN_HEADER)):
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    
+    record = session_manager.export_session(session_id)
+    if record is None:
+        return jsonify({
+            'success': False,
+            'error': 'Session not found'
+        }), 404
+    return jsonify({'success': True, 'session': record})
+
+@app.route('/internal/sessions', methods=['POST'])
+def adopt_session():
+    """Take over an active session handed off by another worker"""
+    if not internal_request_allowed(request.remote_addr, request.headers.get(INTERNAL_TOKEN_HEADER)):
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    record = data.get('session')
+    if not isinstance(record, dict) or 'session_id' not in record:
+        return jsonify({
+            'success': False,
+            'error': 'Session record required'
+        }), 400
+    
+    try:
+        therapy_session = session_manager.import_session(record)
+        return jsonify({'success': True, 'session_id': therapy_session.session_id})
+    except Exception as e:
+        logger.error(f"Error adopting session: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 
 if __name__ == "__main__":
-    app.run(port=5000, debug=True)
+    app.run(host=HOST, port=PORT, debug=FLASK_DEBUG)
@@ -0,0 +1,144 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+class _BatchRequest:
+    __slots__ = ('item', 'length', 'future', 'enqueued_at')
+
+    def __init__(self, item, length: int):
+        self.item = item
+        self.length = length
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+class MicroBatcher:
+    """
+    Collects concurrent inference calls into small batches.
+
+    Callers block in infer() while a worker thread waits up to max_wait_ms
+    (or until max_batch_size requests arrive), groups the requests into buckets
+    of similar sequence length, and runs each bucket through process_batch as
+    one padded batch. Results are handed back to each caller in order.
+    """
+
+    def __init__(self, process_batch: Callable[[List], List], max_batch_size: int = 16,
+                 max_wait_ms: float = 5.0, length_fn: Optional[Callable] = None,
+                 bucket_width: int = 16, name: str = 'micro-batcher'):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.length_fn = length_fn or len
+        self.bucket_width = max(1, bucket_width)
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = {}
+        self._queue_waits = deque(maxlen=1000)
+        self._total_batches = 0
+        self._total_items = 0
+        self._max_queue_wait = 0.0
+
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, item) -> Future:
+        """Queue an item for the next batch and return a future for its result"""
+        request = _BatchRequest(item, self.length_fn(item))
+        self._queue.put(request)
+        return request.future
+
+    def infer(self, item, timeout: Optional[float] = None):
+        """Run a single item through the batcher and wait for its result"""
+        return self.submit(item).result(timeout=timeout)
+
+    def stop(self):
+        """Stop the worker once queued requests have been processed"""
+        self._queue.put(_STOP)
+        self._worker.join()
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+
+            batch = [first]
+            stopping = False
+            deadline = first.enqueued_at + self.max_wait
+            while len(batch) < self.max_batch_size:
+                # Once the window has passed, still take whatever is already queued
+                remaining = deadline - time.perf_counter()
+                try:
+                    if remaining > 0:
+                        request = self._queue.get(timeout=remaining)
+                    else:
+                        request = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is _STOP:
+                    stopping = True
+                    break
+                batch.append(request)
+
+            self._dispatch(batch)
+            if stopping:
+                return
+
+    def _dispatch(self, batch: List[_BatchRequest]):
+        """Split a collected batch into length buckets and run each one"""
+        buckets = {}
+        for request in batch:
+            buckets.setdefault(request.length // self.bucket_width, []).append(request)
+
+        for _, requests in sorted(buckets.items()):
+            started = time.perf_counter()
+            self._record(requests, started)
+            try:
+                results = self.process_batch([request.item for request in requests])
+                for request, result in zip(requests, results):
+                    request.future.set_result(result)
+            except Exception as e:
+                logger.error(f"{self.name}: batch of {len(requests)} failed: {e}")
+                for request in requests:
+                    request.future.set_exception(e)
+
+    def _record(self, requests: List[_BatchRequest], started: float):
+        with self._stats_lock:
+            size = len(requests)
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+            self._total_batches += 1
+            self._total_items += size
+            for request in requests:
+                wait = started - request.enqueued_at
+                self._queue_waits.append(wait)
+                self._max_queue_wait = max(self._max_queue_wait, wait)
+
+    def stats(self) -> dict:
+        """Batch-size and queue-wait metrics"""
+        with self._stats_lock:
+            waits = sorted(self._queue_waits)
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'total_batches': self._total_batches,
+                'total_items': self._total_items,
+                'mean_batch_size': self._total_items / self._total_batches if self._total_batches else 0.0,
+                'batch_size_histogram': dict(sorted(self._batch_sizes.items())),
+                'queue_wait_ms': {
+                    'p50': waits[len(waits) // 2] * 1000 if waits else 0.0,
+                    'p95': waits[int(len(waits) * 0.95)] * 1000 if waits else 0.0,
+                    'max': self._max_queue_wait * 1000
+                },
+                'queue_depth': self._queue.qsize()
+            }
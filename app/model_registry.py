@@ -0,0 +1,129 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class ModelEntry:
+    """A registered model together with its load state"""
+
+    def __init__(self, name: str, loader: Callable, warmup: Optional[Callable] = None):
+        self.name = name
+        self.loader = loader
+        self.warmup = warmup
+        self.state = 'registered'  # registered -> loading -> ready | failed
+        self.value = None
+        self.error = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.lock = threading.Lock()
+        self.loaded = threading.Event()
+
+    def status(self) -> dict:
+        return {
+            'state': self.state,
+            'load_seconds': self.load_seconds,
+            'warmup_seconds': self.warmup_seconds,
+            'error': self.error
+        }
+
+class ModelRegistry:
+    """
+    Lazily loads heavy models so importing the app stays cheap.
+
+    Each model is registered with a loader (and optionally a warm-up inference).
+    Models load on first use via get(), or ahead of time on a background thread
+    via warm_up_async().
+    """
+
+    def __init__(self):
+        self.entries: Dict[str, ModelEntry] = {}
+        self.created_at = time.perf_counter()
+        self.ready_at = None
+        self._warmup_thread = None
+
+    def register(self, name: str, loader: Callable, warmup: Optional[Callable] = None):
+        """Register a model loader; nothing is loaded until get() or warm_up()"""
+        self.entries[name] = ModelEntry(name, loader, warmup)
+
+    def get(self, name: str):
+        """Return the loaded model, loading it on the calling thread if needed"""
+        entry = self.entries[name]
+        if entry.loaded.is_set():
+            return entry.value
+
+        with entry.lock:
+            # Another thread may have finished loading while we waited
+            if not entry.loaded.is_set():
+                self._load(entry)
+        return entry.value
+
+    def _load(self, entry: ModelEntry):
+        entry.state = 'loading'
+        logger.info(f"Loading model '{entry.name}'...")
+        try:
+            start = time.perf_counter()
+            entry.value = entry.loader()
+            entry.load_seconds = time.perf_counter() - start
+
+            if entry.warmup:
+                start = time.perf_counter()
+                entry.warmup(entry.value)
+                entry.warmup_seconds = time.perf_counter() - start
+
+            entry.state = 'ready'
+            logger.info(f"Model '{entry.name}' ready (load {entry.load_seconds:.2f}s)")
+        except Exception as e:
+            entry.state = 'failed'
+            entry.error = str(e)
+            logger.error(f"Failed to load model '{entry.name}': {e}")
+        finally:
+            entry.loaded.set()
+            if self.ready_at is None and self.is_ready():
+                self.ready_at = time.perf_counter()
+
+    def warm_up(self, names: Optional[List[str]] = None):
+        """Load and warm up models on the calling thread"""
+        for name in names or list(self.entries):
+            self.get(name)
+
+    def warm_up_async(self, names: Optional[List[str]] = None) -> threading.Thread:
+        """Load and warm up models on a background thread"""
+        if self._warmup_thread is None or not self._warmup_thread.is_alive():
+            self._warmup_thread = threading.Thread(
+                target=self.warm_up,
+                args=(names,),
+                name='model-warmup',
+                daemon=True
+            )
+            self._warmup_thread.start()
+        return self._warmup_thread
+
+    def is_ready(self) -> bool:
+        """True once every registered model has finished loading (or failed to)"""
+        return all(entry.loaded.is_set() for entry in self.entries.values())
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """Block until all models have settled, or until timeout elapses"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for entry in list(self.entries.values()):
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not entry.loaded.wait(remaining):
+                return False
+        return True
+
+    def status(self) -> dict:
+        """Readiness report for /readyz"""
+        models = {name: entry.status() for name, entry in self.entries.items()}
+        return {
+            'ready': self.is_ready(),
+            'degraded': any(m['state'] == 'failed' for m in models.values()),
+            'time_to_ready_seconds': (self.ready_at - self.created_at) if self.ready_at else None,
+            'models': models
+        }
+
+# Global model registry
+model_registry = ModelRegistry()
@@ -1,72 +1,46 @@
+import copy
 import re
 import logging
-from typing import Dict, List
-from sentiment import analyze_sentiment
+import os
+from typing import Dict, List, Optional
+from sentiment import analyze_sentiment, analyze_sentiments
+from result_cache import LRUCache
+from lexicon import LexiconMatches, lexicon
+from document import AnalyzedDocument, analyze_document
+from model_registry import model_registry
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Optional file of common utterances (one per line) used to prepopulate the result cache
+COMMON_UTTERANCES_FILE = os.getenv('COMMON_UTTERANCES_FILE')
+
 class NLPProcessor:
     def __init__(self):
-        # Therapy-related keywords and patterns
-        self.therapy_patterns = {
-            'greeting': ['hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening'],
-            'feelings': ['feel', 'feeling', 'felt', 'emotion', 'emotional'],
-            'problems': ['problem', 'issue', 'trouble', 'difficulty', 'struggle', 'challenge'],
-            'relationships': ['relationship', 'partner', 'friend', 'family', 'parents', 'spouse'],
-            'work_stress': ['work', 'job', 'boss', 'colleague', 'career', 'workplace'],
-            'mental_health': ['anxiety', 'depression', 'stress', 'panic', 'overwhelmed', 'therapy']
-        }
-        
-        self.question_patterns = [
-            'how', 'what', 'why', 'when', 'where', 'who', 'can you', 'could you', 'would you'
-        ]
+        # process_text results keyed on cleaned text
+        self.cache = LRUCache()
     
-    def extract_keywords(self, text: str) -> Dict[str, List[str]]:
-        """Extract therapy-relevant keywords from text"""
+    def extract_keywords(self, text: str, matches: Optional[LexiconMatches] = None) -> Dict[str, List[str]]:
+        """Extract therapy-relevant keywords from text (or from lexicon matches already computed for it)"""
         if not text:
             return {}
         
-        text_lower = text.lower()
-        found_categories = {}
-        
-        for category, keywords in self.therapy_patterns.items():
-            found_words = []
-            for keyword in keywords:
-                if keyword in text_lower:
-                    found_words.append(keyword)
-            
-            if found_words:
-                found_categories[category] = found_words
-        
-        return found_categories
+        matches = matches if matches is not None else lexicon.scan(text)
+        return matches.categories('topic.')
     
-    def detect_question(self, text: str) -> bool:
+    def detect_question(self, text: str, matches: Optional[LexiconMatches] = None) -> bool:
         """Check if the text contains a question"""
         if not text:
             return False
         
-        text_lower = text.lower().strip()
-        
         # Check for question mark
         if '?' in text:
             return True
         
-        # Enhanced question patterns - especially for help requests
-        question_patterns = [
-            'how', 'what', 'why', 'when', 'where', 'who', 'which',
-            'can you', 'could you', 'would you', 'should i',
-            'do you have', 'are there', 'is there', 'have you',
-            'any suggestions', 'any advice', 'any strategies', 'any tips',
-            'help me', 'what should', 'how do i', 'how can i'
-        ]
-        # Check for question words at the beginning
-        for pattern in question_patterns:
-            if pattern in text_lower:
-                return True
-        
-        return False
+        # Question words and help-request phrasing
+        matches = matches if matches is not None else lexicon.scan(text)
+        return 'question' in matches
     
     def categorize_topic(self, keywords: Dict[str, List[str]]) -> str:
         """Categorize the main topic based on keywords"""
@@ -98,31 +72,92 @@ class NLPProcessor:
                 'keywords': dict,
                 'is_question': bool,
                 'topic_category': str,
-                'response_type': str
+                'response_type': str,
+                'document': AnalyzedDocument  # internal; strip with public_result() before serializing
             }
         """
-        if not text or not text.strip():
-            return {
-                'original_text': text,
-                'cleaned_text': '',
-                'sentiment': {'sentiment': 'neutral', 'confidence': 0.5},
-                'keywords': {},
-                'is_question': False,
-                'topic_category': 'general',
-                'response_type': 'greeting'
-            }
+        # Normalize, tokenize and scan once; downstream consumers reuse this
+        document = analyze_document(text)
         
-        # Clean the text
-        cleaned_text = self.clean_text(text)
+        if not document.lowered:
+            return self._empty_result(text, document)
+        
+        cached = self._cached_result(text, document)
+        if cached is not None:
+            return cached
         
         # Analyze sentiment
-        sentiment_result = analyze_sentiment(cleaned_text)
+        sentiment_result = analyze_sentiment(document.lowered, document=document)
+        return self._build_result(text, document, sentiment_result)
+    
+    def process_texts(self, texts: List[str]) -> List[dict]:
+        """
+        Bulk form of process_text
+        
+        Sentiment for every uncached text runs through the transformer in
+        padded batches; the keyword and topic stages read each text's
+        single lexicon scan.
+        
+        Args:
+            texts: Input texts to process
+            
+        Returns:
+            list: One process_text result per text, in order
+        """
+        documents = [analyze_document(text) for text in texts]
+        results = [None] * len(texts)
+        misses = []
+        
+        for i, (text, document) in enumerate(zip(texts, documents)):
+            if not document.lowered:
+                results[i] = self._empty_result(text, document)
+            else:
+                results[i] = self._cached_result(text, document)
+                if results[i] is None:
+                    misses.append(i)
+        
+        if misses:
+            sentiments = analyze_sentiments(
+                [documents[i].lowered for i in misses],
+                [documents[i] for i in misses]
+            )
+            for i, sentiment_result in zip(misses, sentiments):
+                results[i] = self._build_result(texts[i], documents[i], sentiment_result)
+        
+        logger.info(f"NLP batch processing: {len(texts)} texts, {len(texts) - len(misses)} from cache")
+        return results
+    
+    def _empty_result(self, text: str, document: AnalyzedDocument) -> dict:
+        return {
+            'original_text': text,
+            'cleaned_text': '',
+            'sentiment': {'sentiment': 'neutral', 'confidence': 0.5},
+            'keywords': {},
+            'is_question': False,
+            'topic_category': 'general',
+            'response_type': 'greeting',
+            'document': document
+        }
+    
+    def _cached_result(self, text: str, document: AnalyzedDocument) -> Optional[dict]:
+        cached = self.cache.get(document.lowered)
+        if cached is None:
+            return None
+        # The document is immutable, so the copy shares it
+        result = copy.deepcopy(cached)
+        result['original_text'] = text
+        result['document'] = result['document'].with_original(text)
+        return result
+    
+    def _build_result(self, text: str, document: AnalyzedDocument, sentiment_result: dict) -> dict:
+        """Keyword, question, topic and response-type stages from the document's lexicon matches"""
+        cleaned_text = document.lowered
         
         # Extract keywords
-        keywords = self.extract_keywords(cleaned_text)
+        keywords = self.extract_keywords(cleaned_text, document.matches)
         
         # Detect if it's a question
-        is_question = self.detect_question(cleaned_text)
+        is_question = self.detect_question(cleaned_text, document.matches)
         
         # Categorize topic
         topic_category = self.categorize_topic(keywords)
@@ -142,12 +177,28 @@ class NLPProcessor:
             'keywords': keywords,
             'is_question': is_question,
             'topic_category': topic_category,
-            'response_type': response_type
+            'response_type': response_type,
+            'document': document
         }
         
         logger.info(f"NLP Processing: topic={topic_category}, sentiment={sentiment_result['sentiment']}, response_type={response_type}")
+        
+        if sentiment_result.get('model') != 'fallback':
+            self.cache.put(cleaned_text, copy.deepcopy(result))
         return result
     
+    def prepopulate_cache(self, path: str) -> int:
+        """Run common utterances through the pipeline so they are served from cache"""
+        count = 0
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                utterance = line.strip()
+                if utterance and not utterance.startswith('#'):
+                    self.process_text(utterance)
+                    count += 1
+        logger.info(f"Prepopulated NLP cache with {count} utterances from {path}")
+        return count
+    
     def clean_text(self, text: str) -> str:
         """Clean and normalize text"""
         if not text:
@@ -194,6 +245,17 @@ class NLPProcessor:
 # Global NLP processor instance
 nlp_processor = NLPProcessor()
 
+if COMMON_UTTERANCES_FILE:
+    model_registry.register('utterance_cache', lambda: nlp_processor.prepopulate_cache(COMMON_UTTERANCES_FILE))
+
 def process_text(text: str) -> dict:
     """Convenience function for NLP processing"""
     return nlp_processor.process_text(text)
+
+def process_texts(texts: List[str]) -> List[dict]:
+    """Convenience function for bulk NLP processing"""
+    return nlp_processor.process_texts(texts)
+
+def public_result(nlp_result: dict) -> dict:
+    """process_text result without the internal document, for JSON responses"""
+    return {key: value for key, value in nlp_result.items() if key != 'document'}
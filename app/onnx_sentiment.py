@@ -0,0 +1,112 @@
+import logging
+import os
+from typing import List, Union
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Exported (and quantized) models are cached here between runs
+ONNX_CACHE_DIR = os.getenv('ONNX_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'onnx_models'))
+
+def export_to_onnx(model_name: str, quantize: bool = False, cache_dir: str = ONNX_CACHE_DIR) -> str:
+    """
+    Export a sequence-classification model to ONNX, optionally with dynamic int8 quantization
+
+    Returns:
+        str: path of the .onnx file to load
+    """
+    output_dir = os.path.join(cache_dir, model_name.replace('/', '__'))
+    os.makedirs(output_dir, exist_ok=True)
+    fp32_path = os.path.join(output_dir, 'model.onnx')
+    int8_path = os.path.join(output_dir, 'model.int8.onnx')
+
+    if not os.path.exists(fp32_path):
+        import torch
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+        logger.info(f"Exporting {model_name} to ONNX...")
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForSequenceClassification.from_pretrained(model_name)
+        model.eval()
+
+        dummy = tokenizer("Exporting the sentiment model", return_tensors='pt')
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (dummy['input_ids'], dummy['attention_mask']),
+                fp32_path,
+                input_names=['input_ids', 'attention_mask'],
+                output_names=['logits'],
+                dynamic_axes={
+                    'input_ids': {0: 'batch', 1: 'sequence'},
+                    'attention_mask': {0: 'batch', 1: 'sequence'},
+                    'logits': {0: 'batch'}
+                },
+                opset_version=14
+            )
+        logger.info(f"ONNX model written to {fp32_path}")
+
+    if not quantize:
+        return fp32_path
+
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        logger.info("Quantizing ONNX model to int8...")
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        logger.info(f"Quantized ONNX model written to {int8_path}")
+    return int8_path
+
+class OnnxSentimentPipeline:
+    """
+    Drop-in replacement for the HuggingFace sentiment pipeline backed by ONNX Runtime.
+
+    Called like pipeline(..., return_all_scores=True): returns one list of
+    {'label', 'score'} dicts per input text, so analyze_with_huggingface and the
+    micro-batcher work unchanged.
+    """
+
+    def __init__(self, model_name: str, quantize: bool = False):
+        import onnxruntime as ort
+        from transformers import AutoConfig, AutoTokenizer
+
+        self.model_name = model_name
+        self.quantize = quantize
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.id2label = AutoConfig.from_pretrained(model_name).id2label
+
+        model_path = export_to_onnx(model_name, quantize=quantize)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def __call__(self, texts: Union[str, List[str]], batch_size: int = None) -> List[List[dict]]:
+        import numpy as np
+
+        if isinstance(texts, str):
+            texts = [texts]
+        batch_size = batch_size or len(texts)
+
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            encoded = self.tokenizer(
+                texts[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                return_tensors='np'
+            )
+            feeds = {name: encoded[name].astype(np.int64) for name in self.input_names}
+            logits = self.session.run(None, feeds)[0]
+
+            # Softmax, as the pytorch pipeline applies for single-label classifiers
+            exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+            probabilities = exp / exp.sum(axis=-1, keepdims=True)
+
+            for row in probabilities:
+                outputs.append([
+                    {'label': self.id2label[index], 'score': float(score)}
+                    for index, score in enumerate(row)
+                ])
+        return outputs
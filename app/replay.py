@@ -0,0 +1,241 @@
+"""
+Offline transcript replay.
+
+Streams a JSONL file of archived conversations through the NLP pipeline and
+session analytics without going through Flask, and writes one session
+summary per line:
+
+    python replay.py conversations.jsonl -o summaries.jsonl --workers 4
+
+Each input line is a conversation:
+
+    {"session_id": "abc", "messages": ["I feel anxious", {"text": "...", "ai_response": "..."}]}
+
+Completed session ids are appended to a checkpoint file, so an interrupted
+run picks up where it stopped when started again with the same arguments.
+Sessions that fail go to OUTPUT.errors instead of the output, and are
+retried on the next run.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterator, Optional, Set
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Seconds between progress reports
+REPLAY_REPORT_INTERVAL = float(os.getenv('REPLAY_REPORT_INTERVAL', '10'))
+
+# Models the replay pipeline uses; generation and speech are never loaded
+REPLAY_MODELS = ['textblob', 'sentiment', 'utterance_cache']
+
+def _init_worker(torch_threads: int):
+    """Load and warm the NLP models once per worker process"""
+    try:
+        import torch
+        # Workers share the CPU, so keep each one from claiming every core
+        torch.set_num_threads(torch_threads)
+    except ImportError:
+        pass
+    
+    # A spawned worker starts empty; importing the pipeline registers its models
+    import nlp_pipeline  # noqa: F401
+    from model_registry import model_registry
+    model_registry.warm_up([name for name in REPLAY_MODELS if name in model_registry.entries])
+
+def replay_session(record: dict) -> dict:
+    """Run one archived conversation through the pipeline and summarize it"""
+    from nlp_pipeline import process_texts
+    from session_manager import TherapySession
+    
+    started = time.perf_counter()
+    session = TherapySession(record['session_id'])
+    
+    messages = [message if isinstance(message, dict) else {'text': message} for message in record.get('messages', [])]
+    texts = [message.get('text', '') for message in messages]
+    
+    # Turns are analyzed independently, so the whole conversation goes through the batch API
+    for message, text, nlp_result in zip(messages, texts, process_texts(texts)):
+        session.add_exchange(text, nlp_result, message.get('ai_response', ''))
+    
+    return {
+        'session_id': session.session_id,
+        'messages': len(messages),
+        'summary': session.generate_session_summary(),
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+    }
+
+def read_conversations(path: str, skip: Set[str]) -> Iterator[dict]:
+    """Stream conversations from JSONL, skipping checkpointed sessions"""
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning(f"Skipping line {line_number}: invalid JSON ({e})")
+                continue
+            # Line numbers keep ids stable across runs for records without one
+            record.setdefault('session_id', f"line-{line_number}")
+            if record['session_id'] in skip:
+                continue
+            yield record
+
+def load_checkpoint(path: str) -> Set[str]:
+    """Session ids already written by an earlier run"""
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding='utf-8') as f:
+        return {line.strip() for line in f if line.strip()}
+
+class ReplayStats:
+    """Running counters and the throughput report"""
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sessions = 0
+        self.messages = 0
+        self.failures = 0
+        self.last_report = self.started
+    
+    def record(self, result: dict):
+        if 'error' in result:
+            self.failures += 1
+        else:
+            self.sessions += 1
+            self.messages += result['messages']
+    
+    def report(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        return {
+            'sessions': self.sessions,
+            'messages': self.messages,
+            'failures': self.failures,
+            'elapsed_seconds': round(elapsed, 1),
+            'sessions_per_second': round(self.sessions / elapsed, 2) if elapsed else 0.0,
+            'messages_per_second': round(self.messages / elapsed, 2) if elapsed else 0.0
+        }
+    
+    def maybe_log(self):
+        now = time.perf_counter()
+        if now - self.last_report >= REPLAY_REPORT_INTERVAL:
+            self.last_report = now
+            logger.info(f"Replay progress: {self.report()}")
+
+def replay(input_path: str, output_path: str, workers: int, checkpoint_path: Optional[str] = None,
+           max_in_flight: Optional[int] = None, restart: bool = False) -> dict:
+    """
+    Replay every conversation in input_path and stream summaries to output_path
+
+    Args:
+        input_path: JSONL file of conversations
+        output_path: JSONL file of session summaries (appended to when resuming);
+            failed sessions are written to output_path + '.errors'
+        workers: Worker processes; 0 runs in this process
+        checkpoint_path: File of completed session ids (default: output_path + '.checkpoint')
+        max_in_flight: Sessions queued at once; bounds memory on large inputs
+        restart: Ignore and overwrite an existing checkpoint and output
+
+    Returns:
+        dict: Throughput report
+    """
+    checkpoint_path = checkpoint_path or output_path + '.checkpoint'
+    done = set() if restart else load_checkpoint(checkpoint_path)
+    if done:
+        logger.info(f"Resuming: {len(done)} sessions already in {checkpoint_path}")
+    
+    mode = 'w' if restart or not done else 'a'
+    stats = ReplayStats()
+    conversations = read_conversations(input_path, done)
+    
+    with open(output_path, mode, encoding='utf-8') as output, \
+            open(output_path + '.errors', mode, encoding='utf-8') as errors, \
+            open(checkpoint_path, mode, encoding='utf-8') as checkpoint:
+        def write(result: dict):
+            # Failed sessions stay out of the output and the checkpoint, so a
+            # resumed run retries them without duplicating output records
+            if 'error' in result:
+                errors.write(json.dumps(result) + '\n')
+                errors.flush()
+            else:
+                output.write(json.dumps(result) + '\n')
+                output.flush()
+                checkpoint.write(result['session_id'] + '\n')
+                checkpoint.flush()
+            stats.record(result)
+            stats.maybe_log()
+        
+        if workers <= 0:
+            _init_worker(os.cpu_count() or 1)
+            for record in conversations:
+                write(_replay_or_error(record))
+        else:
+            _replay_with_pool(conversations, workers, max_in_flight or workers * 4, write)
+    
+    report = stats.report()
+    logger.info(f"Replay finished: {report}")
+    return report
+
+def _replay_or_error(record: dict) -> dict:
+    try:
+        return replay_session(record)
+    except Exception as e:
+        logger.error(f"Replay failed for session {record['session_id']}: {e}")
+        return {'session_id': record['session_id'], 'error': str(e)}
+
+def _replay_with_pool(conversations: Iterator[dict], workers: int, max_in_flight: int, write):
+    """Keep at most max_in_flight sessions submitted and write results as they complete"""
+    torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    # spawn: forking a process that has touched torch or started threads is unsafe
+    context = multiprocessing.get_context('spawn')
+    
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(torch_threads,)) as pool:
+        in_flight = {}
+        exhausted = False
+        
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < max_in_flight:
+                record = next(conversations, None)
+                if record is None:
+                    exhausted = True
+                    break
+                in_flight[pool.submit(_replay_or_error, record)] = record['session_id']
+            
+            if not in_flight:
+                break
+            
+            completed, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in completed:
+                session_id = in_flight.pop(future)
+                try:
+                    write(future.result())
+                except Exception as e:
+                    # The worker process itself died
+                    logger.error(f"Replay worker failed for session {session_id}: {e}")
+                    write({'session_id': session_id, 'error': str(e)})
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay archived conversations through the NLP pipeline")
+    parser.add_argument('input', help="JSONL file of conversations")
+    parser.add_argument('-o', '--output', required=True, help="JSONL file for per-session summaries")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                        help="worker processes (0 runs in this process)")
+    parser.add_argument('--checkpoint', help="checkpoint file (default: OUTPUT.checkpoint)")
+    parser.add_argument('--max-in-flight', type=int, help="sessions queued at once (default: 4 per worker)")
+    parser.add_argument('--restart', action='store_true', help="ignore an existing checkpoint and start over")
+    args = parser.parse_args(argv)
+    
+    report = replay(args.input, args.output, args.workers, args.checkpoint, args.max_in_flight, args.restart)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,86 @@
-from textblob import TextBlob
+import copy
 import logging
-from transformers import pipeline
+import os
 import re
+from typing import List, Optional
+from model_registry import model_registry
+from micro_batcher import MicroBatcher
+from result_cache import LRUCache
+from lexicon import LexiconMatches, lexicon
+from document import AnalyzedDocument
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SENTIMENT_MODEL_NAME = "cardiffnlp/twitter-roberta-base-sentiment-latest"
+
+# Inference backend: 'pytorch' (default), 'onnx', or 'onnx-int8' (dynamically quantized)
+SENTIMENT_BACKEND = os.getenv('SENTIMENT_BACKEND', 'pytorch')
+
+# Cross-request micro-batching of transformer inference
+SENTIMENT_BATCHING = os.getenv('SENTIMENT_BATCHING', '1') == '1'
+SENTIMENT_BATCH_WINDOW_MS = float(os.getenv('SENTIMENT_BATCH_WINDOW_MS', '5'))
+SENTIMENT_MAX_BATCH_SIZE = int(os.getenv('SENTIMENT_MAX_BATCH_SIZE', '16'))
+SENTIMENT_BUCKET_WIDTH = int(os.getenv('SENTIMENT_BUCKET_WIDTH', '16'))
+
+# Chunk size for analyze_sentiments() bulk scoring
+SENTIMENT_BULK_BATCH_SIZE = int(os.getenv('SENTIMENT_BULK_BATCH_SIZE', '32'))
+
 class SentimentAnalyzer:
     def __init__(self):
+        # Models are loaded lazily through the model registry
         self.huggingface_analyzer = None
-        self.initialize_models()
+        self.batcher = None
+        # Results keyed on cleaned text; short utterances repeat a lot
+        self.cache = LRUCache()
     
     def initialize_models(self):
         """Initialize sentiment analysis models"""
         try:
             # Try to load HuggingFace model (more accurate)
-            logger.info("Loading HuggingFace sentiment model...")
-            self.huggingface_analyzer = pipeline(
-                "sentiment-analysis",
-                model="cardiffnlp/twitter-roberta-base-sentiment-latest",
-                return_all_scores=True
-            )
+            logger.info(f"Loading HuggingFace sentiment model ({SENTIMENT_BACKEND} backend)...")
+            self.huggingface_analyzer = self._load_backend(SENTIMENT_BACKEND)
             logger.info("HuggingFace model loaded successfully")
+            
+            if SENTIMENT_BATCHING:
+                self.batcher = MicroBatcher(
+                    self._run_batch,
+                    max_batch_size=SENTIMENT_MAX_BATCH_SIZE,
+                    max_wait_ms=SENTIMENT_BATCH_WINDOW_MS,
+                    length_fn=self._token_length,
+                    bucket_width=SENTIMENT_BUCKET_WIDTH,
+                    name='sentiment-batcher'
+                )
         except Exception as e:
             logger.warning(f"Could not load HuggingFace model: {e}")
             logger.info("Will use TextBlob as fallback")
+        return self.huggingface_analyzer
+    
+    def _load_backend(self, backend: str):
+        """Build the sentiment classifier for the selected inference backend"""
+        if backend in ('onnx', 'onnx-int8'):
+            try:
+                from onnx_sentiment import OnnxSentimentPipeline
+                return OnnxSentimentPipeline(SENTIMENT_MODEL_NAME, quantize=backend == 'onnx-int8')
+            except Exception as e:
+                logger.warning(f"Could not load ONNX backend: {e}")
+                logger.info("Falling back to the PyTorch pipeline")
+        
+        from transformers import pipeline
+        return pipeline(
+            "sentiment-analysis",
+            model=SENTIMENT_MODEL_NAME,
+            return_all_scores=True
+        )
+    
+    def _token_length(self, text: str) -> int:
+        """Sequence length used to bucket batched requests"""
+        return len(self.huggingface_analyzer.tokenizer.tokenize(text))
+    
+    def _run_batch(self, texts: list) -> list:
+        """Run one padded batch through the pipeline; one score list per text"""
+        return self.huggingface_analyzer(texts, batch_size=len(texts))
     
     def clean_text(self, text: str) -> str:
         """Clean and preprocess text"""
@@ -39,6 +94,7 @@ class SentimentAnalyzer:
     def analyze_with_textblob(self, text: str) -> dict:
         """Analyze sentiment using TextBlob (simple but reliable)"""
         try:
+            TextBlob = model_registry.get('textblob')
             blob = TextBlob(text)
             polarity = blob.sentiment.polarity  # -1 (negative) to 1 (positive)
             subjectivity = blob.sentiment.subjectivity  # 0 (objective) to 1 (subjective)
@@ -75,41 +131,67 @@ class SentimentAnalyzer:
     def analyze_with_huggingface(self, text: str) -> dict:
         """Analyze sentiment using HuggingFace transformer model"""
         try:
-            results = self.huggingface_analyzer(text)[0]
-            
-            # Convert HuggingFace labels to our format
-            label_mapping = {
-                'LABEL_0': 'negative',  # or 'NEGATIVE'
-                'LABEL_1': 'neutral',   # or 'NEUTRAL' 
-                'LABEL_2': 'positive',  # or 'POSITIVE'
-                'NEGATIVE': 'negative',
-                'NEUTRAL': 'neutral',
-                'POSITIVE': 'positive'
-            }
-            
-            # Find the highest confidence prediction
-            best_result = max(results, key=lambda x: x['score'])
-            sentiment = label_mapping.get(best_result['label'], 'neutral')
-            confidence = best_result['score']
+            if self.batcher:
+                results = self.batcher.infer(text)
+            else:
+                results = self.huggingface_analyzer(text)[0]
             
-            return {
-                'sentiment': sentiment,
-                'confidence': confidence,
-                'all_scores': results,
-                'model': 'huggingface'
-            }
+            return self._format_huggingface(results)
             
         except Exception as e:
             logger.error(f"HuggingFace analysis failed: {e}")
             # Fallback to TextBlob
             return self.analyze_with_textblob(text)
     
-    def analyze_sentiment(self, text: str) -> dict:
+    def _format_huggingface(self, results: list) -> dict:
+        """Convert one text's HuggingFace label scores to our format"""
+        # Convert HuggingFace labels to our format
+        label_mapping = {
+            'LABEL_0': 'negative',  # or 'NEGATIVE'
+            'LABEL_1': 'neutral',   # or 'NEUTRAL' 
+            'LABEL_2': 'positive',  # or 'POSITIVE'
+            'NEGATIVE': 'negative',
+            'NEUTRAL': 'neutral',
+            'POSITIVE': 'positive'
+        }
+        
+        # Find the highest confidence prediction
+        best_result = max(results, key=lambda x: x['score'])
+        sentiment = label_mapping.get(best_result['label'], 'neutral')
+        confidence = best_result['score']
+        
+        return {
+            'sentiment': sentiment,
+            'confidence': confidence,
+            'all_scores': results,
+            'model': 'huggingface'
+        }
+    
+    def _analyze_many_with_huggingface(self, texts: List[str]) -> List[dict]:
+        """Score texts in length-sorted chunks so each padded batch wastes little compute"""
+        order = sorted(range(len(texts)), key=lambda i: self._token_length(texts[i]))
+        results = [None] * len(texts)
+        
+        for start in range(0, len(order), SENTIMENT_BULK_BATCH_SIZE):
+            chunk = order[start:start + SENTIMENT_BULK_BATCH_SIZE]
+            try:
+                scores = self._run_batch([texts[i] for i in chunk])
+                for i, text_scores in zip(chunk, scores):
+                    results[i] = self._format_huggingface(text_scores)
+            except Exception as e:
+                logger.error(f"HuggingFace batch of {len(chunk)} failed: {e}")
+                for i in chunk:
+                    results[i] = self.analyze_with_textblob(texts[i])
+        
+        return results
+    
+    def analyze_sentiment(self, text: str, document: Optional[AnalyzedDocument] = None) -> dict:
         """
         Main sentiment analysis function
         
         Args:
             text: Input text to analyze
+            document: Optional AnalyzedDocument for text, reused instead of re-cleaning and re-scanning
             
         Returns:
             dict: {
@@ -129,7 +211,14 @@ class SentimentAnalyzer:
                 'raw_text': text
             }
         
-        cleaned_text = self.clean_text(text)
+        cleaned_text = document.lowered if document is not None else self.clean_text(text)
+        
+        cached = self.cache.get(cleaned_text)
+        if cached is not None:
+            return copy.deepcopy(cached)
+        
+        # Blocks only if the background warm-up has not finished yet
+        model_registry.get('sentiment')
         
         # Try HuggingFace first, fallback to TextBlob
         if self.huggingface_analyzer:
@@ -137,35 +226,101 @@ class SentimentAnalyzer:
         else:
             result = self.analyze_with_textblob(cleaned_text)
         
-        # Add emotion keywords detection
-        result['emotion_keywords'] = self.detect_emotion_keywords(cleaned_text)
-        result['raw_text'] = cleaned_text
-        
         logger.info(f"Sentiment analysis: {result['sentiment']} (confidence: {result['confidence']:.2f})")
-        return result
+        return self._finish_result(result, cleaned_text, document)
     
-    def detect_emotion_keywords(self, text: str) -> list:
-        """Detect emotional keywords in text"""
-        emotion_keywords = {
-            'positive': ['happy', 'joy', 'excited', 'great', 'wonderful', 'amazing', 'good', 'better', 'best', 'love', 'like'],
-            'negative': ['sad', 'depressed', 'anxious', 'worried', 'angry', 'frustrated', 'terrible', 'awful', 'hate', 'worst', 'bad'],
-            'anxiety': ['anxious', 'worried', 'nervous', 'scared', 'afraid', 'panic', 'stress', 'overwhelmed'],
-            'depression': ['sad', 'depressed', 'hopeless', 'empty', 'lonely', 'down', 'low']
-        }
+    def analyze_sentiments(self, texts: List[str], documents: Optional[List[AnalyzedDocument]] = None) -> List[dict]:
+        """
+        Bulk form of analyze_sentiment
+        
+        Cache misses are deduplicated and run through the transformer in
+        padded batches instead of one call per text.
+        
+        Args:
+            texts: Texts to analyze
+            documents: Optional AnalyzedDocument per text
+            
+        Returns:
+            list: One analyze_sentiment result per text, in order
+        """
+        documents = documents or [None] * len(texts)
+        results = [None] * len(texts)
+        pending = {}  # cleaned text -> indexes waiting for it
         
-        found_keywords = []
-        text_lower = text.lower()
+        for i, (text, document) in enumerate(zip(texts, documents)):
+            if not text or not text.strip():
+                results[i] = self.analyze_sentiment(text)
+                continue
+            cleaned_text = document.lowered if document is not None else self.clean_text(text)
+            cached = self.cache.get(cleaned_text)
+            if cached is not None:
+                results[i] = copy.deepcopy(cached)
+            else:
+                pending.setdefault(cleaned_text, []).append(i)
+        
+        if not pending:
+            return results
         
-        for category, keywords in emotion_keywords.items():
-            for keyword in keywords:
-                if keyword in text_lower:
-                    found_keywords.append({'keyword': keyword, 'category': category})
+        # Blocks only if the background warm-up has not finished yet
+        model_registry.get('sentiment')
         
-        return found_keywords
+        unique_texts = list(pending)
+        if self.huggingface_analyzer:
+            analyzed = self._analyze_many_with_huggingface(unique_texts)
+        else:
+            analyzed = [self.analyze_with_textblob(text) for text in unique_texts]
+        
+        for cleaned_text, result in zip(unique_texts, analyzed):
+            indexes = pending[cleaned_text]
+            result = self._finish_result(result, cleaned_text, documents[indexes[0]])
+            for i in indexes:
+                results[i] = copy.deepcopy(result)
+        
+        logger.info(f"Bulk sentiment analysis: {len(texts)} texts, {len(unique_texts)} run through the model")
+        return results
+    
+    def _finish_result(self, result: dict, cleaned_text: str, document: Optional[AnalyzedDocument]) -> dict:
+        """Add emotion keywords and the cleaned text, and cache the result"""
+        # Add emotion keywords detection
+        result['emotion_keywords'] = self.detect_emotion_keywords(cleaned_text, document.matches if document is not None else None)
+        result['raw_text'] = cleaned_text
+        
+        # Never cache the error fallback so a transient failure is retried
+        if result['model'] != 'fallback':
+            self.cache.put(cleaned_text, copy.deepcopy(result))
+        return result
+    
+    def detect_emotion_keywords(self, text: str, matches: Optional[LexiconMatches] = None) -> list:
+        """Detect emotional keywords in text (or in lexicon matches already computed for it)"""
+        matches = matches if matches is not None else lexicon.scan(text)
+        emotions = matches.categories('emotion.')
+        return [
+            {'keyword': keyword, 'category': category}
+            for category, keywords in emotions.items()
+            for keyword in keywords
+        ]
 
 # Global analyzer instance
 sentiment_analyzer = SentimentAnalyzer()
 
-def analyze_sentiment(text: str) -> dict:
+def _load_huggingface_model():
+    """Registry loader; raises so /readyz reports the TextBlob fallback as degraded"""
+    analyzer = sentiment_analyzer.initialize_models()
+    if analyzer is None:
+        raise RuntimeError("HuggingFace sentiment model unavailable, using TextBlob fallback")
+    return analyzer
+
+def _load_textblob():
+    from textblob import TextBlob
+    return TextBlob
+
+model_registry.register('textblob', _load_textblob, warmup=lambda TextBlob: TextBlob("warm up").sentiment)
+model_registry.register('sentiment', _load_huggingface_model, warmup=lambda analyzer: analyzer("warm up"))
+
+def analyze_sentiment(text: str, document: Optional[AnalyzedDocument] = None) -> dict:
     """Convenience function for sentiment analysis"""
-    return sentiment_analyzer.analyze_sentiment(text)
+    return sentiment_analyzer.analyze_sentiment(text, document)
+
+def analyze_sentiments(texts: List[str], documents: Optional[List[AnalyzedDocument]] = None) -> List[dict]:
+    """Convenience function for bulk sentiment analysis"""
+    return sentiment_analyzer.analyze_sentiments(texts, documents)
@@ -1,16 +1,113 @@
-import uuid
+import atexit
+import copy
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import logging
+from document import AnalyzedDocument, document_for
+from session_store import ColdSessionArchive, SessionStore, WriteBehindWriter, create_session_store
+from sharding import new_session_id
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Active sessions idle this long are ended by the sweeper (0 disables expiry)
+SESSION_IDLE_TTL_SECONDS = float(os.getenv('SESSION_IDLE_TTL_SECONDS', '1800'))
+SESSION_SWEEP_INTERVAL_SECONDS = float(os.getenv('SESSION_SWEEP_INTERVAL_SECONDS', '60'))
+
+# Ended sessions kept in memory; older ones are compressed to the cold archive
+SESSION_ARCHIVE_MAX_SESSIONS = int(os.getenv('SESSION_ARCHIVE_MAX_SESSIONS', '1000'))
+
+# Independently locked partitions of the active session map
+SESSION_LOCK_STRIPES = int(os.getenv('SESSION_LOCK_STRIPES', '64'))
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+class Exchange:
+    """
+    One conversation turn, stored compactly.
+    
+    Slots instead of a per-turn dict, the timestamp as a float and keywords as
+    tuples, with the repeated label strings interned. Reads like the dict it
+    replaces (exchange['sentiment'], exchange.get(...)); to_dict() returns one.
+    """
+    __slots__ = ('created', 'message_id', 'user_input', 'sentiment', 'confidence',
+                 'topic_category', '_keywords', 'ai_response', 'response_type')
+    
+    FIELDS = ('timestamp', 'message_id', 'user_input', 'sentiment', 'confidence',
+              'topic_category', 'keywords', 'ai_response', 'response_type')
+    
+    def __init__(self, created: float, message_id: int, user_input: str, sentiment: str, confidence: float,
+                 topic_category: str, keywords: Dict[str, List[str]], ai_response: str, response_type: str):
+        self.created = created
+        self.message_id = message_id
+        self.user_input = user_input
+        self.sentiment = _intern(sentiment)
+        self.confidence = confidence
+        self.topic_category = _intern(topic_category)
+        self._keywords: Tuple[Tuple[str, Tuple[str, ...]], ...] = tuple(
+            (_intern(category), tuple(_intern(word) for word in words))
+            for category, words in (keywords or {}).items()
+        )
+        self.ai_response = ai_response
+        self.response_type = _intern(response_type)
+    
+    @property
+    def timestamp(self) -> datetime:
+        return datetime.fromtimestamp(self.created)
+    
+    @property
+    def keywords(self) -> Dict[str, List[str]]:
+        return {category: list(words) for category, words in self._keywords}
+    
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self.FIELDS
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key) if key in self.FIELDS else default
+    
+    def keys(self):
+        return self.FIELDS
+    
+    def to_dict(self) -> dict:
+        """The exchange as the plain dict sessions used to store"""
+        return {field: getattr(self, field) for field in self.FIELDS}
+    
+    def to_record(self) -> dict:
+        """JSON-serializable form, with an ISO timestamp"""
+        record = self.to_dict()
+        record['timestamp'] = record['timestamp'].isoformat()
+        return record
+    
+    @classmethod
+    def from_record(cls, record: dict) -> 'Exchange':
+        return cls(
+            created=datetime.fromisoformat(record['timestamp']).timestamp(),
+            message_id=record['message_id'],
+            user_input=record['user_input'],
+            sentiment=record['sentiment'],
+            confidence=record['confidence'],
+            topic_category=record['topic_category'],
+            keywords=record.get('keywords', {}),
+            ai_response=record['ai_response'],
+            response_type=record.get('response_type', 'exploration')
+        )
+
 class TherapySession:
     def __init__(self, session_id: str = None):
-        self.session_id = session_id or str(uuid.uuid4())
+        self.session_id = session_id or new_session_id()
         self.start_time = datetime.now()
-        self.conversation_history = []
+        self.conversation_history: List[Exchange] = []
         self.session_context = {
             'main_topics': [],
             'dominant_sentiment': 'neutral',
@@ -20,34 +117,102 @@ class TherapySession:
             'user_name': None
         }
         self.message_count = 0
+        self.ended_at: Optional[datetime] = None
+        # Guards history, counters and cached views; reentrant so listeners may read the session
+        self.lock = threading.RLock()
+        # Monotonic time of the last request touching the session, for idle expiry
+        self.last_activity = time.monotonic()
+        # Callbacks run with (session, exchange) after each exchange, e.g. to persist it
+        self.exchange_listeners: List[Callable[['TherapySession', Exchange], None]] = []
+        
+        # Running aggregates maintained by add_exchange, so summaries never rescan the history
+        self.sentiment_counts = {'positive': 0, 'negative': 0, 'neutral': 0}
+        self.first_sentiment: Optional[str] = None
+        self.last_sentiment: Optional[str] = None
+        self._topics = set()
+        self._crisis_indicators = set()
+        # Cached summary and context dicts, invalidated by every write
+        self._summary: Optional[dict] = None
+        self._contexts: Dict[int, dict] = {}
         
     def add_exchange(self, user_input: str, nlp_analysis: dict, ai_response: str):
         """Add a conversation exchange to session history"""
-        exchange = {
-            'timestamp': datetime.now(),
-            'message_id': self.message_count,
-            'user_input': user_input,
-            'sentiment': nlp_analysis.get('sentiment', {}).get('sentiment', 'neutral'),
-            'confidence': nlp_analysis.get('sentiment', {}).get('confidence', 0.5),
-            'topic_category': nlp_analysis.get('topic_category', 'general'),
-            'keywords': nlp_analysis.get('keywords', {}),
-            'ai_response': ai_response,
-            'response_type': nlp_analysis.get('response_type', 'exploration')
-        }
+        document = document_for(nlp_analysis, user_input)
         
-        self.conversation_history.append(exchange)
-        self.message_count += 1
-        self._update_session_context(exchange)
+        with self.lock:
+            exchange = Exchange(
+                created=time.time(),
+                message_id=self.message_count,
+                user_input=user_input,
+                sentiment=nlp_analysis.get('sentiment', {}).get('sentiment', 'neutral'),
+                confidence=nlp_analysis.get('sentiment', {}).get('confidence', 0.5),
+                topic_category=nlp_analysis.get('topic_category', 'general'),
+                keywords=nlp_analysis.get('keywords', {}),
+                ai_response=ai_response,
+                response_type=nlp_analysis.get('response_type', 'exploration')
+            )
+            
+            self.conversation_history.append(exchange)
+            self.message_count += 1
+            self.last_activity = time.monotonic()
+            self._update_session_context(exchange, document)
+            self._update_aggregates(exchange)
+            
+            # Under the lock, so listeners see exchanges in message order
+            for listener in self.exchange_listeners:
+                listener(self, exchange)
         
-        logger.info(f"Session {self.session_id}: Added exchange #{self.message_count}")
+        logger.info(f"Session {self.session_id}: Added exchange #{exchange.message_id + 1}")
+    
+    def to_record(self, include_history: bool = True) -> dict:
+        """JSON-serializable snapshot of the session"""
+        with self.lock:
+            record = {
+                'session_id': self.session_id,
+                'start_time': self.start_time.isoformat(),
+                'message_count': self.message_count,
+                'session_context': copy.deepcopy(self.session_context),
+                'ended_at': self.ended_at.isoformat() if self.ended_at else None
+            }
+            if include_history:
+                record['conversation_history'] = [exchange.to_record() for exchange in self.conversation_history]
+            return record
+    
+    @classmethod
+    def from_record(cls, record: dict) -> 'TherapySession':
+        """Rebuild a session from to_record() output"""
+        session = cls(record['session_id'])
+        session.start_time = datetime.fromisoformat(record['start_time'])
+        session.message_count = record['message_count']
+        session.session_context.update(record['session_context'])
+        if record.get('ended_at'):
+            session.ended_at = datetime.fromisoformat(record['ended_at'])
+        session.conversation_history = [Exchange.from_record(exchange) for exchange in record.get('conversation_history', [])]
+        for exchange in session.conversation_history:
+            session._update_aggregates(exchange)
+        session._topics.update(session.session_context['main_topics'])
+        session._crisis_indicators.update(session.session_context['crisis_indicators'])
+        return session
+    
+    def _update_aggregates(self, exchange: Exchange):
+        """Fold one exchange into the running counters and drop cached views"""
+        sentiment = exchange.sentiment
+        if sentiment in self.sentiment_counts:
+            self.sentiment_counts[sentiment] += 1
+        if self.first_sentiment is None:
+            self.first_sentiment = sentiment
+        self.last_sentiment = sentiment
+        self._summary = None
+        self._contexts.clear()
         
-    def _update_session_context(self, exchange: dict):
+    def _update_session_context(self, exchange: Exchange, document: AnalyzedDocument):
         """Update session context based on new exchange"""
-        topic = exchange['topic_category']
-        sentiment = exchange['sentiment']
+        topic = exchange.topic_category
+        sentiment = exchange.sentiment
         
         # Track main topics
-        if topic not in self.session_context['main_topics']:
+        if topic not in self._topics:
+            self._topics.add(topic)
             self.session_context['main_topics'].append(topic)
         
         # Update dominant sentiment (weighted by recent messages)
@@ -55,59 +220,61 @@ class TherapySession:
             self.session_context['dominant_sentiment'] = sentiment
         else:
             # Weight recent messages more heavily
-            recent_sentiments = [ex['sentiment'] for ex in self.conversation_history[-3:]]
+            recent_sentiments = [ex.sentiment for ex in self.conversation_history[-3:]]
             if recent_sentiments.count('negative') >= 2:
                 self.session_context['dominant_sentiment'] = 'negative'
             elif recent_sentiments.count('positive') >= 2:
                 self.session_context['dominant_sentiment'] = 'positive'
         
         # Check for crisis indicators
-        crisis_keywords = ['suicide', 'kill myself', 'end it all', 'can\'t go on', 'want to die']
-        user_text_lower = exchange['user_input'].lower()
-        for keyword in crisis_keywords:
-            if keyword in user_text_lower and keyword not in self.session_context['crisis_indicators']:
+        for keyword in document.matches.keywords('crisis'):
+            if keyword not in self._crisis_indicators:
+                self._crisis_indicators.add(keyword)
                 self.session_context['crisis_indicators'].append(keyword)
                 logger.warning(f"Crisis indicator detected: {keyword}")
     
     def get_conversation_context(self, last_n_messages: int = 3) -> dict:
-        """Get recent conversation context for response generation"""
-        recent_history = self.conversation_history[-last_n_messages:] if self.conversation_history else []
-        
-        return {
-            'session_id': self.session_id,
-            'message_count': self.message_count,
-            'session_duration': str(datetime.now() - self.start_time),
-            'recent_history': recent_history,
-            'session_context': self.session_context,
-            'is_first_message': self.message_count == 0
-        }
+        """Get recent conversation context for response generation (built once per exchange; treat nested values as read-only)"""
+        with self.lock:
+            cached = self._contexts.get(last_n_messages)
+            if cached is None:
+                cached = {
+                    'session_id': self.session_id,
+                    'message_count': self.message_count,
+                    # Plain dicts: responders and jsonify consume these directly
+                    'recent_history': [exchange.to_dict() for exchange in self.conversation_history[-last_n_messages:]],
+                    # A snapshot, so a reader never sees add_exchange change it underneath
+                    'session_context': copy.deepcopy(self.session_context),
+                    'is_first_message': self.message_count == 0
+                }
+                self._contexts[last_n_messages] = cached
+            
+            # Only the duration changes between exchanges; callers get their own copy to extend
+            context = {'session_duration': str(datetime.now() - self.start_time)}
+            context.update(cached)
+        return context
     
     def generate_session_summary(self) -> dict:
         """Generate a summary of the therapy session"""
         if not self.conversation_history:
             return {'summary': 'No conversation occurred', 'recommendations': []}
         
-        # Analyze session patterns
-        sentiments = [ex['sentiment'] for ex in self.conversation_history]
-        topics = [ex['topic_category'] for ex in self.conversation_history]
-        
-        sentiment_counts = {
-            'positive': sentiments.count('positive'),
-            'negative': sentiments.count('negative'),
-            'neutral': sentiments.count('neutral')
-        }
-        
-        # Generate summary
-        summary = {
-            'session_duration': str(datetime.now() - self.start_time),
-            'total_exchanges': len(self.conversation_history),
-            'main_topics': list(set(topics)),
-            'sentiment_distribution': sentiment_counts,
-            'dominant_sentiment': max(sentiment_counts.items(), key=lambda x: x[1])[0],
-            'crisis_indicators': self.session_context['crisis_indicators'],
-            'progress_observations': self._generate_progress_observations()
-        }
+        with self.lock:
+            if self._summary is None:
+                sentiment_counts = dict(self.sentiment_counts)
+                self._summary = {
+                    'total_exchanges': self.message_count,
+                    'main_topics': list(self.session_context['main_topics']),
+                    'sentiment_distribution': sentiment_counts,
+                    'dominant_sentiment': max(sentiment_counts.items(), key=lambda x: x[1])[0],
+                    'crisis_indicators': list(self.session_context['crisis_indicators']),
+                    'progress_observations': self._generate_progress_observations()
+                }
+            cached = self._summary
         
+        # Only the duration changes between writes; callers get their own copy to extend
+        summary = {'session_duration': str((self.ended_at or datetime.now()) - self.start_time)}
+        summary.update(cached)
         return summary
     
     def _generate_progress_observations(self) -> List[str]:
@@ -116,8 +283,8 @@ class TherapySession:
         
         if len(self.conversation_history) >= 3:
             # Check for emotional progression
-            early_sentiment = self.conversation_history[0]['sentiment']
-            recent_sentiment = self.conversation_history[-1]['sentiment']
+            early_sentiment = self.first_sentiment
+            recent_sentiment = self.last_sentiment
             
             if early_sentiment == 'negative' and recent_sentiment in ['neutral', 'positive']:
                 observations.append("Client showed emotional improvement during session")
@@ -129,41 +296,289 @@ class TherapySession:
             observations.append("Client showed good engagement and willingness to communicate")
         
         # Check for specific topics
-        topics = [ex['topic_category'] for ex in self.conversation_history]
-        if 'work_stress' in topics:
+        if 'work_stress' in self._topics:
             observations.append("Work-related stress identified as key concern")
-        if 'relationships' in topics:
+        if 'relationships' in self._topics:
             observations.append("Relationship issues discussed")
-        if 'mental_health' in topics:
+        if 'mental_health' in self._topics:
             observations.append("Mental health concerns addressed")
             
         return observations
 
+class StripedSessionMap:
+    """
+    Session id -> session map split into independently locked stripes, so
+    requests for unrelated sessions never wait on the same lock.
+    """
+    
+    def __init__(self, stripes: int = SESSION_LOCK_STRIPES):
+        self._stripes = [({}, threading.RLock()) for _ in range(max(1, stripes))]
+    
+    def _stripe(self, session_id: str):
+        return self._stripes[hash(session_id) % len(self._stripes)]
+    
+    def get(self, session_id: str, default=None):
+        sessions, lock = self._stripe(session_id)
+        with lock:
+            return sessions.get(session_id, default)
+    
+    def __getitem__(self, session_id: str) -> TherapySession:
+        session = self.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        return session
+    
+    def __setitem__(self, session_id: str, session: TherapySession):
+        sessions, lock = self._stripe(session_id)
+        with lock:
+            sessions[session_id] = session
+    
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+    
+    def pop(self, session_id: str, default=None):
+        """Remove and return a session; of concurrent callers only one gets it"""
+        sessions, lock = self._stripe(session_id)
+        with lock:
+            return sessions.pop(session_id, default)
+    
+    def get_or_load(self, session_id: str, load: Callable[[], Optional[TherapySession]]) -> Optional[TherapySession]:
+        """Get a session, or load and insert it with only its stripe locked"""
+        sessions, lock = self._stripe(session_id)
+        with lock:
+            session = sessions.get(session_id)
+            if session is None:
+                session = load()
+                if session is not None:
+                    sessions[session_id] = session
+            return session
+    
+    def items(self) -> List[tuple]:
+        """Snapshot of (session id, session) pairs"""
+        snapshot = []
+        for sessions, lock in self._stripes:
+            with lock:
+                snapshot.extend(sessions.items())
+        return snapshot
+    
+    def clear(self):
+        for sessions, lock in self._stripes:
+            with lock:
+                sessions.clear()
+    
+    def __len__(self) -> int:
+        return sum(len(sessions) for sessions, _ in self._stripes)
+
 class SessionManager:
-    def __init__(self):
-        self.active_sessions: Dict[str, TherapySession] = {}
-        self.session_history: Dict[str, TherapySession] = {}
+    def __init__(self, store: Optional[SessionStore] = None, archive: Optional[ColdSessionArchive] = None,
+                 idle_ttl: float = SESSION_IDLE_TTL_SECONDS, archive_max_sessions: int = SESSION_ARCHIVE_MAX_SESSIONS):
+        self.active_sessions = StripedSessionMap()
+        # Ended sessions in least-recently-used order, bounded by archive_max_sessions
+        self.session_history: 'OrderedDict[str, TherapySession]' = OrderedDict()
+        # Callbacks run with the session id whenever a session ends or is handed to another worker
+        self.end_session_listeners: List[Callable[[str], None]] = []
+        
+        # Optional durable store; writes are buffered and flushed off the request path
+        self.store = store
+        self.writer = WriteBehindWriter(store) if store else None
+        
+        # Optional cold store for ended sessions evicted from memory
+        self.archive = archive
+        self.archive_max_sessions = max(0, archive_max_sessions)
+        self._archive_lock = threading.Lock()
+        self.evicted_sessions = 0
+        
+        self.idle_ttl = idle_ttl
+        self.expired_sessions = 0
+        self._stop_sweeper = threading.Event()
+        self._sweeper = None
+        if idle_ttl > 0:
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='session-sweeper', daemon=True)
+            self._sweeper.start()
         
-    def create_session(self) -> str:
-        """Create a new therapy session"""
-        session = TherapySession()
+    def create_session(self, shard_key: Optional[str] = None) -> str:
+        """Create a new therapy session, with its id prefixed by the dispatcher's shard key if given"""
+        session = TherapySession(new_session_id(shard_key))
         self.active_sessions[session.session_id] = session
+        self._track(session)
         logger.info(f"Created new session: {session.session_id}")
         return session.session_id
         
     def get_session(self, session_id: str) -> Optional[TherapySession]:
-        """Get an active session"""
-        return self.active_sessions.get(session_id)
+        """Get an active session, reloading it from the store if this process has not seen it"""
+        session = self.active_sessions.get(session_id)
+        if session is None and self.store is not None and session_id:
+            session = self.active_sessions.get_or_load(session_id, lambda: self._rehydrate(session_id))
+        if session is not None:
+            session.last_activity = time.monotonic()
+        return session
+    
+    def _track(self, session: TherapySession):
+        """Persist a session's metadata now and each exchange as it is added"""
+        if self.writer is None:
+            return
+        session.exchange_listeners.append(self._persist_exchange)
+        self.writer.session_updated(session.to_record(include_history=False))
+    
+    def _persist_exchange(self, session: TherapySession, exchange: Exchange):
+        self.writer.exchange_added(session.session_id, exchange.message_id, exchange.to_record())
+        self.writer.session_updated(session.to_record(include_history=False))
+    
+    def _rehydrate(self, session_id: str) -> Optional[TherapySession]:
+        """Load an active session from the store, e.g. after a restart (called with its stripe locked)"""
+        # Make sure nothing buffered for this session is missing from the store
+        if self.writer.pending():
+            self.writer.flush()
+        
+        try:
+            record = self.store.load(session_id)
+        except Exception as e:
+            logger.error(f"Could not load session {session_id}: {e}")
+            return None
+        if record is None or record['status'] != 'active':
+            return None
+        
+        session = TherapySession.from_record(record)
+        session.exchange_listeners.append(self._persist_exchange)
+        logger.info(f"Rehydrated session {session_id} with {session.message_count} messages")
+        return session
     
     def end_session(self, session_id: str) -> Optional[dict]:
         """End a session and generate summary"""
-        session = self.active_sessions.pop(session_id, None)
+        # Load it if needed, but only the caller that removes it from the map ends it
+        session = self.active_sessions.pop(session_id) if self.get_session(session_id) else None
         if session:
-            summary = session.generate_session_summary()
-            self.session_history[session_id] = session
+            with session.lock:
+                session.ended_at = datetime.now()
+                summary = session.generate_session_summary()
+            self._archive_session(session)
+            if self.writer is not None:
+                self.writer.session_ended(session_id, session.ended_at.isoformat())
+            self._release(session_id)
             logger.info(f"Ended session: {session_id}")
             return summary
         return None
+    
+    def _release(self, session_id: str):
+        for listener in self.end_session_listeners:
+            try:
+                listener(session_id)
+            except Exception as e:
+                logger.error(f"End-session listener failed for {session_id}: {e}")
+    
+    def export_session(self, session_id: str) -> Optional[dict]:
+        """Remove an active session from this process and return its record, to hand it to another worker"""
+        session = self.active_sessions.pop(session_id, None)
+        if session is None:
+            return None
+        self._release(session_id)
+        logger.info(f"Handed off session {session_id} with {session.message_count} messages")
+        return session.to_record()
+    
+    def import_session(self, record: dict) -> TherapySession:
+        """Adopt an active session exported by another worker"""
+        session = TherapySession.from_record(record)
+        self.active_sessions[session.session_id] = session
+        self._track(session)
+        logger.info(f"Adopted session {session.session_id} with {session.message_count} messages")
+        return session
+    
+    def get_archived_session(self, session_id: str) -> Optional[TherapySession]:
+        """Get an ended session from memory, reloading it from the cold archive if it was evicted"""
+        with self._archive_lock:
+            session = self.session_history.get(session_id)
+            if session is not None:
+                self.session_history.move_to_end(session_id)
+                return session
+            if self.archive is None:
+                return None
+            
+            try:
+                record = self.archive.get(session_id)
+            except Exception as e:
+                logger.error(f"Could not read archived session {session_id}: {e}")
+                return None
+            if record is None:
+                return None
+            
+            session = TherapySession.from_record(record)
+            self.session_history[session_id] = session
+            self._evict_archived()
+            return session
+    
+    def _archive_session(self, session: TherapySession):
+        with self._archive_lock:
+            self.session_history[session.session_id] = session
+            self.session_history.move_to_end(session.session_id)
+            self._evict_archived()
+    
+    def _evict_archived(self):
+        """Move ended sessions beyond the memory budget to the cold archive (caller holds _archive_lock)"""
+        while len(self.session_history) > self.archive_max_sessions:
+            session_id, session = self.session_history.popitem(last=False)
+            self.evicted_sessions += 1
+            if self.archive is None:
+                continue
+            try:
+                self.archive.put(session.to_record())
+            except Exception as e:
+                logger.error(f"Could not archive session {session_id}: {e}")
+    
+    def expire_idle_sessions(self) -> int:
+        """End every active session idle for longer than the TTL"""
+        cutoff = time.monotonic() - self.idle_ttl
+        idle = [session_id for session_id, session in self.active_sessions.items()
+                if session.last_activity < cutoff]
+        
+        expired = 0
+        for session_id in idle:
+            session = self.active_sessions.get(session_id)
+            # Skip sessions a request touched since the scan
+            if session is None or session.last_activity >= cutoff:
+                continue
+            if self.end_session(session_id) is not None:
+                expired += 1
+        
+        if expired:
+            self.expired_sessions += expired
+            logger.info(f"Expired {expired} idle sessions")
+        return expired
+    
+    def _sweep_loop(self):
+        while not self._stop_sweeper.wait(SESSION_SWEEP_INTERVAL_SECONDS):
+            try:
+                self.expire_idle_sessions()
+            except Exception as e:
+                logger.error(f"Session sweep failed: {e}")
+    
+    def on_session_end(self, listener: Callable[[str], None]):
+        """Register a callback to release per-session resources when a session ends"""
+        self.end_session_listeners.append(listener)
+    
+    def store_stats(self) -> Optional[dict]:
+        """Write-behind metrics, or None when sessions are memory-only"""
+        return self.writer.stats() if self.writer else None
+    
+    def session_stats(self) -> dict:
+        """Active, archived and expired session counts"""
+        stats = {
+            'active_sessions': len(self.active_sessions),
+            'archived_in_memory': len(self.session_history),
+            'archive_max_sessions': self.archive_max_sessions,
+            'evicted_sessions': self.evicted_sessions,
+            'expired_sessions': self.expired_sessions,
+            'idle_ttl_seconds': self.idle_ttl
+        }
+        if self.archive is not None:
+            stats.update(self.archive.stats())
+        return stats
+    
+    def close(self):
+        """Stop the idle sweeper and flush buffered session writes"""
+        self._stop_sweeper.set()
+        if self.writer is not None:
+            self.writer.close()
 
 # Global session manager
-session_manager = SessionManager()
+session_manager = SessionManager(create_session_store(), ColdSessionArchive())
+atexit.register(session_manager.close)
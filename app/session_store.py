@@ -0,0 +1,347 @@
+import json
+import logging
+import os
+import sqlite3
+import re
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Session persistence: 'memory' (default, nothing survives a restart) or 'sqlite'
+SESSION_STORE = os.getenv('SESSION_STORE', 'memory')
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', 'sessions.db')
+
+# Write-behind: buffered writes are flushed this often, or sooner once this many are pending
+SESSION_FLUSH_INTERVAL_MS = float(os.getenv('SESSION_FLUSH_INTERVAL_MS', '200'))
+SESSION_FLUSH_BATCH_SIZE = int(os.getenv('SESSION_FLUSH_BATCH_SIZE', '500'))
+
+# A batch that fails this many flushes in a row is dropped; writes beyond this many
+# buffered rows are dropped while the store is failing
+SESSION_FLUSH_MAX_RETRIES = int(os.getenv('SESSION_FLUSH_MAX_RETRIES', '5'))
+SESSION_MAX_PENDING_WRITES = int(os.getenv('SESSION_MAX_PENDING_WRITES', '100000'))
+
+# Cold store for ended sessions evicted from the in-memory archive
+SESSION_ARCHIVE_DIR = os.getenv('SESSION_ARCHIVE_DIR', 'session_archive')
+
+# Session ids become file names, so anything else is rejected
+SESSION_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,128}')
+
+class SessionStore(ABC):
+    """
+    Storage backend for therapy sessions.
+
+    Sessions are stored as plain records (see TherapySession.to_record):
+    session metadata is upserted, exchanges are appended.
+    """
+    
+    @abstractmethod
+    def write_batch(self, sessions: Dict[str, dict], exchanges: List[Tuple[str, int, dict]], ended: Dict[str, str]):
+        """Persist upserted session records, new exchanges and ended sessions in one transaction"""
+    
+    @abstractmethod
+    def load(self, session_id: str) -> Optional[dict]:
+        """Session record with its conversation history, or None if unknown"""
+    
+    def close(self):
+        pass
+
+class SQLiteSessionStore(SessionStore):
+    """SQLite in WAL mode: readers never block the writer, commits do not fsync"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                start_time TEXT NOT NULL,
+                message_count INTEGER NOT NULL,
+                session_context TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'active',
+                ended_at TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS exchanges (
+                session_id TEXT NOT NULL,
+                message_id INTEGER NOT NULL,
+                exchange TEXT NOT NULL,
+                PRIMARY KEY (session_id, message_id)
+            );
+        ''')
+        logger.info(f"SQLite session store at {path}")
+    
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread; WAL lets them read while the flush thread writes"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            # WAL with synchronous=NORMAL only syncs at checkpoints, never per commit
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+    
+    def write_batch(self, sessions: Dict[str, dict], exchanges: List[Tuple[str, int, dict]], ended: Dict[str, str]):
+        connection = self._connection()
+        now = time.time()
+        with connection:
+            connection.executemany(
+                '''INSERT INTO sessions (session_id, start_time, message_count, session_context, updated_at)
+                   VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(session_id) DO UPDATE SET
+                       message_count = excluded.message_count,
+                       session_context = excluded.session_context,
+                       updated_at = excluded.updated_at''',
+                [
+                    (session_id, record['start_time'], record['message_count'], json.dumps(record['session_context']), now)
+                    for session_id, record in sessions.items()
+                ]
+            )
+            connection.executemany(
+                'INSERT OR REPLACE INTO exchanges (session_id, message_id, exchange) VALUES (?, ?, ?)',
+                [(session_id, message_id, json.dumps(exchange)) for session_id, message_id, exchange in exchanges]
+            )
+            connection.executemany(
+                "UPDATE sessions SET status = 'ended', ended_at = ?, updated_at = ? WHERE session_id = ?",
+                [(ended_at, now, session_id) for session_id, ended_at in ended.items()]
+            )
+    
+    def load(self, session_id: str) -> Optional[dict]:
+        connection = self._connection()
+        row = connection.execute(
+            'SELECT start_time, message_count, session_context, status, ended_at FROM sessions WHERE session_id = ?',
+            (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        
+        exchanges = connection.execute(
+            'SELECT exchange FROM exchanges WHERE session_id = ? ORDER BY message_id',
+            (session_id,)
+        ).fetchall()
+        return {
+            'session_id': session_id,
+            'start_time': row[0],
+            'message_count': row[1],
+            'session_context': json.loads(row[2]),
+            'status': row[3],
+            'ended_at': row[4],
+            'conversation_history': [json.loads(exchange) for (exchange,) in exchanges]
+        }
+    
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+class WriteBehindWriter:
+    """
+    Buffers session writes in memory and flushes them to a SessionStore from a
+    background thread in batched transactions, so requests never wait on disk.
+    
+    A failed batch is retried on the next flushes, up to max_retries times,
+    then logged and dropped. At most max_pending rows are buffered; while the
+    store keeps failing, writes beyond that are dropped instead of queued.
+    """
+    
+    def __init__(self, store: SessionStore, interval_ms: float = SESSION_FLUSH_INTERVAL_MS,
+                 batch_size: int = SESSION_FLUSH_BATCH_SIZE, max_retries: int = SESSION_FLUSH_MAX_RETRIES,
+                 max_pending: int = SESSION_MAX_PENDING_WRITES):
+        self.store = store
+        self.interval = interval_ms / 1000
+        self.batch_size = max(1, batch_size)
+        self.max_retries = max(0, max_retries)
+        self.max_pending = max(self.batch_size, max_pending)
+        
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._sessions: Dict[str, dict] = {}
+        self._exchanges: List[Tuple[str, int, dict]] = []
+        self._ended: Dict[str, str] = {}
+        self._failed_attempts = 0
+        self._dropping = False
+        
+        self.flushes = 0
+        self.rows_written = 0
+        self.errors = 0
+        self.rows_dropped = 0
+        self.last_flush_ms = 0.0
+        
+        self._worker = threading.Thread(target=self._run, name='session-writer', daemon=True)
+        self._worker.start()
+    
+    def session_updated(self, record: dict):
+        """Queue the latest session metadata; only the newest record per session is written"""
+        with self._lock:
+            # Replacing a buffered record adds no row, so only new sessions can be dropped
+            if record['session_id'] not in self._sessions and self._full():
+                return
+            self._sessions[record['session_id']] = record
+            pending = len(self._sessions) + len(self._exchanges)
+        if pending >= self.batch_size:
+            self._wake.set()
+    
+    def exchange_added(self, session_id: str, message_id: int, exchange: dict):
+        with self._lock:
+            if self._full():
+                return
+            self._exchanges.append((session_id, message_id, exchange))
+            pending = len(self._sessions) + len(self._exchanges)
+        if pending >= self.batch_size:
+            self._wake.set()
+    
+    def session_ended(self, session_id: str, ended_at: str):
+        with self._lock:
+            if session_id not in self._ended and self._full():
+                return
+            self._ended[session_id] = ended_at
+    
+    def _full(self) -> bool:
+        """Count a dropped write if the buffer is at max_pending (called under _lock)"""
+        if len(self._sessions) + len(self._exchanges) + len(self._ended) < self.max_pending:
+            return False
+        if not self._dropping:
+            self._dropping = True
+            logger.error(f"Session write buffer full ({self.max_pending} rows), dropping writes until the store recovers")
+        self.rows_dropped += 1
+        return True
+    
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._sessions) + len(self._exchanges) + len(self._ended)
+    
+    def flush(self):
+        """Write everything buffered so far in one transaction"""
+        with self._flush_lock:
+            with self._lock:
+                sessions, self._sessions = self._sessions, {}
+                exchanges, self._exchanges = self._exchanges, []
+                ended, self._ended = self._ended, {}
+            if not (sessions or exchanges or ended):
+                return
+            
+            started = time.perf_counter()
+            try:
+                self.store.write_batch(sessions, exchanges, ended)
+            except Exception as e:
+                logger.error(f"Session flush of {len(sessions)} sessions / {len(exchanges)} exchanges failed: {e}")
+                self.errors += 1
+                self._failed_attempts += 1
+                if self._failed_attempts > self.max_retries:
+                    rows = len(sessions) + len(exchanges) + len(ended)
+                    logger.error(f"Dropping session batch of {rows} rows after {self._failed_attempts} failed flushes")
+                    self.rows_dropped += rows
+                    self._failed_attempts = 0
+                    return
+                # Put the batch back in front of anything buffered since, and retry next round
+                with self._lock:
+                    sessions.update(self._sessions)
+                    self._sessions = sessions
+                    self._exchanges = exchanges + self._exchanges
+                    ended.update(self._ended)
+                    self._ended = ended
+                return
+            
+            self._failed_attempts = 0
+            self._dropping = False
+            self.flushes += 1
+            self.rows_written += len(sessions) + len(exchanges) + len(ended)
+            self.last_flush_ms = (time.perf_counter() - started) * 1000
+    
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+    
+    def close(self):
+        """Flush what is left and stop the background thread"""
+        self._stopped = True
+        self._wake.set()
+        self._worker.join(timeout=5)
+        self.flush()
+        self.store.close()
+    
+    def stats(self) -> dict:
+        return {
+            'pending_writes': self.pending(),
+            'flushes': self.flushes,
+            'rows_written': self.rows_written,
+            'flush_errors': self.errors,
+            'rows_dropped': self.rows_dropped,
+            'last_flush_ms': self.last_flush_ms
+        }
+
+class ColdSessionArchive:
+    """Ended sessions as zlib-compressed JSON records, one file per session"""
+    
+    def __init__(self, directory: str = SESSION_ARCHIVE_DIR):
+        self.directory = directory
+        self.sessions = sum(1 for name in os.listdir(directory) if name.endswith('.json.z')) if os.path.isdir(directory) else 0
+        self.writes = 0
+        self.reads = 0
+        self.bytes_written = 0
+    
+    def _path(self, session_id: str) -> Optional[str]:
+        if not SESSION_ID_PATTERN.fullmatch(session_id or ''):
+            return None
+        return os.path.join(self.directory, session_id + '.json.z')
+    
+    def put(self, record: dict):
+        """Compress and write a session record, replacing any earlier copy"""
+        path = self._path(record['session_id'])
+        if path is None:
+            raise ValueError(f"Session id not usable as an archive key: {record['session_id']!r}")
+        
+        data = zlib.compress(json.dumps(record, separators=(',', ':')).encode('utf-8'))
+        os.makedirs(self.directory, exist_ok=True)
+        is_new = not os.path.exists(path)
+        # Write then rename, so a crash never leaves a truncated archive behind
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        
+        self.sessions += is_new
+        self.writes += 1
+        self.bytes_written += len(data)
+    
+    def get(self, session_id: str) -> Optional[dict]:
+        """Decompressed session record, or None if it was never archived"""
+        path = self._path(session_id)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        
+        self.reads += 1
+        return json.loads(zlib.decompress(data).decode('utf-8'))
+    
+    def stats(self) -> dict:
+        return {
+            'cold_sessions': self.sessions,
+            'cold_writes': self.writes,
+            'cold_reads': self.reads,
+            'cold_bytes_written': self.bytes_written
+        }
+
+def create_session_store(kind: str = SESSION_STORE, path: str = SESSION_DB_PATH) -> Optional[SessionStore]:
+    """Build the configured backend; None keeps sessions in memory only"""
+    if kind == 'memory':
+        return None
+    if kind == 'sqlite':
+        return SQLiteSessionStore(path)
+    raise ValueError(f"Unknown SESSION_STORE '{kind}' (expected 'memory' or 'sqlite')")
@@ -0,0 +1,102 @@
+import bisect
+import hashlib
+import hmac
+import os
+import re
+import secrets
+import uuid
+from typing import Iterable, List, Optional
+
+# Virtual nodes per worker on the hash ring; more spreads sessions more evenly
+SHARD_VIRTUAL_NODES = int(os.getenv('SHARD_VIRTUAL_NODES', '128'))
+
+# How the dispatcher tells a worker which shard a new session belongs to,
+# and the cookie that routes clients which rely on the server-side session
+SHARD_KEY_HEADER = 'X-Shard-Key'
+SESSION_COOKIE = 'therapy_session_id'
+
+# Shared secret the dispatcher sends on worker-to-worker /internal/ requests
+# (INTERNAL_TOKEN; the dispatcher makes one up for the workers it starts)
+INTERNAL_TOKEN_HEADER = 'X-Internal-Token'
+
+SHARD_KEY_PATTERN = re.compile(r'[a-z0-9]{1,32}')
+
+def internal_request_allowed(remote_addr: Optional[str], token: Optional[str]) -> bool:
+    """An /internal/ request must come from loopback and carry INTERNAL_TOKEN; without one set, none is allowed"""
+    expected = os.getenv('INTERNAL_TOKEN')
+    if not expected or not token or remote_addr not in ('127.0.0.1', '::1'):
+        return False
+    return hmac.compare_digest(token.encode('utf-8'), expected.encode('utf-8'))
+
+def new_shard_key() -> str:
+    return secrets.token_hex(4)
+
+def new_session_id(shard_key: Optional[str] = None) -> str:
+    """A session id, prefixed with its shard key when one is given ('<shard>_<uuid>')"""
+    session_id = str(uuid.uuid4())
+    if shard_key and SHARD_KEY_PATTERN.fullmatch(shard_key):
+        return f"{shard_key}_{session_id}"
+    return session_id
+
+def shard_key_of(session_id: str) -> str:
+    """The routing key of a session id; unprefixed ids route on the whole id"""
+    return session_id.split('_', 1)[0]
+
+class HashRing:
+    """
+    Consistent-hash ring of worker nodes.
+
+    Each node is placed at SHARD_VIRTUAL_NODES points; a key belongs to the
+    first point clockwise from its hash. Adding or removing a node only moves
+    the keys between it and its neighbours, about 1/N of them.
+    """
+    
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = SHARD_VIRTUAL_NODES):
+        self.replicas = max(1, replicas)
+        self._nodes = set(nodes)
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        self._rebuild()
+    
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+    
+    def _rebuild(self):
+        ring = sorted(
+            (self._hash(f"{node}#{replica}"), node)
+            for node in self._nodes
+            for replica in range(self.replicas)
+        )
+        self._points = [point for point, _ in ring]
+        self._owners = [node for _, node in ring]
+    
+    def add(self, node: str):
+        if node not in self._nodes:
+            self._nodes.add(node)
+            self._rebuild()
+    
+    def remove(self, node: str):
+        if node in self._nodes:
+            self._nodes.discard(node)
+            self._rebuild()
+    
+    def node_for(self, key: str) -> Optional[str]:
+        """The node owning a key, or None if the ring is empty"""
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[index]
+    
+    def copy(self) -> 'HashRing':
+        return HashRing(self._nodes, self.replicas)
+    
+    @property
+    def nodes(self) -> List[str]:
+        return sorted(self._nodes)
+    
+    def __contains__(self, node: str) -> bool:
+        return node in self._nodes
+    
+    def __len__(self) -> int:
+        return len(self._nodes)
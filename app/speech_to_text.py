@@ -1,13 +1,202 @@
 import speech_recognition as sr
 import logging
+import os
+import struct
+import subprocess
+import threading
+import time
+from collections import deque
+from stt_backends import get_backend
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Uploaded audio: compressed formats are decoded by ffmpeg to mono 16-bit PCM at this rate
+FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+UPLOAD_SAMPLE_RATE = int(os.getenv('UPLOAD_SAMPLE_RATE', '16000'))
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(25 * 1024 * 1024)))
+# Each request thread keeps a PCM buffer of this size between uploads
+UPLOAD_BUFFER_BYTES = int(os.getenv('UPLOAD_BUFFER_BYTES', str(1024 * 1024)))
+
+UPLOAD_READ_SIZE = 64 * 1024
+WAV_HEADER_PROBE = 512
+
+# Ambient-noise calibration of the server microphone is kept between turns and redone
+# in the background every interval (0 disables the timer), or sooner once this share
+# of the recent turns went unheard or unintelligible
+MIC_CALIBRATION_SECONDS = float(os.getenv('MIC_CALIBRATION_SECONDS', '1'))
+MIC_RECALIBRATION_INTERVAL_SECONDS = float(os.getenv('MIC_RECALIBRATION_INTERVAL_SECONDS', '300'))
+MIC_RECALIBRATION_FAILURE_RATE = float(os.getenv('MIC_RECALIBRATION_FAILURE_RATE', '0.5'))
+MIC_FAILURE_WINDOW = int(os.getenv('MIC_FAILURE_WINDOW', '8'))
+
+UNRECOGNIZED_SPEECH = "Could not understand the speech"
+NO_SPEECH_DETECTED = "No speech detected within timeout period"
+
+class CalibratedMicrophone:
+    """
+    The server microphone with a recognizer whose energy threshold is calibrated once and reused.
+    
+    Turns only listen; calibration happens on first use, then on a background
+    timer or when too many recent turns heard nothing or nothing intelligible
+    (the noise floor has probably moved). The device is used by one turn at a
+    time; background recalibration waits until no turn is listening.
+    """
+    
+    def __init__(self, calibration_seconds=MIC_CALIBRATION_SECONDS,
+                 recalibration_interval=MIC_RECALIBRATION_INTERVAL_SECONDS,
+                 failure_rate=MIC_RECALIBRATION_FAILURE_RATE, failure_window=MIC_FAILURE_WINDOW):
+        self.calibration_seconds = calibration_seconds
+        self.recalibration_interval = recalibration_interval
+        self.failure_rate = failure_rate
+        self.recognizer = sr.Recognizer()
+        self.microphone = None
+        self.calibrated_at = None
+        self.calibrations = 0
+        self.in_background = False
+        self._outcomes = deque(maxlen=max(1, failure_window))
+        # _lock is the device, held for a whole background capture; _outcomes_lock guards
+        # _outcomes and starting the recalibration thread, so neither waits on the device
+        self._lock = threading.Lock()
+        self._outcomes_lock = threading.Lock()
+        self._recalibrate = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def _source(self):
+        if self.microphone is None:
+            self.microphone = sr.Microphone()
+        return self.microphone
+    
+    def _calibrate(self):
+        """Measure the noise floor; the caller holds the lock"""
+        logger.info("Adjusting for ambient noise...")
+        try:
+            with self._source() as source:
+                self.recognizer.adjust_for_ambient_noise(source, duration=self.calibration_seconds)
+        except Exception:
+            # Reopen the device next time, in case it was unplugged
+            self.microphone = None
+            raise
+        self.calibrated_at = time.monotonic()
+        self.calibrations += 1
+        with self._outcomes_lock:
+            self._outcomes.clear()
+        logger.info(f"Microphone energy threshold set to {self.recognizer.energy_threshold:.0f}")
+    
+    def calibrate(self):
+        with self._lock:
+            self._calibrate()
+    
+    def listen(self, timeout=5, phrase_time_limit=10):
+        """Capture one phrase; only the first call (or one after a device error) calibrates first"""
+        self._start_recalibration()
+        # Wait out another turn, but not background listening, which holds the lock until it stops
+        while not self._lock.acquire(timeout=0.1):
+            if self.in_background:
+                raise RuntimeError("The microphone is in use by background listening")
+        try:
+            if self.calibrated_at is None:
+                self._calibrate()
+            logger.info("Listening for speech...")
+            with self._source() as source:
+                return self.recognizer.listen(source, timeout=timeout, phrase_time_limit=phrase_time_limit)
+        except OSError:
+            self.microphone = None
+            self.calibrated_at = None
+            raise
+        finally:
+            self._lock.release()
+    
+    def listen_in_background(self, callback, phrase_time_limit=None, pause_threshold=None):
+        """
+        Hold the microphone for continuous capture, calling callback(recognizer, audio) per phrase
+        
+        Args:
+            pause_threshold: Seconds of silence that end a phrase while capturing
+        
+        Returns:
+            function: stops capture and frees the microphone
+        """
+        self._start_recalibration()
+        self._lock.acquire()
+        saved_pause_threshold = self.recognizer.pause_threshold
+        try:
+            if self.calibrated_at is None:
+                self._calibrate()
+            if pause_threshold is not None:
+                self.recognizer.pause_threshold = pause_threshold
+            stop_listening = self.recognizer.listen_in_background(self._source(), callback, phrase_time_limit=phrase_time_limit)
+        except Exception:
+            self.recognizer.pause_threshold = saved_pause_threshold
+            self._lock.release()
+            raise
+        self.in_background = True
+        
+        def stop():
+            try:
+                stop_listening(wait_for_stop=True)
+            finally:
+                self.recognizer.pause_threshold = saved_pause_threshold
+                self.in_background = False
+                self._lock.release()
+        return stop
+    
+    def record_outcome(self, heard):
+        """Note whether a turn produced intelligible speech; a run of misses triggers recalibration"""
+        with self._outcomes_lock:
+            self._outcomes.append(bool(heard))
+            misses = self._outcomes.count(False)
+            drifted = len(self._outcomes) == self._outcomes.maxlen and misses >= self.failure_rate * len(self._outcomes)
+        if drifted:
+            logger.info(f"{misses} of the last {len(self._outcomes)} turns were missed, recalibrating microphone")
+            self._recalibrate.set()
+    
+    def _start_recalibration(self):
+        if self._thread is None:
+            with self._outcomes_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._recalibration_loop, name='mic-calibration', daemon=True)
+                    self._thread.start()
+    
+    def _recalibration_loop(self):
+        interval = self.recalibration_interval if self.recalibration_interval > 0 else None
+        while not self._stop.is_set():
+            self._recalibrate.wait(interval)
+            self._recalibrate.clear()
+            if self._stop.is_set():
+                break
+            # Never measure the noise floor while someone is speaking: wait for the turn to end
+            while not self._lock.acquire(blocking=False):
+                if self._stop.wait(1.0):
+                    return
+            try:
+                self._calibrate()
+            except Exception as e:
+                logger.error(f"Microphone recalibration failed: {e}")
+            finally:
+                self._lock.release()
+    
+    def stop(self):
+        self._stop.set()
+        self._recalibrate.set()
+    
+    def stats(self) -> dict:
+        with self._outcomes_lock:
+            misses, turns = self._outcomes.count(False), len(self._outcomes)
+        return {
+            'calibrated': self.calibrated_at is not None,
+            'energy_threshold': self.recognizer.energy_threshold,
+            'seconds_since_calibration': time.monotonic() - self.calibrated_at if self.calibrated_at else None,
+            'calibrations': self.calibrations,
+            'in_background': self.in_background,
+            'recent_misses': misses,
+            'recent_turns': turns
+        }
+
 def speech_to_text(timeout=5, phrase_time_limit=10):
     """
-    Convert speech from microphone to text using Google Speech Recognition
+    Convert speech from microphone to text with the configured STT backend
     
     Args:
         timeout: Time to wait for speech to start
@@ -16,47 +205,353 @@ def speech_to_text(timeout=5, phrase_time_limit=10):
     Returns:
         dict: {'success': bool, 'text': str, 'error': str}
     """
-    recognizer = sr.Recognizer()
-    microphone = sr.Microphone()
-    
     try:
-        logger.info("Adjusting for ambient noise...")
-        with microphone as source:
-            recognizer.adjust_for_ambient_noise(source, duration=1)
+        audio = calibrated_microphone.listen(timeout=timeout, phrase_time_limit=phrase_time_limit)
+        result = recognize(audio)
+        # Network errors say nothing about the noise floor
+        calibrated_microphone.record_outcome(result['error'] != UNRECOGNIZED_SPEECH)
+        return result
         
-        logger.info("Listening for speech...")
-        with microphone as source:
-            audio = recognizer.listen(source, timeout=timeout, phrase_time_limit=phrase_time_limit)
+    except sr.WaitTimeoutError:
+        error_msg = NO_SPEECH_DETECTED
+        logger.error(error_msg)
+        calibrated_microphone.record_outcome(False)
+        return {'success': False, 'text': '', 'error': error_msg}
         
-        logger.info("Processing speech...")
-        text = recognizer.recognize_google(audio)
+    except Exception as e:
+        error_msg = f"Unexpected error: {e}"
+        logger.error(error_msg)
+        return {'success': False, 'text': '', 'error': error_msg}
+
+def recognize(audio):
+    """
+    Recognize captured or uploaded audio with the configured STT backend
+    
+    Returns:
+        dict: {'success': bool, 'text': str, 'error': str, 'backend': str, 'latency_ms': float}
+    """
+    backend = get_backend()
+    if backend is None:
+        return {'success': False, 'text': '', 'error': 'Speech recognition backend unavailable'}
+    
+    start = time.perf_counter()
+    try:
+        logger.info(f"Processing speech ({backend.name})...")
+        text = backend.transcribe(audio)
         logger.info(f"Recognized text: {text}")
-        
-        return {
+        result = {
             'success': True,
             'text': text,
             'error': None
         }
         
-    except sr.WaitTimeoutError:
-        error_msg = "No speech detected within timeout period"
-        logger.error(error_msg)
-        return {'success': False, 'text': '', 'error': error_msg}
-        
     except sr.UnknownValueError:
-        error_msg = "Could not understand the speech"
+        error_msg = UNRECOGNIZED_SPEECH
         logger.error(error_msg)
-        return {'success': False, 'text': '', 'error': error_msg}
+        result = {'success': False, 'text': '', 'error': error_msg}
         
     except sr.RequestError as e:
         error_msg = f"Could not request results from speech recognition service: {e}"
         logger.error(error_msg)
-        return {'success': False, 'text': '', 'error': error_msg}
+        result = {'success': False, 'text': '', 'error': error_msg}
         
     except Exception as e:
         error_msg = f"Unexpected error: {e}"
         logger.error(error_msg)
-        return {'success': False, 'text': '', 'error': error_msg}
+        result = {'success': False, 'text': '', 'error': error_msg}
+    
+    latency = time.perf_counter() - start
+    backend.record(latency, result['success'])
+    result['backend'] = backend.name
+    result['latency_ms'] = round(latency * 1000, 1)
+    return result
+
+class AudioUploadError(ValueError):
+    """Uploaded audio that is empty, too large or cannot be decoded"""
+
+class PCMBuffer:
+    """
+    Growable byte buffer that streams are read straight into.
+    
+    One is kept per thread and reset between uploads, so a request reuses the
+    allocation of the previous one instead of building up a bytes object chunk
+    by chunk. Views handed out by view() must be released before the next write.
+    """
+    
+    def __init__(self, capacity=UPLOAD_BUFFER_BYTES, max_bytes=UPLOAD_MAX_BYTES):
+        self.initial_capacity = capacity
+        self.max_bytes = max_bytes
+        self._data = bytearray(capacity)
+        self.length = 0
+    
+    @property
+    def capacity(self):
+        return len(self._data)
+    
+    def reset(self):
+        self.length = 0
+        # Don't hold on to the memory of one unusually long upload
+        if len(self._data) > 4 * self.initial_capacity:
+            try:
+                del self._data[self.initial_capacity:]
+            except BufferError:
+                self._data = bytearray(self.initial_capacity)
+    
+    def _reserve(self, size):
+        needed = self.length + size
+        if needed > self.max_bytes:
+            raise AudioUploadError(f"Audio upload exceeds {self.max_bytes} bytes")
+        if needed > len(self._data):
+            grown = min(max(needed, 2 * len(self._data)), self.max_bytes)
+            try:
+                self._data.extend(bytes(grown - len(self._data)))
+            except BufferError:
+                # A view of the previous upload is still alive; leave it its memory
+                data = bytearray(grown)
+                data[:self.length] = self._data[:self.length]
+                self._data = data
+    
+    def write(self, chunk):
+        self._reserve(len(chunk))
+        self._data[self.length:self.length + len(chunk)] = chunk
+        self.length += len(chunk)
+    
+    def fill_from(self, stream, limit=None):
+        """Read a stream into the buffer until EOF (or `limit` total bytes); returns the bytes read"""
+        start = self.length
+        readinto = getattr(stream, 'readinto', None)
+        while limit is None or self.length < limit:
+            size = UPLOAD_READ_SIZE if limit is None else min(UPLOAD_READ_SIZE, limit - self.length)
+            free = self.max_bytes - self.length
+            if free <= 0:
+                if stream.read(1):
+                    raise AudioUploadError(f"Audio upload exceeds {self.max_bytes} bytes")
+                break
+            size = min(size, free)
+            if readinto is None:
+                chunk = stream.read(size)
+                if not chunk:
+                    break
+                self.write(chunk)
+                continue
+            # Read straight into the free space; the buffer only grows once it's full
+            self._reserve(size)
+            with memoryview(self._data)[self.length:self.length + size] as target:
+                count = readinto(target)
+            if not count:
+                break
+            self.length += count
+        return self.length - start
+    
+    def view(self, start=0, end=None):
+        end = self.length if end is None else min(end, self.length)
+        return memoryview(self._data)[start:end]
+
+class ChunkReader:
+    """File-like reader over an iterable of byte chunks (a chunked request body)"""
+    
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = memoryview(b'')
+    
+    def _next_chunk(self):
+        """False once the chunks are exhausted"""
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return False
+            self._pending = memoryview(chunk)
+        return True
+    
+    def readinto(self, target):
+        if not self._next_chunk():
+            return 0
+        count = min(len(target), len(self._pending))
+        target[:count] = self._pending[:count]
+        self._pending = self._pending[count:]
+        return count
+    
+    def read(self, size=-1):
+        if not self._next_chunk():
+            return b''
+        count = len(self._pending) if size < 0 else min(size, len(self._pending))
+        chunk = bytes(self._pending[:count])
+        self._pending = self._pending[count:]
+        return chunk
+
+_buffers = threading.local()
+
+def _thread_buffer():
+    buffer = getattr(_buffers, 'pcm', None)
+    if buffer is None:
+        buffer = _buffers.pcm = PCMBuffer()
+    buffer.reset()
+    return buffer
+
+def _riff_chunks(data, end):
+    """(chunk id, data offset, data size) of each chunk in a RIFF/WAVE header"""
+    offset = 12
+    while offset + 8 <= end:
+        chunk_id, size = struct.unpack_from('<4sI', data, offset)
+        yield chunk_id, offset + 8, size
+        offset += 8 + size + (size & 1)
+
+def _wav_format(data, end):
+    """(sample rate, sample width) of a mono PCM WAV header, or None if ffmpeg should decode it"""
+    for chunk_id, offset, size in _riff_chunks(data, end):
+        if chunk_id == b'fmt ':
+            if offset + 16 > end:
+                return None
+            audio_format, channels, rate, _, _, bits = struct.unpack_from('<HHIIHH', data, offset)
+            if audio_format == 1 and channels == 1 and bits in (8, 16, 24, 32):
+                return rate, bits // 8
+            return None
+    return None
+
+def _wav_frames(buffer):
+    """Offsets of the sample data of a WAV file held in the buffer"""
+    with buffer.view() as data:
+        for chunk_id, offset, size in _riff_chunks(data, len(data)):
+            if chunk_id == b'data':
+                # Streamed WAVs leave the size at 0 or 0xFFFFFFFF; take everything after the header
+                end = len(data) if size in (0, 0xFFFFFFFF) else min(offset + size, len(data))
+                return offset, end
+    raise AudioUploadError("WAV upload has no data chunk")
+
+def _ffmpeg_decode(head, stream, buffer):
+    """Pipe the upload through ffmpeg as it arrives, collecting mono s16le PCM in the buffer"""
+    command = [
+        FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+        '-f', 's16le', '-ac', '1', '-ar', str(UPLOAD_SAMPLE_RATE), 'pipe:1'
+    ]
+    try:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        raise AudioUploadError(f"Decoding compressed audio requires ffmpeg ('{FFMPEG_BINARY}' not found)")
+    
+    feed_error = []
+    
+    def feed():
+        # Runs alongside the reader below so neither pipe fills up and stalls ffmpeg
+        received = len(head)
+        try:
+            process.stdin.write(head)
+            while True:
+                chunk = stream.read(UPLOAD_READ_SIZE)
+                if not chunk:
+                    break
+                received += len(chunk)
+                if received > UPLOAD_MAX_BYTES:
+                    feed_error.append(AudioUploadError(f"Audio upload exceeds {UPLOAD_MAX_BYTES} bytes"))
+                    process.kill()
+                    break
+                process.stdin.write(chunk)
+        except (BrokenPipeError, OSError):
+            pass  # ffmpeg exited early; its stderr says why
+        except Exception as e:
+            feed_error.append(e)
+            process.kill()
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+    
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        buffer.fill_from(process.stdout)
+    except AudioUploadError:
+        process.kill()
+        raise
+    finally:
+        feeder.join()
+        stderr = process.stderr.read().decode('utf-8', 'replace').strip()
+        process.stdout.close()
+        process.stderr.close()
+        process.wait()
+    
+    if feed_error:
+        raise feed_error[0]
+    if process.returncode != 0:
+        raise AudioUploadError(f"Could not decode audio: {stderr.splitlines()[-1] if stderr else 'ffmpeg failed'}")
+
+def decode_upload(stream, content_type=None, sample_rate=None, buffer=None):
+    """
+    Decode uploaded audio into an sr.AudioData without copying the upload
+    
+    WAV (mono PCM) and raw PCM are read straight into the buffer and handed to
+    the recognizer in place; raw PCM is 16-bit little-endian at `sample_rate`.
+    Anything else (webm/opus, ogg, mp3, m4a, stereo or float WAV) is streamed
+    through ffmpeg while it uploads.
+    
+    Args:
+        stream: File-like object with read() (and ideally readinto()), or an iterable of byte chunks
+        content_type: MIME type of the upload, if known
+        sample_rate: Sample rate of raw PCM uploads
+        buffer: PCMBuffer to decode into (default: this thread's)
+    
+    Returns:
+        sr.AudioData backed by the buffer; valid until the buffer is reused
+    """
+    if not hasattr(stream, 'read'):
+        stream = ChunkReader(stream)
+    buffer = buffer or _thread_buffer()
+    
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in ('audio/pcm', 'audio/x-pcm', 'audio/raw'):
+        buffer.fill_from(stream)
+        if not buffer.length:
+            raise AudioUploadError("No audio received")
+        return sr.AudioData(buffer.view(0, buffer.length - buffer.length % 2), sample_rate or UPLOAD_SAMPLE_RATE, 2)
+    
+    # Enough of the upload to tell WAV apart and read its format
+    buffer.fill_from(stream, limit=WAV_HEADER_PROBE)
+    if not buffer.length:
+        raise AudioUploadError("No audio received")
+    
+    with buffer.view() as head:
+        is_wav = head[:4] == b'RIFF' and head[8:12] == b'WAVE'
+        wav_format = _wav_format(head, len(head)) if is_wav else None
+    
+    if wav_format:
+        rate, width = wav_format
+        buffer.fill_from(stream)
+        start, end = _wav_frames(buffer)
+        end -= (end - start) % width
+        return sr.AudioData(buffer.view(start, end), rate, width)
+    
+    with buffer.view() as head:
+        head = bytes(head)
+    buffer.reset()
+    _ffmpeg_decode(head, stream, buffer)
+    if not buffer.length:
+        raise AudioUploadError("No audio decoded from upload")
+    return sr.AudioData(buffer.view(0, buffer.length - buffer.length % 2), UPLOAD_SAMPLE_RATE, 2)
+
+def transcribe_audio(stream, content_type=None, sample_rate=None):
+    """
+    Convert uploaded audio to text, for clients that record in the browser
+    
+    Args:
+        stream: Upload body (file-like or iterable of byte chunks)
+        content_type: MIME type of the upload
+        sample_rate: Sample rate of raw PCM uploads
+    
+    Returns:
+        dict: {'success': bool, 'text': str, 'error': str}
+    """
+    try:
+        audio = decode_upload(stream, content_type, sample_rate)
+    except AudioUploadError as e:
+        logger.error(str(e))
+        return {'success': False, 'text': '', 'error': str(e)}
+    
+    try:
+        return recognize(audio)
+    finally:
+        # The audio is a view into this thread's buffer; let it be reused
+        audio.frame_data.release()
 
 def test_microphone():
     """
@@ -78,3 +573,6 @@ def test_microphone():
             'microphones': [],
             'error': str(e)
         }
+
+# Global server microphone
+calibrated_microphone = CalibratedMicrophone()
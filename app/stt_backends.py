@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+import speech_recognition as sr
+from model_registry import model_registry
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Recognition engine: 'google' (default, online), 'whisper' (faster-whisper on the CPU) or 'vosk' (Kaldi, offline)
+STT_BACKEND = os.getenv('STT_BACKEND', 'google')
+STT_LANGUAGE = os.getenv('STT_LANGUAGE', 'en-US')
+
+# faster-whisper model size/name and CTranslate2 weight type; int8 keeps it fast on CPUs
+WHISPER_MODEL = os.getenv('WHISPER_MODEL', 'base.en')
+WHISPER_COMPUTE_TYPE = os.getenv('WHISPER_COMPUTE_TYPE', 'int8')
+WHISPER_CPU_THREADS = int(os.getenv('WHISPER_CPU_THREADS', '0'))  # 0 lets CTranslate2 decide
+
+# Unpacked Vosk model directory (https://alphacephei.com/vosk/models)
+VOSK_MODEL_PATH = os.getenv('VOSK_MODEL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vosk_models', 'vosk-model-small-en-us-0.15'))
+
+# Local engines take 16 kHz, 16-bit mono
+LOCAL_SAMPLE_RATE = 16000
+
+# Recent call latencies kept per backend for /metrics
+STT_LATENCY_WINDOW = 1000
+
+class STTBackend(ABC):
+    """
+    A speech recognizer that takes sr.AudioData.
+
+    transcribe() behaves like Recognizer.recognize_google: it returns the text,
+    raises sr.UnknownValueError when nothing intelligible was said and
+    sr.RequestError when the engine itself failed.
+    """
+    
+    name = None
+    
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=STT_LATENCY_WINDOW)
+        self.calls = 0
+        self.failures = 0
+    
+    @abstractmethod
+    def transcribe(self, audio: sr.AudioData) -> str:
+        """Text of the audio (see the class docstring for errors)"""
+    
+    def warm_up(self):
+        """Run one throwaway recognition so the first real call doesn't pay for initialization"""
+        try:
+            self.transcribe(sr.AudioData(bytes(LOCAL_SAMPLE_RATE), LOCAL_SAMPLE_RATE, 2))
+        except sr.UnknownValueError:
+            pass
+    
+    def record(self, seconds: float, ok: bool):
+        with self._stats_lock:
+            self.calls += 1
+            self.failures += not ok
+            self._latencies.append(seconds)
+    
+    def stats(self) -> dict:
+        """Call counts and latency percentiles over the recent window"""
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+            return {
+                'backend': self.name,
+                'calls': self.calls,
+                'failures': self.failures,
+                'latency_ms': {
+                    'p50': latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+                    'p95': latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0.0,
+                    'max': latencies[-1] * 1000 if latencies else 0.0
+                }
+            }
+
+class GoogleBackend(STTBackend):
+    """Google Web Speech API; needs the network"""
+    
+    name = 'google'
+    
+    def __init__(self, language: str = STT_LANGUAGE):
+        super().__init__()
+        self.language = language
+        self.recognizer = sr.Recognizer()
+    
+    def transcribe(self, audio: sr.AudioData) -> str:
+        return self.recognizer.recognize_google(audio, language=self.language)
+    
+    def warm_up(self):
+        pass  # A warm-up call would only measure the network
+
+class WhisperBackend(STTBackend):
+    """Whisper via faster-whisper (CTranslate2), quantized and run on the CPU"""
+    
+    name = 'whisper'
+    
+    def __init__(self, model_name: str = WHISPER_MODEL, compute_type: str = WHISPER_COMPUTE_TYPE,
+                 cpu_threads: int = WHISPER_CPU_THREADS, language: str = STT_LANGUAGE):
+        super().__init__()
+        from faster_whisper import WhisperModel
+        
+        logger.info(f"Loading Whisper model '{model_name}' ({compute_type})...")
+        self.model = WhisperModel(model_name, device='cpu', compute_type=compute_type, cpu_threads=cpu_threads)
+        self.language = language.split('-')[0].lower()
+    
+    def transcribe(self, audio: sr.AudioData) -> str:
+        import numpy as np
+        
+        pcm = audio.get_raw_data(convert_rate=LOCAL_SAMPLE_RATE, convert_width=2)
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+        try:
+            # Greedy decoding; one short utterance has no earlier text to condition on
+            segments, _ = self.model.transcribe(samples, language=self.language, beam_size=1,
+                                                condition_on_previous_text=False)
+            text = ' '.join(segment.text.strip() for segment in segments).strip()
+        except Exception as e:
+            raise sr.RequestError(f"Whisper recognition failed: {e}")
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+class VoskBackend(STTBackend):
+    """Vosk (Kaldi) offline recognizer; the model is shared, each call gets its own recognizer"""
+    
+    name = 'vosk'
+    
+    def __init__(self, model_path: str = VOSK_MODEL_PATH):
+        super().__init__()
+        from vosk import Model, SetLogLevel
+        
+        if not os.path.isdir(model_path):
+            raise FileNotFoundError(f"No Vosk model at {model_path}; set VOSK_MODEL_PATH")
+        SetLogLevel(-1)
+        logger.info(f"Loading Vosk model from {model_path}...")
+        self.model = Model(model_path)
+    
+    def transcribe(self, audio: sr.AudioData) -> str:
+        from vosk import KaldiRecognizer
+        
+        recognizer = KaldiRecognizer(self.model, LOCAL_SAMPLE_RATE)
+        try:
+            recognizer.AcceptWaveform(bytes(audio.get_raw_data(convert_rate=LOCAL_SAMPLE_RATE, convert_width=2)))
+            text = json.loads(recognizer.FinalResult()).get('text', '').strip()
+        except Exception as e:
+            raise sr.RequestError(f"Vosk recognition failed: {e}")
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+STT_BACKENDS = {
+    'google': GoogleBackend,
+    'whisper': WhisperBackend,
+    'vosk': VoskBackend
+}
+
+def load_backend(name: str = STT_BACKEND) -> STTBackend:
+    """Build the configured backend; a local engine that can't load falls back to Google"""
+    backend_class = STT_BACKENDS.get(name)
+    if backend_class is None:
+        logger.warning(f"Unknown STT_BACKEND '{name}' (expected one of {', '.join(STT_BACKENDS)}), using Google")
+        return GoogleBackend()
+    try:
+        return backend_class()
+    except Exception as e:
+        if backend_class is GoogleBackend:
+            raise
+        logger.warning(f"Could not load {name} speech backend, using Google: {e}")
+        return GoogleBackend()
+
+model_registry.register('speech_to_text', load_backend, warmup=lambda backend: backend.warm_up())
+
+def get_backend() -> STTBackend:
+    """The configured backend, loading it on first use"""
+    return model_registry.get('speech_to_text')
+
+def stt_stats() -> dict:
+    """Latency report for /metrics; None until the backend has loaded"""
+    entry = model_registry.entries['speech_to_text']
+    return entry.value.stats() if entry.loaded.is_set() and entry.value else None
@@ -1,13 +1,50 @@
 import pyttsx3
+import itertools
 import logging
+import os
+import queue
+import tempfile
 import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
 from typing import Optional
 import time
+from model_registry import model_registry
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Job priorities for the TTS worker (lower runs first): speech a voice turn is
+# waiting on, other requests, and fire-and-forget (async_mode) speech
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 10
+PRIORITY_BACKGROUND = 20
+
+class PlaybackTracker:
+    """When the server speaker is or was last playing, so microphone capture can drop its own echo"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = 0
+        self.last_ended = 0.0
+    
+    @contextmanager
+    def playing(self):
+        with self._lock:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+                self.last_ended = time.monotonic()
+    
+    def overlaps(self, since: float) -> bool:
+        """True if anything played between `since` (time.monotonic()) and now"""
+        with self._lock:
+            return self._active > 0 or self.last_ended >= since
+
 def create_new_tts_engine():
     """Create a fresh TTS engine instance"""
     try:
@@ -25,63 +62,217 @@ def create_new_tts_engine():
         logger.error(f"Failed to create TTS engine: {e}")
         return None
 
-def text_to_speech_simple(text: str) -> dict:
+def _describe_voices(engine) -> list:
+    voices = engine.getProperty('voices') or []
+    return [
+        {
+            'id': voice.id,
+            'name': voice.name,
+            'age': getattr(voice, 'age', 'Unknown'),
+            'gender': getattr(voice, 'gender', 'Unknown')
+        }
+        for voice in voices
+    ]
+
+def _render(engine, text: str) -> dict:
+    """Render speech to WAV bytes through a temporary file (pyttsx3 can only write files)"""
+    fd, path = tempfile.mkstemp(suffix='.wav')
+    os.close(fd)
+    try:
+        engine.save_to_file(text, path)
+        engine.runAndWait()
+        with open(path, 'rb') as f:
+            audio = f.read()
+        if not audio:
+            return {'success': False, 'audio': None, 'error': 'Speech synthesis produced no audio'}
+        return {'success': True, 'audio': audio, 'error': None}
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+class TTSWorker:
     """
-    Simple text-to-speech that creates a fresh engine each time
+    Owns one pyttsx3 engine on a long-lived thread and runs speech jobs from a priority queue.
+    
+    The driver is initialized and its voices enumerated once, when the first
+    job arrives, instead of for every sentence. Callers get a Future; lower
+    priority numbers run first and equal priorities keep submission order.
+    pyttsx3 keeps a single engine per driver in a process, so one thread is
+    all it can use. A job that fails restarts the engine for the next one.
     """
-    if not text or not text.strip():
-        return {'success': False, 'error': 'No text provided'}
     
-    try:
-        # Create fresh engine for each request
-        engine = create_new_tts_engine()
-        if not engine:
-            return {'success': False, 'error': 'Could not initialize TTS engine'}
-        
-        logger.info(f"Speaking: {text}")
-        engine.say(text)
-        engine.runAndWait()
-        
-        # Clean up
-        engine.stop()
-        del engine
+    def __init__(self):
+        self._jobs = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.engine = None
+        self.voices = None
+        self.busy = False
+        self.engine_starts = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+    
+    def submit(self, kind: str, text: Optional[str], priority: int = PRIORITY_NORMAL) -> Future:
+        """Queue a 'start', 'speak' or 'synthesize' job"""
+        future = Future()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='tts-worker', daemon=True)
+                self._thread.start()
+            self._jobs.put((priority, next(self._order), kind, text, future))
+        return future
+    
+    def start(self) -> Future:
+        """Bring the engine up ahead of the first request; resolves to whether it started"""
+        return self.submit('start', None, PRIORITY_INTERACTIVE)
+    
+    def queue_depth(self) -> int:
+        return self._jobs.qsize()
+    
+    def _run(self):
+        while True:
+            _, _, kind, text, future = self._jobs.get()
+            if kind is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                self.cancelled += 1
+                continue
+            self.busy = True
+            try:
+                result = self._handle(kind, text)
+            except Exception as e:
+                self.failed += 1
+                future.set_exception(e)
+                continue
+            finally:
+                self.busy = False
+            if isinstance(result, dict) and not result['success']:
+                self.failed += 1
+            else:
+                self.completed += 1
+            future.set_result(result)
+        self._stop_engine()
+    
+    def _ensure_engine(self):
+        if self.engine is None:
+            self.engine = create_new_tts_engine()
+            if self.engine is not None:
+                self.engine_starts += 1
+                self.voices = _describe_voices(self.engine)
+        return self.engine
+    
+    def _stop_engine(self):
+        if self.engine is not None:
+            try:
+                self.engine.stop()
+            except Exception:
+                pass
+            self.engine = None
+    
+    def _handle(self, kind: str, text: Optional[str]):
+        engine = self._ensure_engine()
+        if kind == 'start':
+            return engine is not None
+        failure = {'success': False, 'audio': None} if kind == 'synthesize' else {'success': False}
+        if engine is None:
+            return {**failure, 'error': 'Could not initialize TTS engine'}
         
-        return {'success': True, 'error': None}
+        try:
+            if kind == 'synthesize':
+                return _render(engine, text)
+            
+            logger.info(f"Speaking: {text}")
+            with playback.playing():
+                engine.say(text)
+                engine.runAndWait()
+            return {'success': True, 'error': None}
         
-    except Exception as e:
-        error_msg = f"Error during speech synthesis: {e}"
-        logger.error(error_msg)
-        return {'success': False, 'error': error_msg}
+        except Exception as e:
+            error_msg = f"Error during speech synthesis: {e}"
+            logger.error(error_msg)
+            self._stop_engine()
+            return {**failure, 'error': error_msg}
+    
+    def shutdown(self):
+        """Stop the thread once the jobs already queued have run"""
+        if self._thread is not None:
+            self._jobs.put((float('inf'), next(self._order), None, None, None))
+    
+    def stats(self) -> dict:
+        return {
+            'engine_running': self.engine is not None,
+            'engine_starts': self.engine_starts,
+            'busy': self.busy,
+            'queued': self.queue_depth(),
+            'completed': self.completed,
+            'failed': self.failed,
+            'cancelled': self.cancelled
+        }
+
+def _resolved(result: dict) -> Future:
+    future = Future()
+    future.set_result(result)
+    return future
+
+def speak(text: str, priority: int = PRIORITY_NORMAL) -> Future:
+    """Queue text to be spoken on the server speaker; the future resolves once it has been said"""
+    if not text or not text.strip():
+        return _resolved({'success': False, 'error': 'No text provided'})
+    return tts_worker.submit('speak', text, priority)
+
+def synthesize(text: str, priority: int = PRIORITY_NORMAL) -> Future:
+    """Queue text to be rendered to WAV bytes instead of played, for clients that play it themselves"""
+    if not text or not text.strip():
+        return _resolved({'success': False, 'audio': None, 'error': 'No text provided'})
+    return tts_worker.submit('synthesize', text, priority)
+
+def text_to_speech_simple(text: str) -> dict:
+    """
+    Speak text and wait until it has been said
+    """
+    return speak(text).result()
+
+def synthesize_speech(text: str) -> dict:
+    """
+    Render speech to WAV bytes and wait for it
+    
+    Returns:
+        dict: {'success': bool, 'audio': bytes, 'error': str}
+    """
+    return synthesize(text).result()
 
 # Main function for backward compatibility
-def text_to_speech(text: str, async_mode: bool = False) -> dict:
+def text_to_speech(text: str, async_mode: bool = False, priority: Optional[int] = None) -> dict:
     """
-    Convert text to speech (simplified version)
+    Convert text to speech on the TTS worker
+    
+    With async_mode the text is queued (at background priority unless one is
+    given) and this returns immediately; otherwise it returns once it was said.
     """
-    return text_to_speech_simple(text)
+    if async_mode:
+        future = speak(text, PRIORITY_BACKGROUND if priority is None else priority)
+        if future.done():
+            return future.result()
+        return {'success': True, 'queued': True, 'queue_depth': tts_worker.queue_depth(), 'error': None}
+    return speak(text, PRIORITY_NORMAL if priority is None else priority).result()
 
 def get_available_voices() -> dict:
-    """Get list of available voices"""
+    """Get list of available voices (enumerated once, when the engine starts)"""
     try:
-        engine = create_new_tts_engine()
-        if not engine:
+        if tts_worker.voices is None and not tts_worker.start().result():
             return {'voices': [], 'error': 'Could not initialize TTS engine'}
-        
-        voices = engine.getProperty('voices')
-        voice_list = []
-        
-        if voices:
-            for voice in voices:
-                voice_list.append({
-                    'id': voice.id,
-                    'name': voice.name,
-                    'age': getattr(voice, 'age', 'Unknown'),
-                    'gender': getattr(voice, 'gender', 'Unknown')
-                })
-        
-        engine.stop()
-        del engine
-        return {'voices': voice_list, 'error': None}
+        return {'voices': tts_worker.voices, 'error': None}
         
     except Exception as e:
         return {'voices': [], 'error': str(e)}
+
+# Global speaker playback state
+playback = PlaybackTracker()
+
+# Global speech worker; the engine starts with the other models
+tts_worker = TTSWorker()
+model_registry.register('text_to_speech', lambda: tts_worker.start().result())
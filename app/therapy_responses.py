@@ -1,7 +1,9 @@
 import random
 import logging
+import threading
 from typing import Dict, List, Optional
 from hybrid_response_generator import hybrid_generator
+from document import AnalyzedDocument, document_for
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -172,7 +174,9 @@ class AdvancedTherapyResponseGenerator:
         message_count = session_context.get('message_count', 0)
         recent_history = session_context.get('recent_history', [])
         is_question = nlp_result.get('is_question', False)
-        user_text = nlp_result.get('original_text', '').lower()
+        document = document_for(nlp_result)
+        user_text = document.lowered
+        matches = document.matches
 
         logger.info(f"Generating contextual response: type={response_type}, message_count={message_count}, sentiment={sentiment}")
         
@@ -180,29 +184,27 @@ class AdvancedTherapyResponseGenerator:
         recent_responses = [exchange.get('ai_response', '') for exchange in recent_history[-3:]]
         
         # PRIORITY 1: Handle direct questions/requests for help
-        if is_question or any(keyword in user_text for keyword in ['strategies', 'help', 'advice', 'suggestions', 'tips', 'how do i', 'what should']):
+        if is_question or 'help_request' in matches:
             return self._handle_direct_question(user_text, topic_category, recent_responses)
 
         # PRIORITY 2: Handle specific content themes
-        if any(keyword in user_text for keyword in ['burnout', 'exhausted', 'overwhelmed', 'pressure', 'racing mind', 'overthinking']):
+        if 'burnout' in matches:
             return self._handle_burnout_stress(user_text, message_count, recent_responses)
         
         # PRIORITY 3: Handle work-related concerns specifically
-        if topic_category == 'work_stress' or any(keyword in user_text for keyword in ['work', 'job', 'career', 'workplace', 'colleague']):
+        if topic_category == 'work_stress' or 'work' in matches:
             return self._handle_work_stress(user_text, sentiment, recent_responses)
         
         # PRIORITY 4: Handle emotional expressions
-        if sentiment == 'negative' and any(keyword in user_text for keyword in ['scared', 'worry', 'anxious', 'fear', 'losing interest']):
+        if sentiment == 'negative' and 'distress' in matches:
             return self._handle_emotional_distress(user_text, recent_responses)
 
         # Crisis handling (highest priority)
-        if self._detect_crisis_language(nlp_result.get('original_text', '')):
+        if self._detect_crisis_language(document):
             return self._get_varied_response('crisis', recent_responses)
         
         # Check if user is actually greeting
-        greeting_keywords = ['hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening']
-        user_text_lower = nlp_result.get('original_text', '').lower()
-        is_actual_greeting = any(keyword in user_text_lower for keyword in greeting_keywords)
+        is_actual_greeting = 'topic.greeting' in matches
         
         # Only give greeting response if user actually said a greeting
         if is_first_message and is_actual_greeting:
@@ -266,7 +268,7 @@ class AdvancedTherapyResponseGenerator:
         
         # Use reflection technique
         if response_type in ['empathy_support', 'mental_health_support'] and random.random() < 0.4:
-            reflection = self._generate_reflection(nlp_result.get('original_text', ''))
+            reflection = self._generate_reflection(document_for(nlp_result).lowered)
             if reflection:
                 template = random.choice(self.response_templates['reflection'])
                 base_response = template.format(reflection=reflection)
@@ -282,14 +284,12 @@ class AdvancedTherapyResponseGenerator:
         
         return base_response
     
-    def _generate_reflection(self, user_text: str) -> Optional[str]:
-        """Generate a therapeutic reflection of what the user said"""
-        if not user_text:
+    def _generate_reflection(self, user_lower: str) -> Optional[str]:
+        """Generate a therapeutic reflection of what the user said (expects lowercased text)"""
+        if not user_lower:
             return None
             
         # Simple reflection generation (in a real app, this would be more sophisticated)
-        user_lower = user_text.lower()
-        
         if 'anxious' in user_lower or 'worried' in user_lower:
             return "you're experiencing anxiety and worry"
         elif 'sad' in user_lower or 'depressed' in user_lower:
@@ -359,16 +359,9 @@ class AdvancedTherapyResponseGenerator:
             
         return strategy_intro + strategy
     
-    def _detect_crisis_language(self, text: str) -> bool:
+    def _detect_crisis_language(self, document: AnalyzedDocument) -> bool:
         """Enhanced crisis detection"""
-        crisis_phrases = [
-            'want to die', 'kill myself', 'end it all', 'suicide', 'can\'t go on',
-            'better off dead', 'no point in living', 'want to disappear',
-            'hurt myself', 'end my life'
-        ]
-        
-        text_lower = text.lower()
-        return any(phrase in text_lower for phrase in crisis_phrases)
+        return document.has('crisis')
     
     def _get_response(self, response_type: str) -> str:
         """Get a random response from the specified category"""
@@ -459,4 +452,24 @@ def generate_hybrid_therapy_response(nlp_result: Dict, session_context: Dict) ->
             return advanced_therapy_responder.generate_contextual_response(nlp_result, session_context)
         else:
             # Use AI generation for complex cases
-            return hybrid_generator.generate_with_transformer(user_input, nlp_result, session_context)
\ No newline at end of file
+            return hybrid_generator.generate_with_transformer(user_input, nlp_result, session_context)
+
+def stream_hybrid_therapy_response(nlp_result: Dict, session_context: Dict, cancel: threading.Event = None):
+    """
+    Stream a hybrid response; yields text chunks and returns the complete response
+
+    A StreamCorrection chunk replaces everything streamed before it. Setting
+    `cancel` stops AI generation at the next token.
+    """
+    user_input = nlp_result.get('original_text', '')
+    strategy = hybrid_generator.determine_response_strategy(user_input, nlp_result, session_context)
+    
+    logger.info(f"Streaming {strategy} strategy for: {user_input[:50]}...")
+    
+    if strategy == 'rule_based':
+        # Template responses are instant, so send them as a single chunk
+        response = advanced_therapy_responder.generate_contextual_response(nlp_result, session_context)
+        yield response
+        return response
+    
+    return (yield from hybrid_generator.stream_with_transformer(user_input, nlp_result, session_context, cancel))
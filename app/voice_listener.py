@@ -0,0 +1,212 @@
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, Optional
+import speech_recognition as sr
+from speech_to_text import calibrated_microphone, recognize, speech_to_text, NO_SPEECH_DETECTED
+from text_to_speech import playback
+from voice_stream import load_vad
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Silence that ends an utterance, and the longest single utterance
+LISTEN_PAUSE_SECONDS = float(os.getenv('LISTEN_PAUSE_SECONDS', '0.8'))
+LISTEN_PHRASE_LIMIT_SECONDS = float(os.getenv('LISTEN_PHRASE_LIMIT_SECONDS', '20'))
+
+# Recognized utterances waiting per session; the oldest is dropped when full
+UTTERANCE_QUEUE_SIZE = int(os.getenv('UTTERANCE_QUEUE_SIZE', '20'))
+
+# With webrtcvad installed, the share of a phrase's 30 ms frames that must be speech
+# before it is sent for recognition
+VAD_MIN_SPEECH_RATIO = float(os.getenv('VAD_MIN_SPEECH_RATIO', '0.3'))
+
+VAD_SAMPLE_RATE = 16000
+VAD_FRAME_BYTES = VAD_SAMPLE_RATE * 30 // 1000 * 2
+
+_STOP = object()
+
+class VoiceListener:
+    """
+    Keeps the server microphone open for one session at a time.
+
+    The recognizer's energy-based voice activity detection splits the stream
+    into utterances (a phrase ends after LISTEN_PAUSE_SECONDS of silence).
+    Capture never waits on recognition: phrases go to a worker thread, which
+    drops the server's own speech and, with webrtcvad, noise that isn't speech,
+    then queues the recognized text for the session. The voice endpoints take
+    the next utterance from that queue instead of opening the microphone.
+    """
+    
+    def __init__(self, microphone=calibrated_microphone, queue_size=UTTERANCE_QUEUE_SIZE):
+        self.microphone = microphone
+        self.queue_size = max(1, queue_size)
+        self.session_id: Optional[str] = None
+        self._queues: Dict[str, queue.Queue] = {}
+        self._lock = threading.Lock()
+        self._stop_capture = None
+        self._phrases = queue.Queue()
+        self._worker = None
+        self._vad = None
+        self.captured = 0
+        self.recognized = 0
+        self.discarded_echo = 0
+        self.discarded_noise = 0
+        self.unrecognized = 0
+        self.dropped = 0
+    
+    def start(self, session_id: str) -> Optional[str]:
+        """Listen for a session, taking the microphone over from any other; returns the previous session"""
+        with self._lock:
+            previous = self.session_id
+            self._queues.setdefault(session_id, queue.Queue(maxsize=self.queue_size))
+            self.session_id = session_id
+            if self._stop_capture is None:
+                if self._worker is None:
+                    self._vad = load_vad()
+                    self._worker = threading.Thread(target=self._recognition_loop, name='voice-listener', daemon=True)
+                    self._worker.start()
+                try:
+                    self._stop_capture = self.microphone.listen_in_background(
+                        self._on_phrase, phrase_time_limit=LISTEN_PHRASE_LIMIT_SECONDS, pause_threshold=LISTEN_PAUSE_SECONDS
+                    )
+                except Exception:
+                    self.session_id = None
+                    raise
+                logger.info(f"Background listening started for session {session_id}")
+        return None if previous == session_id else previous
+    
+    def stop(self, session_id: Optional[str] = None) -> bool:
+        """Stop listening (only if it is for `session_id`, when given); queued utterances stay"""
+        with self._lock:
+            if self._stop_capture is None or (session_id and session_id != self.session_id):
+                return False
+            stop_capture, self._stop_capture = self._stop_capture, None
+            self.session_id = None
+        # Waits for a phrase in progress, so don't hold the lock
+        stop_capture()
+        logger.info("Background listening stopped")
+        return True
+    
+    def release_session(self, session_id: str):
+        """Session-end hook: stop listening for it and drop its queue"""
+        self.stop(session_id)
+        with self._lock:
+            self._queues.pop(session_id, None)
+    
+    def is_listening(self, session_id: Optional[str] = None) -> bool:
+        return self._stop_capture is not None and (session_id is None or self.session_id == session_id)
+    
+    def pending(self, session_id: str) -> int:
+        utterances = self._queues.get(session_id)
+        return utterances.qsize() if utterances else 0
+    
+    def _on_phrase(self, recognizer, audio: sr.AudioData):
+        """Capture thread: hand the phrase on and go straight back to listening"""
+        session_id = self.session_id
+        if session_id is None:
+            return
+        self.captured += 1
+        duration = len(audio.frame_data) / (audio.sample_rate * audio.sample_width)
+        # The microphone hears the speaker; a phrase overlapping playback is our own voice
+        if playback.overlaps(time.monotonic() - duration):
+            self.discarded_echo += 1
+            return
+        self._phrases.put((session_id, audio, time.time()))
+    
+    def _is_speech(self, audio: sr.AudioData) -> bool:
+        if self._vad is None:
+            return True
+        pcm = audio.get_raw_data(convert_rate=VAD_SAMPLE_RATE, convert_width=2)
+        frames = len(pcm) // VAD_FRAME_BYTES
+        if frames == 0:
+            return False
+        voiced = sum(
+            self._vad.is_speech(pcm[i * VAD_FRAME_BYTES:(i + 1) * VAD_FRAME_BYTES], VAD_SAMPLE_RATE)
+            for i in range(frames)
+        )
+        return voiced / frames >= VAD_MIN_SPEECH_RATIO
+    
+    def _recognition_loop(self):
+        while True:
+            item = self._phrases.get()
+            if item is _STOP:
+                break
+            session_id, audio, captured_at = item
+            try:
+                if not self._is_speech(audio):
+                    self.discarded_noise += 1
+                    continue
+                result = recognize(audio)
+            except Exception as e:
+                logger.error(f"Background recognition failed: {e}")
+                continue
+            if not result['success']:
+                self.unrecognized += 1
+                continue
+            self.recognized += 1
+            result['captured_at'] = captured_at
+            self._enqueue(session_id, result)
+    
+    def _enqueue(self, session_id: str, result: dict):
+        utterances = self._queues.get(session_id)
+        if utterances is None:
+            return  # The session ended meanwhile
+        while True:
+            try:
+                utterances.put_nowait(result)
+                return
+            except queue.Full:
+                try:
+                    utterances.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+    
+    def next_utterance(self, session_id: str, timeout: float = 5) -> dict:
+        """The session's next recognized utterance, waiting up to `timeout`; same shape as speech_to_text"""
+        utterances = self._queues.get(session_id)
+        if utterances is None:
+            return {'success': False, 'text': '', 'error': 'Session is not listening'}
+        try:
+            return utterances.get(timeout=timeout)
+        except queue.Empty:
+            return {'success': False, 'text': '', 'error': NO_SPEECH_DETECTED}
+    
+    def capture_utterance(self, session_id: str, timeout: float = 5, phrase_time_limit: float = 10) -> dict:
+        """
+        Next utterance for a voice turn: from the background queue when the session
+        is listening (or has utterances waiting), otherwise one capture with speech_to_text
+        """
+        if self.is_listening(session_id) or self.pending(session_id):
+            # Allow for speech that starts at the timeout and runs the full phrase
+            return self.next_utterance(session_id, timeout=timeout + phrase_time_limit)
+        if self.is_listening():
+            return {'success': False, 'text': '', 'error': 'The microphone is listening for another session'}
+        return speech_to_text(timeout=timeout, phrase_time_limit=phrase_time_limit)
+    
+    def shutdown(self):
+        self.stop()
+        if self._worker is not None:
+            self._phrases.put(_STOP)
+    
+    def stats(self) -> dict:
+        return {
+            'listening': self.is_listening(),
+            'session_id': self.session_id,
+            'vad': self._vad is not None,
+            'captured': self.captured,
+            'recognized': self.recognized,
+            'discarded_echo': self.discarded_echo,
+            'discarded_noise': self.discarded_noise,
+            'unrecognized': self.unrecognized,
+            'dropped': self.dropped,
+            'awaiting_recognition': self._phrases.qsize(),
+            'queued_utterances': {session_id: q.qsize() for session_id, q in list(self._queues.items())}
+        }
+
+# Global background listener
+voice_listener = VoiceListener()
@@ -0,0 +1,184 @@
+import logging
+import os
+from typing import List, Optional, Tuple
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# webrtcvad (optional) aggressiveness, 0-3; without it speech is detected on energy
+VAD_AGGRESSIVENESS = int(os.getenv('VAD_AGGRESSIVENESS', '2'))
+
+# Streamed audio: silence that ends an utterance, audio kept from just before speech
+# started, and the longest utterance before it is cut
+STREAM_PAUSE_SECONDS = float(os.getenv('STREAM_PAUSE_SECONDS', '0.8'))
+STREAM_PREROLL_SECONDS = float(os.getenv('STREAM_PREROLL_SECONDS', '0.3'))
+STREAM_MAX_UTTERANCE_SECONDS = float(os.getenv('STREAM_MAX_UTTERANCE_SECONDS', '30'))
+
+# Energy detection: a frame is speech above this RMS, or this many times the noise floor
+STREAM_ENERGY_THRESHOLD = float(os.getenv('STREAM_ENERGY_THRESHOLD', '300'))
+STREAM_ENERGY_RATIO = float(os.getenv('STREAM_ENERGY_RATIO', '3'))
+
+FRAME_MS = 30
+SPEECH_START_FRAMES = 3
+WEBRTC_VAD_RATES = (8000, 16000, 32000, 48000)
+
+def load_vad(aggressiveness: int = VAD_AGGRESSIVENESS):
+    """A webrtcvad.Vad, or None if the package isn't installed"""
+    try:
+        import webrtcvad
+        return webrtcvad.Vad(aggressiveness)
+    except Exception as e:
+        logger.info(f"webrtcvad unavailable, detecting speech on energy only: {e}")
+        return None
+
+class AudioRingBuffer:
+    """
+    Fixed-size circular buffer of 16-bit PCM, allocated once per stream.
+
+    Positions are absolute byte offsets into the stream; the buffer holds its
+    last `capacity` bytes. Incoming chunks are copied straight into the
+    preallocated memory and read back as memoryviews. The capacity is a whole
+    number of frames, so a frame-aligned read never wraps.
+    """
+    
+    def __init__(self, capacity: int, frame_bytes: int):
+        self.frame_bytes = frame_bytes
+        self.capacity = max(1, -(-capacity // frame_bytes)) * frame_bytes
+        self._data = bytearray(self.capacity)
+        self._view = memoryview(self._data)
+        self.written = 0
+    
+    @property
+    def start(self) -> int:
+        """Oldest position still held"""
+        return max(0, self.written - self.capacity)
+    
+    def write(self, chunk):
+        view = memoryview(chunk).cast('B')
+        if len(view) > self.capacity:
+            self.written += len(view) - self.capacity
+            view = view[-self.capacity:]
+        offset = self.written % self.capacity
+        first = min(len(view), self.capacity - offset)
+        self._view[offset:offset + first] = view[:first]
+        if first < len(view):
+            self._view[:len(view) - first] = view[first:]
+        self.written += len(view)
+    
+    def views(self, start: int, end: int) -> List[memoryview]:
+        """The bytes between two positions as one or two memoryviews, without copying"""
+        start = max(start, self.start)
+        end = min(end, self.written)
+        if end <= start:
+            return []
+        offset = start % self.capacity
+        first = min(end - start, self.capacity - offset)
+        views = [self._view[offset:offset + first]]
+        if first < end - start:
+            views.append(self._view[:end - start - first])
+        return views
+    
+    def frame(self, position: int) -> memoryview:
+        """The frame at a frame-aligned position that is still held"""
+        offset = position % self.capacity
+        return self._view[offset:offset + self.frame_bytes]
+    
+    def copy(self, start: int, end: int) -> bytes:
+        """The bytes between two positions, copied once (for audio that outlives the buffer)"""
+        return b''.join(self.views(start, end))
+
+class UtteranceDetector:
+    """
+    Splits the PCM in a ring buffer into utterances, one 30 ms frame at a time.
+
+    A frame counts as speech if webrtcvad says so or, without it, if its RMS
+    energy clears both STREAM_ENERGY_THRESHOLD and STREAM_ENERGY_RATIO times the
+    running noise floor. An utterance starts after SPEECH_START_FRAMES speech
+    frames in a row (keeping STREAM_PREROLL_SECONDS before them) and ends after
+    STREAM_PAUSE_SECONDS of non-speech or at STREAM_MAX_UTTERANCE_SECONDS.
+    """
+    
+    def __init__(self, ring: AudioRingBuffer, sample_rate: int, vad=None,
+                 pause_seconds: float = STREAM_PAUSE_SECONDS, preroll_seconds: float = STREAM_PREROLL_SECONDS,
+                 max_seconds: float = STREAM_MAX_UTTERANCE_SECONDS):
+        self.ring = ring
+        self.sample_rate = sample_rate
+        self.vad = vad if sample_rate in WEBRTC_VAD_RATES else None
+        self.frame_bytes = ring.frame_bytes
+        bytes_per_second = sample_rate * 2
+        self.pause_frames = max(1, int(pause_seconds * 1000 / FRAME_MS))
+        self.preroll_bytes = int(preroll_seconds * bytes_per_second) // 2 * 2
+        self.max_bytes = int(max_seconds * bytes_per_second) // 2 * 2
+        self.position = 0
+        self.speech_start: Optional[int] = None
+        self.noise_floor = None
+        self._voiced_run = 0
+        self._silent_frames = 0
+    
+    @staticmethod
+    def frame_bytes_for(sample_rate: int) -> int:
+        return sample_rate * FRAME_MS // 1000 * 2
+    
+    @property
+    def speaking(self) -> bool:
+        return self.speech_start is not None
+    
+    def _is_speech(self, frame: memoryview) -> bool:
+        if self.vad is not None:
+            return self.vad.is_speech(frame.toreadonly(), self.sample_rate)
+        
+        import numpy as np
+        
+        samples = np.frombuffer(frame, dtype=np.int16).astype(np.float32)
+        energy = float(np.sqrt(np.mean(samples * samples))) if len(samples) else 0.0
+        floor = self.noise_floor if self.noise_floor is not None else energy
+        speech = energy > STREAM_ENERGY_THRESHOLD and energy > floor * STREAM_ENERGY_RATIO
+        if not speech:
+            # Track the noise floor on non-speech frames only
+            self.noise_floor = energy if self.noise_floor is None else 0.95 * self.noise_floor + 0.05 * energy
+        return speech
+    
+    def feed(self) -> List[Tuple]:
+        """
+        Classify the frames written since the last call
+
+        Returns:
+            list: ('speech_start', start) and ('utterance', start, end) events, positions in the ring
+        """
+        events = []
+        # Frames overwritten before they were read are skipped
+        if self.position < self.ring.start:
+            self.position = -(-self.ring.start // self.frame_bytes) * self.frame_bytes
+        while self.ring.written - self.position >= self.frame_bytes:
+            frame = self.ring.frame(self.position)
+            speech = self._is_speech(frame)
+            self.position += self.frame_bytes
+            
+            if self.speech_start is None:
+                self._voiced_run = self._voiced_run + 1 if speech else 0
+                if self._voiced_run >= SPEECH_START_FRAMES:
+                    voiced_from = self.position - self._voiced_run * self.frame_bytes
+                    self.speech_start = max(self.ring.start, voiced_from - self.preroll_bytes)
+                    self._silent_frames = 0
+                    events.append(('speech_start', self.speech_start))
+                continue
+            
+            self._silent_frames = 0 if speech else self._silent_frames + 1
+            if self._silent_frames >= self.pause_frames or self.position - self.speech_start >= self.max_bytes:
+                events.append(('utterance', self.speech_start, self.position))
+                self._reset()
+        return events
+    
+    def end_utterance(self) -> Optional[Tuple[int, int]]:
+        """End the current utterance now (push-to-talk release); its (start, end), or None"""
+        if self.speech_start is None:
+            return None
+        span = (self.speech_start, self.position)
+        self._reset()
+        return span
+    
+    def _reset(self):
+        self.speech_start = None
+        self._voiced_run = 0
+        self._silent_frames = 0
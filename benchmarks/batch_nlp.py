@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from model_registry import model_registry
+from nlp_pipeline import nlp_processor
+from sentiment import sentiment_analyzer
+
+MESSAGES = [
+    "I have been feeling overwhelmed at work and my boss keeps adding deadlines",
+    "I'm worried about my relationship with my partner",
+    "Some days I feel hopeless and empty",
+    "Can you suggest any strategies for dealing with panic before meetings?",
+    "I had a wonderful weekend and felt happy for the first time in a while",
+    "My mind keeps racing and I'm overthinking every conversation",
+    "I'm exhausted and I think I'm heading toward burnout",
+    "What should I do when the anxiety gets this bad at night?"
+]
+
+class BatchNLPBenchmark:
+    """Compare looping process_text against process_texts on the same messages"""
+    
+    def __init__(self, batch_sizes=(1, 16, 64, 256)):
+        self.batch_sizes = batch_sizes
+        model_registry.warm_up()
+    
+    def messages(self, count):
+        # Unique texts so every message misses the result caches
+        return [f"{MESSAGES[i % len(MESSAGES)]} ({i})" for i in range(count)]
+    
+    def clear_caches(self):
+        nlp_processor.cache.clear()
+        sentiment_analyzer.cache.clear()
+    
+    def run(self):
+        print("🧪 Batch NLP benchmark (process_text loop vs process_texts)")
+        print("=" * 50)
+        
+        results = {}
+        for size in self.batch_sizes:
+            texts = self.messages(size)
+            
+            self.clear_caches()
+            start = time.perf_counter()
+            for text in texts:
+                nlp_processor.process_text(text)
+            looped = size / (time.perf_counter() - start)
+            
+            self.clear_caches()
+            start = time.perf_counter()
+            nlp_processor.process_texts(texts)
+            batched = size / (time.perf_counter() - start)
+            
+            results[size] = {'process_text': looped, 'process_texts': batched}
+            print(f"\n{size} messages:")
+            print(f"   🐢 process_text loop: {looped:.1f} texts/s")
+            print(f"   ⚡ process_texts:     {batched:.1f} texts/s")
+            print(f"   📊 speedup: {batched / looped:.2f}x")
+        return results
+
+if __name__ == "__main__":
+    BatchNLPBenchmark().run()
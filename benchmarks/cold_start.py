@@ -0,0 +1,80 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+
+# Longest wait for the models to settle before a run is reported as not ready
+READY_TIMEOUT_SECONDS = 600
+
+# Runs inside a fresh interpreter so every measurement is a true cold start.
+# MODEL_LOADING=lazy never loads anything on its own, so there the clock stops
+# at the answer to a first therapy request, which pays for the loading instead.
+CHILD_SCRIPT = """
+import json, os, sys, time
+start = time.perf_counter()
+import main
+import_seconds = time.perf_counter() - start
+if os.environ['MODEL_LOADING'] == 'lazy':
+    client = main.app.test_client()
+    session_id = client.post('/start-therapy-session').get_json()['session_id']
+    client.post('/text-therapy', json={'session_id': session_id, 'text': 'I have been feeling anxious lately'})
+    ready = True
+else:
+    ready = main.model_registry.wait_until_ready(float(sys.argv[1]))
+ready_seconds = time.perf_counter() - start
+print(json.dumps({
+    'import_seconds': import_seconds,
+    'time_to_ready_seconds': ready_seconds,
+    'ready': ready,
+    'models': main.model_registry.status()['models']
+}))
+"""
+
+class ColdStartBenchmark:
+    def __init__(self, runs=3, model_loading='background', ready_timeout=READY_TIMEOUT_SECONDS):
+        self.runs = runs
+        self.model_loading = model_loading
+        self.ready_timeout = ready_timeout
+    
+    def run_once(self):
+        env = dict(os.environ, MODEL_LOADING=self.model_loading)
+        output = subprocess.run(
+            [sys.executable, '-c', CHILD_SCRIPT, str(self.ready_timeout)],
+            cwd=APP_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout
+        return json.loads(output.strip().splitlines()[-1])
+    
+    def run(self):
+        print(f"🧪 Cold start benchmark (MODEL_LOADING={self.model_loading}, {self.runs} runs)")
+        print("=" * 50)
+        
+        results = []
+        for i in range(1, self.runs + 1):
+            result = self.run_once()
+            results.append(result)
+            ready = 'first response' if self.model_loading == 'lazy' else 'ready'
+            if not result['ready']:
+                ready = f"NOT ready after {self.ready_timeout}s"
+            print(f"   Run {i}: import {result['import_seconds']:.2f}s, {ready} {result['time_to_ready_seconds']:.2f}s")
+        
+        import_times = [r['import_seconds'] for r in results]
+        ready_times = [r['time_to_ready_seconds'] for r in results]
+        print(f"\n📊 Import time (median): {statistics.median(import_times):.2f}s")
+        label = 'Time to first response' if self.model_loading == 'lazy' else 'Time to ready'
+        print(f"📊 {label} (median): {statistics.median(ready_times):.2f}s")
+        
+        print("\nPer-model load times (last run):")
+        for name, status in results[-1]['models'].items():
+            print(f"   {name}: {status['state']}, load {status['load_seconds']}, warm-up {status['warmup_seconds']}")
+        return results
+
+if __name__ == "__main__":
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'background'
+    ColdStartBenchmark(model_loading=mode).run()
@@ -0,0 +1,96 @@
+import json
+import os
+import subprocess
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+
+# Each precision runs in a fresh interpreter so RSS numbers are not mixed up
+CHILD_SCRIPT = """
+import json, resource, sys, time
+import torch
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return peak_rss_mb()
+
+from hybrid_response_generator import HybridTherapyResponseGenerator
+
+mode, runs, new_tokens = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+generator = HybridTherapyResponseGenerator(quantization=mode)
+rss_before = rss_mb()
+generator.load_model()
+rss_loaded = rss_mb()
+
+prompt = "You are a caring therapist. Client says: I have been feeling very anxious about work lately"
+inputs = generator.tokenizer.encode(prompt + generator.tokenizer.eos_token, return_tensors='pt')
+
+def generate():
+    with torch.no_grad():
+        return generator.model.generate(
+            inputs,
+            min_new_tokens=new_tokens,
+            max_new_tokens=new_tokens,
+            do_sample=False,
+            pad_token_id=generator.tokenizer.eos_token_id
+        )
+
+generate()  # warm up
+start = time.perf_counter()
+for _ in range(runs):
+    outputs = generate()
+elapsed = time.perf_counter() - start
+generated = (outputs.shape[1] - inputs.shape[1]) * runs
+
+print(json.dumps({
+    'mode': mode,
+    'model_rss_mb': rss_loaded - rss_before,
+    'peak_rss_mb': peak_rss_mb(),
+    'tokens_per_second': generated / elapsed,
+    'seconds_per_turn': elapsed / runs
+}))
+"""
+
+class DialoGPTQuantizationBenchmark:
+    def __init__(self, modes=('fp32', 'int8'), runs=5, new_tokens=64):
+        self.modes = modes
+        self.runs = runs
+        self.new_tokens = new_tokens
+    
+    def run_mode(self, mode):
+        output = subprocess.run(
+            [sys.executable, '-c', CHILD_SCRIPT, mode, str(self.runs), str(self.new_tokens)],
+            cwd=APP_DIR,
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout
+        return json.loads(output.strip().splitlines()[-1])
+    
+    def run(self):
+        print(f"🧪 DialoGPT precision benchmark ({self.runs} runs x {self.new_tokens} tokens)")
+        print("=" * 50)
+        
+        results = {}
+        for mode in self.modes:
+            result = self.run_mode(mode)
+            results[mode] = result
+            print(f"\n{mode}:")
+            print(f"   ⚡ {result['tokens_per_second']:.1f} tokens/s ({result['seconds_per_turn']:.2f}s per turn)")
+            print(f"   💾 Model RSS {result['model_rss_mb']:.0f} MB, peak process RSS {result['peak_rss_mb']:.0f} MB")
+        
+        if 'fp32' in results and 'int8' in results:
+            speedup = results['int8']['tokens_per_second'] / results['fp32']['tokens_per_second']
+            saved = results['fp32']['model_rss_mb'] - results['int8']['model_rss_mb']
+            print(f"\n📊 int8 speedup: {speedup:.2f}x, memory saved: {saved:.0f} MB")
+        return results
+
+if __name__ == "__main__":
+    DialoGPTQuantizationBenchmark().run()
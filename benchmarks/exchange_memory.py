@@ -0,0 +1,105 @@
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from lexicon import lexicon
+from session_manager import Exchange
+
+TURNS = [
+    ("I have been feeling overwhelmed at work and my boss keeps adding deadlines", 'negative', 'work_stress'),
+    ("I'm worried about my relationship with my partner", 'negative', 'relationships'),
+    ("Some days I feel hopeless and empty", 'negative', 'feelings'),
+    ("Can you suggest any strategies for dealing with panic before meetings?", 'neutral', 'mental_health'),
+    ("I had a wonderful weekend and felt happy for the first time in a while", 'positive', 'feelings'),
+    ("Thanks, that helps", 'positive', 'general')
+]
+
+RESPONSE = ("It sounds like a lot is landing on you at once. What part of it feels heaviest right now, "
+            "and what has helped even a little when it felt like this before?")
+
+class ExchangeMemoryBenchmark:
+    """Bytes per stored exchange: the old per-turn dict vs the slotted Exchange"""
+    
+    def __init__(self, exchanges=20000):
+        self.exchanges = exchanges
+    
+    def analysis(self, i):
+        # Fresh strings and keyword dicts per turn, as process_text produces them
+        text, sentiment, topic = TURNS[i % len(TURNS)]
+        text = f"{text} ({i})"
+        return text, {
+            'sentiment': {'sentiment': sentiment, 'confidence': 0.87},
+            'topic_category': topic,
+            'keywords': lexicon.scan(text).categories('topic.'),
+            'response_type': 'exploration'
+        }, f"{RESPONSE} ({i})"
+    
+    def as_dict(self, i, text, nlp_analysis, ai_response):
+        return {
+            'timestamp': datetime.now(),
+            'message_id': i,
+            'user_input': text,
+            'sentiment': nlp_analysis.get('sentiment', {}).get('sentiment', 'neutral'),
+            'confidence': nlp_analysis.get('sentiment', {}).get('confidence', 0.5),
+            'topic_category': nlp_analysis.get('topic_category', 'general'),
+            'keywords': nlp_analysis.get('keywords', {}),
+            'ai_response': ai_response,
+            'response_type': nlp_analysis.get('response_type', 'exploration')
+        }
+    
+    def as_exchange(self, i, text, nlp_analysis, ai_response):
+        return Exchange(
+            created=time.time(),
+            message_id=i,
+            user_input=text,
+            sentiment=nlp_analysis.get('sentiment', {}).get('sentiment', 'neutral'),
+            confidence=nlp_analysis.get('sentiment', {}).get('confidence', 0.5),
+            topic_category=nlp_analysis.get('topic_category', 'general'),
+            keywords=nlp_analysis.get('keywords', {}),
+            ai_response=ai_response,
+            response_type=nlp_analysis.get('response_type', 'exploration')
+        )
+    
+    def measure(self, build):
+        """Bytes retained per exchange, including its text, once the NLP results are dropped"""
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        history = []
+        for i in range(self.exchanges):
+            history.append(build(i, *self.analysis(i)))
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        return retained / len(history)
+    
+    def text_bytes(self):
+        """Bytes per exchange spent on the user and AI text alone"""
+        total = 0
+        for i in range(self.exchanges):
+            text, _, ai_response = self.analysis(i)
+            total += sys.getsizeof(text) + sys.getsizeof(ai_response)
+        return total / self.exchanges
+    
+    def run(self):
+        print(f"🧪 Exchange memory benchmark ({self.exchanges} exchanges)")
+        print("=" * 50)
+        
+        as_dict = self.measure(self.as_dict)
+        slotted = self.measure(self.as_exchange)
+        text = self.text_bytes()
+        
+        print(f"\n   🐢 dict per exchange:      {as_dict:.0f} bytes ({as_dict - text:.0f} excluding text)")
+        print(f"   ⚡ Exchange per exchange:  {slotted:.0f} bytes ({slotted - text:.0f} excluding text)")
+        print(f"   📊 saved: {as_dict - slotted:.0f} bytes per exchange ({(1 - slotted / as_dict) * 100:.0f}%), "
+              f"{(as_dict - text) / (slotted - text):.2f}x less overhead")
+        
+        return {'dict_bytes': as_dict, 'exchange_bytes': slotted, 'text_bytes': text}
+
+if __name__ == "__main__":
+    ExchangeMemoryBenchmark().run()
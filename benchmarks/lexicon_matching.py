@@ -0,0 +1,89 @@
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from lexicon import VOCABULARIES, lexicon
+
+SENTENCES = [
+    "Hi, I have been feeling overwhelmed at work and my boss keeps adding deadlines.",
+    "I'm worried about my relationship with my partner and my family.",
+    "Some days I feel hopeless and empty, like nothing I do is good enough.",
+    "Can you suggest any strategies for dealing with panic before meetings?",
+    "I had a wonderful weekend and felt happy for the first time in a while.",
+    "My mind keeps racing and I'm overthinking every conversation with colleagues.",
+    "I'm exhausted and I think I'm heading toward burnout in my career.",
+    "What should I do when the anxiety gets this bad at night?"
+]
+
+class LexiconMatchingBenchmark:
+    """Compare the compiled lexicon against the per-call-site substring loops it replaced"""
+    
+    def __init__(self, transcript_sentences=(10, 100, 1000), runs=20):
+        self.transcript_sentences = transcript_sentences
+        self.runs = runs
+        self.patterns = {category: [p.rstrip('*') for p in patterns] for category, patterns in VOCABULARIES.items()}
+        self.word_patterns = {
+            category: [(p.rstrip('*'), re.compile(r'\b' + re.escape(p.rstrip('*')) + ('' if p.endswith('*') else r'\b'))) for p in patterns]
+            for category, patterns in VOCABULARIES.items()
+        }
+    
+    def transcript(self, sentences):
+        rng = random.Random(sentences)
+        return ' '.join(rng.choice(SENTENCES) for _ in range(sentences))
+    
+    def substring_loops(self, text):
+        """One nested `in` loop per vocabulary, as every call site used to do"""
+        text_lower = text.lower()
+        found = {}
+        for category, keywords in self.patterns.items():
+            for keyword in keywords:
+                if keyword in text_lower:
+                    found.setdefault(category, []).append(keyword)
+        return found
+    
+    def word_boundary_loops(self, text):
+        """The same loops with a word-boundary regex per keyword, matching the lexicon's semantics"""
+        text_lower = text.lower()
+        found = {}
+        for category, keywords in self.word_patterns.items():
+            for keyword, pattern in keywords:
+                if pattern.search(text_lower):
+                    found.setdefault(category, []).append(keyword)
+        return found
+    
+    def time_it(self, fn, text):
+        start = time.perf_counter()
+        for _ in range(self.runs):
+            fn(text)
+        return (time.perf_counter() - start) / self.runs
+    
+    def run(self):
+        print(f"🧪 Lexicon matching benchmark ({sum(len(p) for p in VOCABULARIES.values())} patterns, {self.runs} runs)")
+        print("=" * 50)
+        
+        results = {}
+        for sentences in self.transcript_sentences:
+            text = self.transcript(sentences)
+            loops = self.time_it(self.substring_loops, text)
+            word_loops = self.time_it(self.word_boundary_loops, text)
+            scan = self.time_it(lexicon.scan, text)
+            results[sentences] = {'substring_loops': loops, 'word_boundary_loops': word_loops, 'lexicon': scan}
+            print(f"\n{sentences} sentences ({len(text)} chars):")
+            print(f"   🐢 substring loops:     {loops * 1000:.3f} ms")
+            print(f"   🐢 word-boundary loops: {word_loops * 1000:.3f} ms")
+            print(f"   ⚡ lexicon scan:        {scan * 1000:.3f} ms")
+            print(f"   📊 speedup: {loops / scan:.2f}x vs substring, {word_loops / scan:.2f}x vs word-boundary")
+        
+        # Word boundaries: substring loops report keywords hidden inside other words
+        sample = "This is the thing about whoever said nothing"
+        print(f"\n🔍 '{sample}'")
+        print(f"   substring loops: {self.substring_loops(sample)}")
+        print(f"   lexicon scan:    {lexicon.scan(sample).categories()}")
+        return results
+
+if __name__ == "__main__":
+    LexiconMatchingBenchmark().run()
@@ -0,0 +1,83 @@
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from sentiment import sentiment_analyzer
+
+SAMPLE_UTTERANCES = [
+    "I have been feeling very anxious about work lately",
+    "It keeps me up at night and I feel overwhelmed",
+    "I worry that I am falling behind my colleagues",
+    "Things are a bit better this week, I went for a walk every day",
+    "I don't know, I guess I'm fine",
+    "My partner and I keep arguing about small things",
+    "thanks, that actually helps a lot",
+    "I feel empty and I can't focus on anything",
+    "yes",
+    "I finally talked to my boss and it went really well!"
+]
+
+class SentimentBackendBenchmark:
+    def __init__(self, backends=('pytorch', 'onnx', 'onnx-int8'), repeats=20):
+        self.backends = backends
+        self.repeats = repeats
+    
+    def scores(self, classifier, text):
+        return {item['label']: item['score'] for item in classifier(text)[0]}
+    
+    def check_parity(self, reference, candidate):
+        """Compare top labels and per-label scores against the PyTorch pipeline"""
+        agreements = 0
+        max_diff = 0.0
+        for text in SAMPLE_UTTERANCES:
+            expected = self.scores(reference, text)
+            actual = self.scores(candidate, text)
+            if max(expected, key=expected.get) == max(actual, key=actual.get):
+                agreements += 1
+            max_diff = max(max_diff, max(abs(expected[label] - actual[label]) for label in expected))
+        return agreements / len(SAMPLE_UTTERANCES), max_diff
+    
+    def measure_latency(self, classifier):
+        latencies = []
+        for _ in range(self.repeats):
+            for text in SAMPLE_UTTERANCES:
+                start = time.perf_counter()
+                classifier(text)
+                latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        
+        start = time.perf_counter()
+        for _ in range(self.repeats):
+            classifier(SAMPLE_UTTERANCES, batch_size=len(SAMPLE_UTTERANCES))
+        batch_throughput = self.repeats * len(SAMPLE_UTTERANCES) / (time.perf_counter() - start)
+        
+        return {
+            'p50_ms': statistics.median(latencies),
+            'p95_ms': latencies[int(len(latencies) * 0.95)],
+            'batch_texts_per_second': batch_throughput
+        }
+    
+    def run(self):
+        print("🧪 Sentiment backend parity and latency")
+        print("=" * 50)
+        
+        classifiers = {backend: sentiment_analyzer._load_backend(backend) for backend in self.backends}
+        reference = classifiers['pytorch']
+        
+        for backend, classifier in classifiers.items():
+            for text in SAMPLE_UTTERANCES:
+                classifier(text)  # warm up
+            latency = self.measure_latency(classifier)
+            print(f"\n{backend}:")
+            print(f"   ⏱  p50 {latency['p50_ms']:.1f} ms, p95 {latency['p95_ms']:.1f} ms")
+            print(f"   📈 Batched throughput: {latency['batch_texts_per_second']:.1f} texts/s")
+            if classifier is not reference:
+                agreement, max_diff = self.check_parity(reference, classifier)
+                status = "✅" if agreement == 1.0 else "⚠️"
+                print(f"   {status} Label agreement with pytorch: {agreement:.0%}, max score diff {max_diff:.4f}")
+
+if __name__ == "__main__":
+    SentimentBackendBenchmark().run()
@@ -0,0 +1,166 @@
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+MESSAGES = [
+    "I have been feeling overwhelmed at work and my boss keeps adding deadlines",
+    "I'm worried about my relationship with my partner",
+    "Some days I feel hopeless and empty",
+    "Can you suggest any strategies for dealing with panic before meetings?",
+    "I had a wonderful weekend and felt happy for the first time in a while"
+]
+
+class SessionStressBenchmark:
+    """
+    Many threads adding exchanges to a few shared sessions at once, then checking
+    that no update was lost: every session's message_count equals the requests
+    that succeeded for it, and its message ids run 0..n-1 with no gaps.
+
+    With a server URL (python session_stress.py http://localhost:5000) the
+    requests go to /text-therapy; without one, straight to the session manager.
+    """
+    
+    def __init__(self, url=None, threads=32, sessions=8, requests_per_thread=50):
+        self.url = url.rstrip('/') if url else None
+        self.threads = threads
+        self.sessions = sessions
+        self.requests_per_thread = requests_per_thread
+        
+        if self.url is None:
+            from session_manager import SessionManager
+            self.manager = SessionManager(idle_ttl=0)
+    
+    def post(self, path, payload=None):
+        request = urllib.request.Request(
+            self.url + path,
+            data=json.dumps(payload or {}).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=300) as response:
+            return json.loads(response.read())
+    
+    def get(self, path):
+        with urllib.request.urlopen(self.url + path, timeout=60) as response:
+            return json.loads(response.read())
+    
+    def start_session(self):
+        if self.url:
+            return self.post('/start-therapy-session')['session_id']
+        return self.manager.create_session()
+    
+    def send(self, session_id, text):
+        """One exchange; returns True if it was recorded"""
+        if self.url:
+            return self.post('/text-therapy', {'text': text, 'session_id': session_id}).get('success', False)
+        
+        session = self.manager.get_session(session_id)
+        if session is None:
+            return False
+        nlp_result = {'sentiment': {'sentiment': random.choice(['positive', 'negative', 'neutral'])}, 'topic_category': 'general'}
+        session.add_exchange(text, nlp_result, "I hear you.")
+        # Readers run alongside the writers
+        session.get_conversation_context()
+        session.generate_session_summary()
+        return True
+    
+    def message_count(self, session_id):
+        if self.url:
+            return self.get(f'/session-status/{session_id}')['session_status']['message_count']
+        return self.manager.get_session(session_id).message_count
+    
+    def message_ids(self, session_id):
+        if self.url:
+            return None  # Only the count is visible over HTTP
+        return [exchange.message_id for exchange in self.manager.get_session(session_id).conversation_history]
+    
+    def worker(self, session_ids, counts, counts_lock, latencies):
+        for i in range(self.requests_per_thread):
+            session_id = random.choice(session_ids)
+            start = time.perf_counter()
+            try:
+                recorded = self.send(session_id, f"{random.choice(MESSAGES)} ({i})")
+            except Exception as e:
+                print(f"   ⚠️ request failed: {e}")
+                recorded = False
+            latencies.append(time.perf_counter() - start)
+            if recorded:
+                with counts_lock:
+                    counts[session_id] += 1
+    
+    def churn(self, stop, results):
+        """Create and end unrelated sessions, racing two enders per session"""
+        while not stop.is_set():
+            session_id = self.manager.create_session()
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                summaries = list(pool.map(self.manager.end_session, [session_id, session_id]))
+            results.append(sum(summary is not None for summary in summaries))
+    
+    def run(self):
+        target = self.url or 'in-process SessionManager'
+        print(f"🧪 Session stress test ({self.threads} threads x {self.requests_per_thread} requests on {self.sessions} sessions, {target})")
+        print("=" * 50)
+        
+        session_ids = [self.start_session() for _ in range(self.sessions)]
+        counts = {session_id: 0 for session_id in session_ids}
+        counts_lock = threading.Lock()
+        latencies = []
+        churn_results = []
+        stop_churn = threading.Event()
+        
+        # In-process only: ending sessions over HTTP would need the server's cooperation
+        churner = None
+        if not self.url:
+            churner = threading.Thread(target=self.churn, args=(stop_churn, churn_results), daemon=True)
+            churner.start()
+        start = time.perf_counter()
+        threads = [
+            threading.Thread(target=self.worker, args=(session_ids, counts, counts_lock, latencies))
+            for _ in range(self.threads)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stop_churn.set()
+        if churner:
+            churner.join()
+        
+        violations = []
+        for session_id in session_ids:
+            recorded = self.message_count(session_id)
+            if recorded != counts[session_id]:
+                violations.append(f"{session_id}: message_count {recorded}, expected {counts[session_id]}")
+            message_ids = self.message_ids(session_id)
+            if message_ids is not None and message_ids != list(range(len(message_ids))):
+                violations.append(f"{session_id}: message ids out of order or duplicated")
+        double_ends = sum(1 for ended in churn_results if ended != 1)
+        if double_ends:
+            violations.append(f"{double_ends} sessions ended more than once (or never)")
+        
+        total = sum(counts.values())
+        latencies.sort()
+        print(f"\n   ⚡ throughput: {total / elapsed:.1f} requests/s ({total} recorded in {elapsed:.2f}s)")
+        print(f"   ⏱️ latency p50 {statistics.median(latencies) * 1000:.2f} ms, p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f} ms")
+        if not self.url:
+            print(f"   🔁 {len(churn_results)} sessions created and raced to end_session alongside")
+        if violations:
+            print(f"   ❌ {len(violations)} invariant violations:")
+            for violation in violations:
+                print(f"      {violation}")
+        else:
+            print("   ✅ all invariants held")
+        
+        return {'requests_per_second': total / elapsed, 'violations': violations}
+
+if __name__ == "__main__":
+    SessionStressBenchmark(sys.argv[1] if len(sys.argv) > 1 else None).run()
@@ -0,0 +1,84 @@
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import speech_recognition as sr
+from stt_backends import STT_BACKENDS
+
+SAMPLE_SENTENCE = "I have been feeling anxious about work and I cannot sleep at night"
+
+class STTBackendBenchmark:
+    """
+    Transcribes the same recording with each speech-to-text backend and reports
+    load time, per-call latency and the text each one heard. Pass a WAV file to
+    use a real recording; otherwise a sentence is synthesized with pyttsx3.
+    """
+    
+    def __init__(self, wav_path=None, backends=tuple(STT_BACKENDS), repeats=5):
+        self.wav_path = wav_path
+        self.backends = backends
+        self.repeats = repeats
+    
+    def synthesize(self):
+        import pyttsx3
+        
+        path = os.path.join(tempfile.mkdtemp(), 'sample.wav')
+        engine = pyttsx3.init()
+        engine.save_to_file(SAMPLE_SENTENCE, path)
+        engine.runAndWait()
+        return path
+    
+    def load_audio(self):
+        path = self.wav_path or self.synthesize()
+        with sr.AudioFile(path) as source:
+            return sr.Recognizer().record(source)
+    
+    def measure(self, name, audio):
+        start = time.perf_counter()
+        try:
+            backend = STT_BACKENDS[name]()
+        except Exception as e:
+            return {'error': f"not available: {e}"}
+        load_seconds = time.perf_counter() - start
+        
+        latencies = []
+        text = None
+        for _ in range(self.repeats):
+            start = time.perf_counter()
+            try:
+                text = backend.transcribe(audio)
+            except (sr.UnknownValueError, sr.RequestError) as e:
+                text = f"<{type(e).__name__}: {e}>"
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        return {
+            'load_seconds': load_seconds,
+            'p50_ms': statistics.median(latencies),
+            'max_ms': latencies[-1],
+            'text': text
+        }
+    
+    def run(self):
+        audio = self.load_audio()
+        seconds = len(audio.frame_data) / (audio.sample_rate * audio.sample_width)
+        print(f"🎙️ Speech-to-text backend benchmark ({seconds:.1f}s of audio, {self.repeats} runs each)")
+        print("=" * 50)
+        
+        results = {}
+        for name in self.backends:
+            result = results[name] = self.measure(name, audio)
+            if 'error' in result:
+                print(f"\n   ⚠️ {name}: {result['error']}")
+                continue
+            print(f"\n   {name}: load {result['load_seconds']:.2f}s, "
+                  f"p50 {result['p50_ms']:.0f} ms, max {result['max_ms']:.0f} ms "
+                  f"(real-time factor {result['p50_ms'] / 1000 / seconds:.2f})")
+            print(f"      heard: {result['text']}")
+        return results
+
+if __name__ == "__main__":
+    STTBackendBenchmark(sys.argv[1] if len(sys.argv) > 1 else None).run()
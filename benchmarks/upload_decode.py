@@ -0,0 +1,74 @@
+import io
+import os
+import sys
+import time
+import tracemalloc
+import wave
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import speech_recognition as sr
+from speech_to_text import decode_upload
+
+class UploadDecodeBenchmark:
+    """
+    Decoding a browser WAV upload into sr.AudioData: reading the whole body and
+    unpacking it with the wave module, against decode_upload reading straight
+    into the reused per-thread buffer. Reports time and peak allocation per upload.
+    """
+    
+    def __init__(self, seconds=30, sample_rate=16000, uploads=50):
+        self.uploads = uploads
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(sample_rate)
+            wav.writeframes(os.urandom(seconds * sample_rate * 2))
+        self.upload = buffer.getvalue()
+        self.seconds = seconds
+    
+    def chunks(self, size=16 * 1024):
+        """The upload as it arrives from a chunked request"""
+        for start in range(0, len(self.upload), size):
+            yield self.upload[start:start + size]
+    
+    def naive_decode(self):
+        body = b''
+        for chunk in self.chunks():
+            body += chunk
+        with wave.open(io.BytesIO(body), 'rb') as wav:
+            return sr.AudioData(wav.readframes(wav.getnframes()), wav.getframerate(), wav.getsampwidth())
+    
+    def buffered_decode(self):
+        audio = decode_upload(self.chunks(), 'audio/wav')
+        audio.frame_data.release()
+        return audio
+    
+    def measure(self, decode):
+        decode()  # Warm-up; the buffered path allocates its buffer here
+        tracemalloc.start()
+        start = time.perf_counter()
+        for _ in range(self.uploads):
+            decode()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return elapsed / self.uploads, peak
+    
+    def run(self):
+        print(f"🎙️ Upload decode benchmark ({self.seconds}s WAV, {len(self.upload) / 1024:.0f} KiB, {self.uploads} uploads)")
+        print("=" * 50)
+        
+        results = {}
+        for name, decode in [('read + wave', self.naive_decode), ('decode_upload', self.buffered_decode)]:
+            per_upload, peak = self.measure(decode)
+            results[name] = {'ms_per_upload': per_upload * 1000, 'peak_kib': peak / 1024}
+            print(f"   {name:>14}: {per_upload * 1000:7.2f} ms/upload, peak {peak / 1024:8.0f} KiB")
+        
+        saved = results['read + wave']['peak_kib'] - results['decode_upload']['peak_kib']
+        print(f"\n   💾 {saved:.0f} KiB less allocated per upload")
+        return results
+
+if __name__ == "__main__":
+    UploadDecodeBenchmark().run()
@@ -0,0 +1,89 @@
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from voice_stream import AudioRingBuffer, UtteranceDetector
+
+class VoiceStreamBenchmark:
+    """
+    Buffering a streamed voice session: appending every WebSocket frame to a
+    per-utterance bytes object and slicing 30 ms frames out of it, against
+    writing frames into the connection's preallocated ring buffer and reading
+    frames back as memoryviews. Speech detection is left out of both so only
+    the buffering is measured. Reports time and allocation per second of audio.
+    """
+    
+    def __init__(self, seconds=120, sample_rate=16000, chunk_ms=20, utterance_seconds=10):
+        self.seconds = seconds
+        self.sample_rate = sample_rate
+        self.frame_bytes = UtteranceDetector.frame_bytes_for(sample_rate)
+        self.chunk = os.urandom(sample_rate * 2 * chunk_ms // 1000)
+        self.chunks = seconds * 1000 // chunk_ms
+        self.utterance_bytes = utterance_seconds * sample_rate * 2
+    
+    def naive(self):
+        pending = b''
+        position = 0
+        frames = utterance_bytes = 0
+        for _ in range(self.chunks):
+            pending += self.chunk
+            while len(pending) - position >= self.frame_bytes:
+                frame = pending[position:position + self.frame_bytes]
+                position += self.frame_bytes
+                frames += len(frame) > 0
+            if len(pending) >= self.utterance_bytes:
+                utterance = pending[:position]
+                utterance_bytes += len(utterance)
+                pending, position = pending[position:], 0
+        return frames, utterance_bytes
+    
+    def ring(self):
+        ring = AudioRingBuffer(self.utterance_bytes * 2, self.frame_bytes)
+        start = position = 0
+        frames = utterance_bytes = 0
+        for _ in range(self.chunks):
+            ring.write(self.chunk)
+            while ring.written - position >= self.frame_bytes:
+                frame = ring.frame(position)
+                position += self.frame_bytes
+                frames += len(frame) > 0
+            if ring.written - start >= self.utterance_bytes:
+                utterance = ring.copy(start, position)
+                utterance_bytes += len(utterance)
+                start = position
+        return frames, utterance_bytes
+    
+    def measure(self, buffer):
+        started = time.perf_counter()
+        frames, utterance_bytes = buffer()
+        elapsed = time.perf_counter() - started
+        
+        # Traced separately; tracing slows every allocation down
+        tracemalloc.start()
+        buffer()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {'ms_per_audio_second': elapsed * 1000 / self.seconds, 'peak_kib': peak / 1024,
+                'frames': frames, 'utterance_bytes': utterance_bytes}
+    
+    def run(self):
+        print(f"🎙️ Voice stream buffering benchmark ({self.seconds}s of {self.sample_rate} Hz audio, {len(self.chunk)}-byte frames)")
+        print("=" * 50)
+        
+        results = {}
+        for name, buffer in [('bytes append', self.naive), ('ring buffer', self.ring)]:
+            result = results[name] = self.measure(buffer)
+            print(f"   {name:>12}: {result['ms_per_audio_second']:6.3f} ms per second of audio, "
+                  f"peak {result['peak_kib']:6.0f} KiB ({result['frames']} frames)")
+        
+        # Both must have cut out the same audio for the timings to be comparable
+        assert results['bytes append']['utterance_bytes'] == results['ring buffer']['utterance_bytes']
+        speedup = results['bytes append']['ms_per_audio_second'] / max(results['ring buffer']['ms_per_audio_second'], 1e-9)
+        print(f"\n   ⚡ {speedup:.1f}x faster buffering")
+        return results
+
+if __name__ == "__main__":
+    VoiceStreamBenchmark().run()